@@ -1,6 +1,10 @@
 import sqlite3
+import argparse
 import pandas as pd
 import math
+import xlsxwriter
+
+from sqlite_sink import user_tables
 
 # Database and Excel file details
 DATABASE_FILE = "Products.db"
@@ -12,16 +16,13 @@ def export_to_excel_split(db_file, excel_file, row_limit=ROW_LIMIT):
     try:
         # Connect to the database
         conn = sqlite3.connect(db_file)
-        cursor = conn.cursor()
 
-        # Get all table names in the database
-        cursor.execute("SELECT name FROM sqlite_master WHERE type='table';")
-        tables = cursor.fetchall()
+        # Get all table names in the database, without the search index
+        tables = user_tables(conn)
 
         # Initialize a Pandas Excel writer
         with pd.ExcelWriter(excel_file, engine='xlsxwriter') as writer:
             for table_name in tables:
-                table_name = table_name[0]
                 # Load the table into a Pandas DataFrame
                 df = pd.read_sql_query(f"SELECT * FROM {table_name}", conn)
 
@@ -50,5 +51,78 @@ def export_to_excel_split(db_file, excel_file, row_limit=ROW_LIMIT):
         # Close the database connection
         conn.close()
 
+def excel_value(value):
+    """A cell value xlsxwriter can write; BLOBs become a size placeholder."""
+    if isinstance(value, bytes):
+        return f"<{len(value)} bytes>"
+    return value
+
+def export_to_excel_streaming(db_file, excel_file, row_limit=ROW_LIMIT, chunk_size=2000, hyperlinks=False):
+    """Export every table to Excel sheets of `row_limit` rows in constant memory.
+
+    Rows are read from a SQLite cursor `chunk_size` at a time and written
+    through xlsxwriter's constant_memory mode, which flushes each row to disk
+    as soon as the next one starts. Peak memory therefore depends on the
+    chunk size and the number of columns, not on the size of the table.
+    Sheets are split and named exactly as in export_to_excel_split.
+
+    URLs are written as plain text unless `hyperlinks` is set: xlsxwriter
+    keeps every hyperlink in memory until the workbook is closed, which would
+    make memory grow with the number of URL cells again.
+    """
+    conn = sqlite3.connect(db_file)
+    try:
+        tables = user_tables(conn)
+
+        workbook = xlsxwriter.Workbook(excel_file, {"constant_memory": True, "strings_to_urls": hyperlinks})
+        header_format = workbook.add_format({"bold": True, "border": 1, "align": "center", "valign": "top"})
+        try:
+            for table_name in tables:
+                cursor = conn.execute(f'SELECT * FROM "{table_name}"')
+                columns = [description[0] for description in cursor.description]
+                sheet_num = 0
+                worksheet = None
+                sheet_row = row_limit  # Start a sheet on the first row
+
+                while True:
+                    rows = cursor.fetchmany(chunk_size)
+                    if not rows:
+                        break
+                    for row in rows:
+                        if sheet_row == row_limit:
+                            if worksheet is not None:
+                                print(f"Exported rows {(sheet_num - 1) * row_limit} to {sheet_num * row_limit} "
+                                      f"of table '{table_name}' to sheet '{worksheet.name}'")
+                            sheet_num += 1
+                            worksheet = workbook.add_worksheet(f"{table_name}_{sheet_num}")
+                            worksheet.write_row(0, 0, columns, header_format)
+                            sheet_row = 0
+                        sheet_row += 1
+                        worksheet.write_row(sheet_row, 0, [excel_value(value) for value in row])
+
+                if worksheet is not None:
+                    start_row = (sheet_num - 1) * row_limit
+                    print(f"Exported rows {start_row} to {start_row + sheet_row} "
+                          f"of table '{table_name}' to sheet '{worksheet.name}'")
+        finally:
+            workbook.close()
+
+        print(f"Data successfully exported to {excel_file}")
+
+    finally:
+        conn.close()
+
 if __name__ == "__main__":
-    export_to_excel_split(DATABASE_FILE, EXCEL_FILE)
+    parser = argparse.ArgumentParser(description="Export every table of a SQLite database to Excel.")
+    parser.add_argument("--db", default=DATABASE_FILE)
+    parser.add_argument("--output", default=EXCEL_FILE)
+    parser.add_argument("--legacy", action="store_true",
+                        help="load each table into pandas first (the previous, memory-hungry exporter)")
+    parser.add_argument("--hyperlinks", action="store_true",
+                        help="write URLs as clickable links (memory then grows with the number of URLs)")
+    args = parser.parse_args()
+
+    if args.legacy:
+        export_to_excel_split(args.db, args.output)
+    else:
+        export_to_excel_streaming(args.db, args.output, hyperlinks=args.hyperlinks)
@@ -0,0 +1,1341 @@
+import argparse
+import ast
+import contextlib
+import hashlib
+import importlib.util
+import io
+import json
+import os
+import signal
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import traceback
+import tracemalloc
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import closing
+from functools import partial
+
+import requests
+
+import columnar_export
+import error_log
+import extractor
+import image_store
+import metrics
+from concurrency import AdaptiveLimiter, submit_bounded
+import page_archive
+import search_index
+import spec_store
+import variants
+from fixture_server import start_fixture_server, start_fake_proxies, create_url_db, product_page
+from proxy_scheduler import ProxyScheduler
+from session_pool import SessionPool
+from sqlite_sink import close_sinks, get_sink
+from url_store import RetryPolicy, ensure_url_columns, iter_url_rows, retry_stats, revive_dead
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+def load_script(filename, module_name):
+    """Import one of the hyphenated scraper scripts as a module."""
+    spec = importlib.util.spec_from_file_location(module_name, os.path.join(HERE, filename))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def count_rows(db_name, table):
+    with closing(sqlite3.connect(db_name)) as conn:
+        return conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+
+# Fetch engines: thread pool vs asyncio against the local stand-in server
+def bench_fetch(args):
+    server, base_url = start_fixture_server(latency=args.latency)
+    print(f"Fixture server at {base_url}, {args.urls} URLs, {args.latency * 1000:.0f} ms latency")
+
+    runs = [("threads", {"batch_size": args.threads}),
+            ("pipeline", {"batch_size": args.threads, "parsers": args.parsers})]
+    runs += [("async", {"concurrency": c}) for c in args.concurrency]
+
+    for mode, options in runs:
+        with tempfile.TemporaryDirectory() as workdir:
+            os.chdir(workdir)
+            scraper = load_script("prducts-fast.py", "prducts_fast")
+            create_url_db("Models.db", base_url, args.urls)
+
+            start = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):
+                scraper.process_urls_from_db(url_db_name="Models.db", url_table="models_urls",
+                                             url_column="url", mode=mode, **options)
+            elapsed = time.perf_counter() - start
+
+            stored = count_rows("products.db", "products")
+            label = ", ".join(f"{key}={value}" for key, value in options.items())
+            print(f"{mode:8} {label:32} {stored:6} pages in {elapsed:7.2f}s  "
+                  f"{stored / elapsed:8.1f} pages/s")
+            os.chdir(HERE)
+
+    server.shutdown()
+
+# Keep-alive session pool vs a fresh requests.get per URL
+def bench_sessions(args):
+    server, base_url = start_fixture_server(latency=args.latency)
+    urls = [f"{base_url}/product/{n}" for n in range(args.urls)]
+    ports = list(range(8001, 8001 + args.ports))
+
+    def bare_get(i, url):
+        return requests.get(url, timeout=10)
+
+    pool = SessionPool()
+
+    def pooled_get(i, url):
+        with pool.session(ports[i % len(ports)]) as session:
+            return session.get(url, timeout=10)
+
+    for label, get in (("requests.get", bare_get), ("session pool", pooled_get)):
+        connections_before = server.connections
+        latencies = []
+
+        def timed(i, url):
+            start = time.perf_counter()
+            get(i, url).content
+            latencies.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.threads) as executor:
+            list(executor.map(timed, range(len(urls)), urls))
+        elapsed = time.perf_counter() - start
+
+        latencies.sort()
+        print(f"{label:13} {len(urls) / elapsed:8.1f} req/s  "
+              f"p50 {latencies[len(latencies) // 2] * 1000:6.2f} ms  "
+              f"p95 {latencies[int(len(latencies) * 0.95)] * 1000:6.2f} ms  "
+              f"handshakes {server.connections - connections_before}")
+
+    print(f"Session pool stats: {pool.stats()}")
+    pool.close()
+    server.shutdown()
+
+# Proxy port selection against fake proxies that inject failures
+class LinearRotation:
+    """The previous behaviour: start at `i % 100`, then `port += 1` on failure."""
+
+    def __init__(self, ports):
+        self.ports = list(ports)
+        self.lock = threading.Lock()
+        self.started = 0
+        self.attempts = 0
+        self.failures = 0
+
+    def acquire(self, previous=None):
+        with self.lock:
+            self.attempts += 1
+            if previous is None:
+                self.started += 1
+                return self.ports[(self.started - 1) % min(100, len(self.ports))]
+            return self.ports[(self.ports.index(previous) + 1) % len(self.ports)]
+
+    def report(self, port, ok, latency=None):
+        if not ok:
+            with self.lock:
+                self.failures += 1
+
+    def stats(self):
+        return {"attempts": self.attempts, "failures": self.failures}
+
+def bench_proxies(args):
+    server, base_url = start_fixture_server()
+    proxies = start_fake_proxies(args.proxies, dead=args.dead, slow=args.slow, flaky=args.flaky)
+    ports = sorted(proxies)
+    behaviours = [proxy.behaviour for proxy in proxies.values()]
+    print(f"{args.urls} URLs through {len(ports)} fake proxies: "
+          + ", ".join(f"{b} {behaviours.count(b)}" for b in ("healthy", "slow", "flaky", "dead")))
+
+    for label, scheduler in (("linear", LinearRotation(ports)),
+                             ("scheduler", ProxyScheduler(ports, cooldown=5.0))):
+        with tempfile.TemporaryDirectory() as workdir:
+            os.chdir(workdir)
+            scraper = load_script("prducts-fast.py", "prducts_fast")
+            scraper.get_proxies = lambda port: {"http": f"http://127.0.0.1:{port}"}
+            scraper.proxy_scheduler = scheduler
+            create_url_db("Models.db", base_url, args.urls)
+
+            start = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):
+                scraper.process_urls_from_db(url_db_name="Models.db", url_table="models_urls",
+                                             url_column="url", batch_size=args.threads)
+            elapsed = time.perf_counter() - start
+
+            stored = count_rows("products.db", "products")
+            stats = scheduler.stats()
+            print(f"{label:10} {stored:5} stored in {elapsed:6.2f}s  attempts {stats['attempts']:6}  "
+                  f"wasted {stats['failures']:6} ({stats['failures'] / stats['attempts']:.1%})")
+            os.chdir(HERE)
+
+    server.shutdown()
+
+# Adaptive concurrency against a server that throttles above its capacity
+class FixedLimiter:
+    """No limit beyond the thread pool, i.e. the previous behaviour."""
+
+    limit = maximum = float("inf")
+
+    @contextlib.contextmanager
+    def slot(self):
+        yield
+
+    def record(self, status_code=None, latency=None, retry_after=None):
+        pass
+
+    def stats(self):
+        return {}
+
+def bench_adaptive(args):
+    server, base_url = start_fixture_server(latency=args.latency, capacity=args.capacity,
+                                            retry_after=args.retry_after)
+    print(f"Server capacity {args.capacity} concurrent requests, {args.threads} worker threads")
+
+    for label, limiter in (("fixed", FixedLimiter()),
+                           ("adaptive", AdaptiveLimiter(initial=10, maximum=args.threads))):
+        with tempfile.TemporaryDirectory() as workdir:
+            os.chdir(workdir)
+            scraper = load_script("prducts-fast.py", "prducts_fast")
+            scraper.concurrency_limiter = limiter
+            create_url_db("Models.db", base_url, args.urls)
+            throttled_before = server.throttled
+
+            start = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):
+                scraper.process_urls_from_db(url_db_name="Models.db", url_table="models_urls",
+                                             url_column="url", batch_size=args.threads)
+            elapsed = time.perf_counter() - start
+
+            stored = count_rows("products.db", "products")
+            print(f"{label:9} {stored:5} stored in {elapsed:6.2f}s  {stored / elapsed:7.1f} pages/s  "
+                  f"429s {server.throttled - throttled_before:6}  {limiter.stats()}")
+            os.chdir(HERE)
+
+    server.shutdown()
+
+# Incremental recrawl: conditional requests and content hashes vs a full crawl
+def bench_recrawl(args):
+    server, base_url = start_fixture_server(latency=args.latency)
+    print(f"{args.urls} URLs, {args.changed:.0%} of pages change between crawls")
+
+    with tempfile.TemporaryDirectory() as workdir:
+        os.chdir(workdir)
+        create_url_db("Models.db", base_url, args.urls)
+        runs = [("full crawl", {}, True),
+                ("incremental", {"incremental": True}, True),
+                ("hash only", {"incremental": True}, False)]
+
+        for label, options, conditional in runs:
+            if options:
+                server.change_pages(range(0, args.urls, max(1, round(1 / args.changed))))
+            server.conditional = conditional
+            bytes_before, not_modified_before = server.bytes_sent, server.not_modified
+
+            scraper = load_script("prducts-fast.py", "prducts_fast")
+            metrics.REGISTRY.reset()
+            start = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):
+                scraper.process_urls_from_db(url_db_name="Models.db", url_table="models_urls",
+                                             url_column="url", batch_size=args.threads, **options)
+            elapsed = time.perf_counter() - start
+
+            print(f"{label:12} {elapsed:6.2f}s  {(server.bytes_sent - bytes_before) / 1024:8.0f} KiB  "
+                  f"304s {server.not_modified - not_modified_before:5}  "
+                  f"rows {count_rows('products.db', 'products'):5}  {metrics.PAGES.snapshot()}")
+        os.chdir(HERE)
+
+    server.shutdown()
+
+# Failing URLs: immediate retries on every run vs the persistent retry queue
+def break_fixture_pages(server, args):
+    """Break every n-th page of the fixture server; returns {behaviour: page numbers}."""
+    pages = {"gone": range(1, args.urls, round(1 / args.gone)),
+             "no_specs": range(2, args.urls, round(1 / args.no_specs)),
+             "flaky": range(3, args.urls, round(1 / args.flaky))}
+    server.break_pages(pages["gone"], "gone")
+    server.break_pages(pages["no_specs"], "no_specs")
+    server.break_pages(pages["flaky"], args.flaky_failures)
+    return pages
+
+def next_retry_wait(db_name):
+    with closing(sqlite3.connect(db_name)) as conn:
+        due = conn.execute("SELECT MAX(next_attempt_at) FROM models_urls WHERE processed = 0").fetchone()[0]
+    return max(0.0, due - time.time()) if due else 0.0
+
+def run_retry_crawls(server, base_url, args, policy, retries, max_runs):
+    """Crawl until no URL is left to retry (or `max_runs`); yields per-run stats."""
+    with tempfile.TemporaryDirectory() as workdir:
+        os.chdir(workdir)
+        create_url_db("Models.db", base_url, args.urls)
+        break_fixture_pages(server, args)
+        wait = 0.0
+        for run in range(1, max_runs + 1):
+            time.sleep(wait)
+            scraper = load_script("prducts-fast.py", "prducts_fast")
+            scraper.retry_policy, scraper.retries_per_run = policy, retries
+            metrics.REGISTRY.reset()
+            start = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):
+                scraper.process_urls_from_db(url_db_name="Models.db", url_table="models_urls",
+                                             url_column="url", batch_size=args.threads)
+            elapsed = time.perf_counter() - start
+            stats = retry_stats("Models.db", "models_urls")
+            yield {"run": run, "waited": wait, "seconds": elapsed,
+                   "attempts": metrics.FETCH_ATTEMPTS.total(), "pages": metrics.PAGES.snapshot(),
+                   "stored": count_rows("products.db", "products"),
+                   "waiting": sum(stats["waiting"].values()), "dead": stats["dead"]}
+            # The first rerun is immediate, to show that backing-off URLs are skipped
+            wait = next_retry_wait("Models.db") if run > 1 else 0.0
+            if run > 1 and not stats["waiting"] and not count_rows("Models.db", "models_urls WHERE processed = 0"):
+                break
+        if policy.max_attempts < args.urls:
+            revived = revive_dead("Models.db", "models_urls", "parse")
+            print(f"Revived {revived} dead parse failures (python url_store.py revive --error parse)")
+        os.chdir(HERE)
+
+def bench_retries(args):
+    server, base_url = start_fixture_server(latency=args.latency)
+    print(f"{args.urls} URLs: {args.gone:.0%} gone (404), {args.no_specs:.0%} without a spec table, "
+          f"{args.flaky:.0%} failing {args.flaky_failures} times before they load")
+
+    # Before the retry queue every failure was retried 10 times at once, and
+    # every unprocessed URL again on the next run, 404s and all
+    legacy = RetryPolicy(base_delay=0.0, max_attempts=10 ** 9, permanent_statuses=(), parse_attempts=10 ** 9)
+    queue_policy = RetryPolicy(base_delay=args.base_delay, max_delay=60 * args.base_delay)
+    results = {}
+    for label, policy, retries in (("immediate", legacy, 10), ("retry queue", queue_policy, 3)):
+        print(f"\n{label}: {retries} attempts per URL per run")
+        total = 0
+        for stats in run_retry_crawls(server, base_url, args, policy, retries, args.runs):
+            total += stats["attempts"]
+            print(f"run {stats['run']} after {stats['waited']:4.1f}s  {stats['seconds']:5.2f}s  "
+                  f"attempts {stats['attempts']:5}  rows {stats['stored']:5}  backing off {stats['waiting']:4}  "
+                  f"dead {stats['dead']}  {stats['pages']}")
+        results[label] = total
+    server.shutdown()
+    print(f"\nFetch attempts over all runs: immediate {results['immediate']}, "
+          f"retry queue {results['retry queue']}")
+
+# Several worker processes sharing one URL DB: separate copies vs leased claims
+def start_workers(workdir, count, threads, lease_seconds=None, mode="threads"):
+    command = [sys.executable, os.path.join(HERE, "prducts-fast.py"), "--batch-size", str(threads),
+               "--mode", mode, "--concurrency", str(threads)]
+    workers = []
+    for index in range(count):
+        extra = ["--lease", "--worker-id", f"w{index}", "--lease-seconds", str(lease_seconds)] if lease_seconds else []
+        workers.append(subprocess.Popen(command + extra, cwd=workdir, stdout=subprocess.PIPE,
+                                        stderr=subprocess.DEVNULL, text=True))
+    return workers
+
+def wait_for_leases(db_name, worker_id):
+    """Block until `worker_id` holds leases on some URLs."""
+    while True:
+        try:
+            with closing(sqlite3.connect(db_name, timeout=30.0)) as conn:
+                if conn.execute("SELECT 1 FROM models_urls WHERE lease_owner = ? LIMIT 1", (worker_id,)).fetchone():
+                    return
+        except sqlite3.OperationalError:
+            pass  # The lease columns are not there yet
+        time.sleep(0.05)
+
+def worker_leases(output):
+    for line in output.splitlines():
+        if line.startswith("[DEBUG] Leases: "):
+            return ast.literal_eval(line[len("[DEBUG] Leases: "):])
+    return None
+
+def bench_workers(args):
+    server, base_url = start_fixture_server(latency=args.latency)
+    print(f"{args.urls} URLs, {args.mode} mode, {args.threads} threads per worker, "
+          f"{args.latency * 1000:.0f} ms latency")
+
+    runs = [("1 worker, leases", 1, args.lease_seconds, None),
+            (f"{args.workers} copies, no leases", args.workers, None, None),
+            (f"{args.workers} workers, leases", args.workers, args.lease_seconds, None),
+            (f"{args.workers} workers, 1 killed", args.workers, args.lease_seconds, args.kill_after)]
+    for label, count, lease_seconds, kill_after in runs:
+        with tempfile.TemporaryDirectory() as workdir:
+            create_url_db(os.path.join(workdir, "Models.db"), base_url, args.urls)
+            server.product_requests.clear()
+            start = time.perf_counter()
+            workers = start_workers(workdir, count, args.threads, lease_seconds, args.mode)
+            if kill_after is not None:
+                wait_for_leases(os.path.join(workdir, "Models.db"), "w0")
+                time.sleep(kill_after)
+                workers[0].send_signal(signal.SIGKILL)
+            outputs = [worker.communicate()[0] for worker in workers]
+            elapsed = time.perf_counter() - start
+
+            requests_made = sum(server.product_requests.values())
+            duplicates = sum(n - 1 for n in server.product_requests.values() if n > 1)
+            leases = [stats for stats in map(worker_leases, outputs) if stats]
+            processed = count_rows(os.path.join(workdir, "Models.db"), "models_urls WHERE processed = 1")
+            stored = count_rows(os.path.join(workdir, "products.db"), "products")
+            print(f"{label:24} {elapsed:6.2f}s  requests {requests_made:6}  duplicate fetches {duplicates:6}  "
+                  f"rows {stored:6}  processed {processed:6}")
+            for index, output in enumerate(outputs):
+                if lease_seconds and not worker_leases(output) and not (kill_after is not None and index == 0):
+                    print(" " * 25 + f"w{index} stopped early: {(output.strip().splitlines() or [''])[-1]}")
+            if leases:
+                print(" " * 25 + "claimed " + ", ".join(f"{stats['worker']} {stats['claimed']}" for stats in leases)
+                      + f"; reclaimed from expired leases {sum(stats['reclaimed'] for stats in leases)}")
+    server.shutdown()
+
+# Instrumentation: per-call cost of the metrics, and a crawl scraped live over HTTP
+def call_cost(fn, calls):
+    start = time.perf_counter()
+    for _ in range(calls):
+        fn()
+    return (time.perf_counter() - start) / calls
+
+def scrape_value(text, name):
+    for line in text.splitlines():
+        if line.startswith(name + " "):
+            return float(line.split()[-1])
+    return 0.0
+
+def bench_metrics(args):
+    registry = metrics.Registry()
+    counter = registry.counter("bench_total", "", ("outcome",))
+    histogram = registry.histogram("bench_seconds", "")
+    counter_cost = call_cost(lambda: counter.inc("stored"), args.calls)
+    histogram_cost = call_cost(lambda: histogram.observe(0.05), args.calls)
+    print(f"Counter.inc {counter_cost * 1e9:6.0f} ns  Histogram.observe {histogram_cost * 1e9:6.0f} ns  (1 thread)")
+
+    server, base_url = start_fixture_server(latency=args.latency)
+    with tempfile.TemporaryDirectory() as workdir:
+        os.chdir(workdir)
+        create_url_db("Models.db", base_url, args.urls)
+        scraper = load_script("prducts-fast.py", "prducts_fast")
+        metrics.REGISTRY.reset()
+        stats_server = metrics.start_stats_server(0)
+        stats_url = f"http://127.0.0.1:{stats_server.server_address[1]}"
+        snapshots = metrics.SnapshotWriter("stats.json", interval=0.5).start()
+
+        scrapes = []
+        done = threading.Event()
+
+        def scrape():
+            while not done.wait(0.2):
+                started = time.perf_counter()
+                text = requests.get(f"{stats_url}/metrics", timeout=5).text
+                scrapes.append((time.perf_counter() - started, len(text.splitlines()),
+                                scrape_value(text, 'crawler_pages_total{outcome="stored"}')))
+
+        scraper_thread = threading.Thread(target=scrape, daemon=True)
+        scraper_thread.start()
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            scraper.process_urls_from_db(url_db_name="Models.db", url_table="models_urls",
+                                         url_column="url", batch_size=args.threads)
+        elapsed = time.perf_counter() - start
+        done.set()
+        scraper_thread.join()
+        snapshots.stop()
+
+        final = requests.get(f"{stats_url}/metrics", timeout=5).text
+        live = requests.get(f"{stats_url}/stats.json", timeout=5).json()
+        stats_server.shutdown()
+        with open("stats.json", encoding="utf-8") as f:
+            snapshot = json.load(f)
+        os.chdir(HERE)
+    server.shutdown()
+
+    pages = scrape_value(final, 'crawler_pages_total{outcome="stored"}')
+    counters, histograms = snapshot["counters"], snapshot["histograms"]
+    attempts = sum(counters["crawler_fetch_attempts_total"].values())
+    batches = sum(series["count"] for series in histograms["crawler_db_write_seconds"].values())
+    calls_per_page = (2 * attempts + sum(counters["crawler_retries_total"].values()) + 2 * pages
+                      + 2 * batches) / max(pages, 1)
+    print(f"Crawl of {args.urls} URLs: {pages:.0f} pages stored in {elapsed:.2f}s "
+          f"({pages / elapsed:.0f} pages/s), {attempts} fetch attempts, {len(scrapes)} live scrapes "
+          f"(progress {', '.join(f'{value:.0f}' for _, _, value in scrapes[:5])}, ...)")
+    fetch = histograms["crawler_fetch_seconds"]["total"]
+    parse = histograms["crawler_parse_seconds"]["total"]
+    db = histograms["crawler_db_write_seconds"]["products"]
+    print(f"fetch p50/p95/p99 {fetch['p50'] * 1000:.1f}/{fetch['p95'] * 1000:.1f}/{fetch['p99'] * 1000:.1f} ms  "
+          f"parse p50/p95 {parse['p50'] * 1000:.2f}/{parse['p95'] * 1000:.2f} ms  "
+          f"db batch p95 {db['p95'] * 1000:.1f} ms over {db['count']} batches")
+    mean_scrape = sum(seconds for seconds, _, _ in scrapes) / max(len(scrapes), 1)
+    ports = len(live["gauges"].get("crawler_proxy_attempts", {}))
+    print(f"/metrics: {len(final.splitlines())} lines, mean scrape {mean_scrape * 1000:.1f} ms; "
+          f"stats.json has {ports} proxy ports, "
+          f"rates for {len(snapshot.get('rates', {}))} counters")
+    cost = calls_per_page * max(counter_cost, histogram_cost)
+    print(f"~{calls_per_page:.1f} metric calls per page: {cost * 1e6:.1f} us, "
+          f"{cost / (elapsed * args.threads / max(pages, 1)):.3%} of a worker's time per page")
+
+# Error logging during a simulated proxy outage: per-call appends vs the JSONL sink
+def legacy_log_error(path, error_message, url_id=None, url=None):
+    """The error_log.txt writer the scrapers used before error_log.py."""
+    timestamp = time.strftime("%Y-%m-%d %H:%M:%S")
+    with open(path, "a", encoding="utf-8") as f:
+        f.write(f"""
+[{timestamp}]
+URL ID: {url_id if url_id else 'N/A'}
+URL: {url if url else 'N/A'}
+Error: {error_message}
+Stack Trace: {traceback.format_exc()}
+{'=' * 80}
+""")
+
+def failing_request(port):
+    """Raise the error a dead proxy port gives, a few frames deep like a real requests call."""
+    def connect():
+        raise requests.exceptions.ProxyError(f"Unable to connect to proxy on port {port}")
+    def send():
+        connect()
+    send()
+
+def log_outage(log, threads, errors_per_thread):
+    def worker(thread):
+        for n in range(errors_per_thread):
+            row_id = thread * errors_per_thread + n
+            url = f"https://example.test/product/{row_id % 500}"
+            try:
+                failing_request(8001 + row_id % 1000)
+            except requests.RequestException as e:
+                log(f"Request failed after 10 attempts: {e}", row_id, url)
+            if n % 10 == 0:
+                log(f"Failed with status code: {503 if n % 20 else 404}", row_id, url)
+            if n % 25 == 0:
+                log("Specified table not found", row_id, url)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        list(executor.map(worker, range(threads)))
+    return time.perf_counter() - start
+
+def bench_errors(args):
+    total = args.threads * args.errors
+    print(f"{args.threads} threads logging {total} failed requests, plus status and parse errors")
+    with tempfile.TemporaryDirectory() as workdir:
+        legacy_path = os.path.join(workdir, "error_log.txt")
+        elapsed = log_outage(partial(legacy_log_error, legacy_path), args.threads, args.errors)
+        size = os.path.getsize(legacy_path)
+        print(f"error_log.txt   {elapsed:6.2f}s in the workers  {size / 2 ** 20:7.1f} MiB")
+
+        path = os.path.join(workdir, "error_log.jsonl")
+        log = error_log.ErrorLog(path, max_bytes=args.max_bytes, backups=args.backups)
+        elapsed = log_outage(log.log, args.threads, args.errors)
+        start = time.perf_counter()
+        log.close()
+        drained = time.perf_counter() - start
+        files = error_log.log_files(path)
+        size = sum(os.path.getsize(name) for name in files)
+        print(f"error_log.jsonl {elapsed:6.2f}s in the workers  {size / 2 ** 20:7.1f} MiB in {len(files)} files "
+              f"(+{drained:.2f}s to drain, {log.logged} logged, {log.dropped} dropped)")
+
+        start = time.perf_counter()
+        summary = error_log.summarize(path)
+        elapsed = time.perf_counter() - start
+        categories = ", ".join(f"{category} {count}" for category, count in summary["categories"].most_common())
+        print(f"summary in {elapsed:.2f}s: {summary['errors']} errors ({categories}) on {len(summary['urls'])} URLs, "
+              f"{summary['traces']} distinct stack traces")
+
+# Raw page archive: crawl once with --archive, then rebuild products offline
+def product_rows(db_name):
+    # Rows without the autoincrement ID and row version, so rebuilt tables compare equal
+    with closing(sqlite3.connect(db_name)) as conn:
+        cursor = conn.execute("SELECT * FROM products")
+        columns = [description[0] for description in cursor.description]
+        skipped = {"ID", extractor.PRODUCTS_VERSION_COLUMN}
+        return sorted(tuple(sorted((column, value) for column, value in zip(columns, row)
+                                   if column not in skipped and value is not None))
+                      for row in cursor)
+
+def bench_reparse(args):
+    server, base_url = start_fixture_server()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        os.chdir(workdir)
+        create_url_db("Models.db", base_url, args.urls)
+        scraper = load_script("prducts-fast.py", "prducts_fast")
+        scraper.raw_archive = page_archive.PageArchive("archive").open()
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            scraper.process_urls_from_db(url_db_name="Models.db", url_table="models_urls",
+                                         url_column="url", batch_size=args.threads)
+        scraper.raw_archive.close()
+        stats = scraper.raw_archive.stats()
+        print(f"crawl        {time.perf_counter() - start:6.2f}s  archived {stats['pages']} pages, "
+              f"{stats['raw_bytes'] / 1e6:.1f} MB raw -> {stats['stored_bytes'] / 1e6:.1f} MB "
+              f"({stats['ratio']:.1f}x, {page_archive.compress(b'')[0]})")
+        reference = product_rows("products.db")
+
+        for workers in sorted({1, os.cpu_count() or 1}):
+            db_name = f"reparsed-{workers}.db"
+            start = time.perf_counter()
+            stored, missing = page_archive.reparse("archive", db_name, workers=workers)
+            elapsed = time.perf_counter() - start
+            same = "identical" if product_rows(db_name) == reference else "DIFFERENT"
+            print(f"reparse x{workers:<3} {elapsed:6.2f}s  {stored / elapsed:8.1f} pages/s  "
+                  f"{stored} rows, {same} to the crawl")
+        os.chdir(HERE)
+
+    server.shutdown()
+
+# Browserless model discovery against the fixture brand pages
+def bench_discovery(args):
+    server, base_url = start_fixture_server(latency=args.latency, catalogue_size=args.models,
+                                            page_size=args.page_size)
+    with tempfile.TemporaryDirectory() as workdir:
+        os.chdir(workdir)
+        complete = load_script("complete.py", "complete")
+        complete.SITE_URL = f"{base_url}/"
+        requests_before = server.connections
+
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            models = complete.discover_all_models("http")
+        elapsed = time.perf_counter() - start
+
+        found = {url for _, url in models}
+        expected = {f"{base_url}/product/{n}" for n in range(args.models)}
+        print(f"http discovery  {len(found)}/{len(expected)} models in {elapsed:.2f}s  "
+              f"({len(models) / elapsed:.0f} models/s, {server.connections - requests_before} connections)"
+              + ("" if found == expected else "  MISSING MODELS"))
+        os.chdir(HERE)
+
+    server.shutdown()
+
+# Browser discovery: one brand at a time vs concurrent contexts with event-driven waits
+def bench_browser(args):
+    server, base_url = start_fixture_server(latency=args.latency, catalogue_size=args.models,
+                                            page_size=args.page_size)
+    expected = {f"{base_url}/product/{n}" for n in range(args.models)}
+    for engine in ("sync", "async"):
+        with tempfile.TemporaryDirectory() as workdir:
+            os.chdir(workdir)
+            complete = load_script("complete.py", "complete")
+            if complete.sync_playwright is None:
+                print("Requires playwright (pip install playwright && playwright install chromium)")
+                os.chdir(HERE)
+                break
+            complete.SITE_URL = f"{base_url}/"
+
+            start = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):
+                models = complete.discover_all_models("browser", browser_engine=engine)
+            elapsed = time.perf_counter() - start
+            complete.error_log.close()
+
+            found = {url for _, url in models}
+            print(f"{engine:6} browser  {len(found)}/{len(expected)} models in {elapsed:6.2f}s"
+                  + ("" if found == expected else "  MISSING MODELS (see error_log.jsonl)"))
+            os.chdir(HERE)
+
+    server.shutdown()
+
+# complete.py end to end: discovery then fetching vs both streaming together
+def bench_stream(args):
+    server, base_url = start_fixture_server(latency=args.latency, catalogue_size=args.models)
+
+    def phased(complete):
+        models = complete.discover_all_models("http")
+        with closing(sqlite3.connect(complete.BRANDS_DB)) as conn, conn:
+            conn.executemany("INSERT OR IGNORE INTO models (brand, url) VALUES (?, ?)", models)
+        complete.process_urls_from_db()
+
+    def streaming(complete):
+        complete.discover_and_process("http")
+
+    for label, run in (("phased", phased), ("streaming", streaming)):
+        with tempfile.TemporaryDirectory() as workdir:
+            os.chdir(workdir)
+            complete = load_script("complete.py", "complete")
+            complete.SITE_URL = f"{base_url}/"
+            complete.setup_databases()
+            first_fetch = []
+            fetch_and_store = complete.fetch_and_store_to_db
+
+            def timed_fetch(*fetch_args, **kwargs):
+                if not first_fetch:
+                    first_fetch.append(time.perf_counter())
+                return fetch_and_store(*fetch_args, **kwargs)
+            complete.fetch_and_store_to_db = timed_fetch
+
+            start = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):
+                run(complete)
+            elapsed = time.perf_counter() - start
+            print(f"{label:10} first fetch after {first_fetch[0] - start:6.2f}s  total {elapsed:6.2f}s  "
+                  f"{count_rows(complete.PRODUCTS_DB, 'products')} products")
+            os.chdir(HERE)
+
+    server.shutdown()
+
+# Task submission: fetchall + a future per URL vs keyset pages + a bounded window
+def bench_window(args):
+    def submit_all(executor, task):
+        with closing(sqlite3.connect("Models.db")) as conn:
+            urls = conn.execute("SELECT id, url FROM models_urls WHERE processed = 0 ORDER BY id").fetchall()
+        future_to_url = {executor.submit(task, url): url for url in urls}
+        for future in as_completed(future_to_url):
+            future.result()
+
+    def bounded(executor, task):
+        urls = iter_url_rows("Models.db", "models_urls")
+        for _, future in submit_bounded(executor, task, urls, window=4 * args.threads):
+            future.result()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        os.chdir(workdir)
+        create_url_db("Models.db", "http://127.0.0.1:1", args.urls)
+        with closing(sqlite3.connect("Models.db")) as conn, conn:
+            ensure_url_columns(conn, "models_urls")
+        print(f"{args.urls} URLs, {args.threads} workers, no-op tasks")
+
+        for label, schedule in (("submit all", submit_all), ("bounded", bounded)):
+            first_task = []
+
+            def task(item):
+                if not first_task:
+                    first_task.append(time.perf_counter())
+
+            tracemalloc.start()
+            start = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=args.threads) as executor:
+                schedule(executor, task)
+            elapsed = time.perf_counter() - start
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            print(f"{label:10} first task after {first_task[0] - start:6.3f}s  total {elapsed:6.2f}s  "
+                  f"peak memory {peak / 1e6:7.1f} MB")
+        os.chdir(HERE)
+
+# Excel export: pandas DataFrame per table vs streaming constant-memory writes
+EXPORT_CHILD = """
+import json, resource, sys, time
+sys.path.insert(0, sys.argv[1])
+from benchmarks import load_script
+exporter = load_script("Sqlite-To-Excel.py", "sqlite_to_excel")
+start = time.perf_counter()
+getattr(exporter, sys.argv[2])("Products.db", sys.argv[3])
+elapsed = time.perf_counter() - start
+print(json.dumps({"elapsed": elapsed, "max_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss}))
+"""
+
+def wide_spec_value(n, i):
+    # Mostly "<n> units" text, with some bare integer, decimal and Yes/No columns
+    if (n + i) % 3 == 0:
+        return None
+    if i % 10 == 1:
+        return "Yes" if n % 2 else "No"
+    if i % 10 == 2:
+        return str(i * n % 997)
+    if i % 10 == 3:
+        return f"{i * n % 997 / 10:.1f}"
+    return f"{i * n % 997} units"
+
+def create_wide_products_db(db_name, rows, spec_columns):
+    """A products table shaped like prducts-fast.py output: base columns plus many spec columns."""
+    labels = [f'"Spec {i}"' for i in range(spec_columns)]
+    with closing(sqlite3.connect(db_name)) as conn, conn:
+        conn.execute(f"CREATE TABLE products (ID INTEGER PRIMARY KEY AUTOINCREMENT, Brand TEXT, "
+                     f"ProductName TEXT, Url TEXT, Images TEXT, {', '.join(f'{label} TEXT' for label in labels)})")
+        conn.executemany(
+            f"INSERT INTO products (Brand, ProductName, Url, Images, {', '.join(labels)}) "
+            f"VALUES ({', '.join('?' * (4 + spec_columns))})",
+            ((f"Brand {n % 7}", f"Book {n}", f"https://www.laptoparena.net/product/{n}",
+              f'["https://www.laptoparena.net/img/{n}/0.jpg"]',
+              *(wide_spec_value(n, i) for i in range(spec_columns)))
+             for n in range(rows)),
+        )
+
+def sheet_sizes(excel_file):
+    import openpyxl
+    workbook = openpyxl.load_workbook(excel_file, read_only=True)
+    sizes = {sheet.title: sheet.max_row for sheet in workbook.worksheets}
+    workbook.close()
+    return sizes
+
+def bench_excel(args):
+    with tempfile.TemporaryDirectory() as workdir:
+        create_wide_products_db(os.path.join(workdir, "Products.db"), args.rows, args.columns)
+        print(f"{args.rows} rows x {args.columns + 5} columns")
+        outputs = {}
+        for label, function in (("pandas", "export_to_excel_split"), ("streaming", "export_to_excel_streaming")):
+            output = f"{label}.xlsx"
+            result = subprocess.run([sys.executable, "-c", EXPORT_CHILD, HERE, function, output],
+                                    cwd=workdir, capture_output=True, text=True, check=True)
+            stats = json.loads(result.stdout.strip().splitlines()[-1])
+            outputs[label] = os.path.join(workdir, output)
+            print(f"{label:10} {stats['elapsed']:7.2f}s  peak RSS {stats['max_rss_kb'] / 1024:7.1f} MB  "
+                  f"{os.path.getsize(outputs[label]) / 1e6:6.1f} MB file")
+        same = sheet_sizes(outputs["pandas"]) == sheet_sizes(outputs["streaming"])
+        print("Same sheets and row counts" if same else "SHEETS DIFFER")
+
+# Columnar export: Excel vs Parquet and CSV, written and loaded back
+def file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def bench_columnar(args):
+    import pandas as pd
+
+    with tempfile.TemporaryDirectory() as workdir:
+        db_name = os.path.join(workdir, "Products.db")
+        create_wide_products_db(db_name, args.rows, args.columns)
+        # A second, smaller table so the per-table workers run side by side
+        create_url_db(db_name, "https://www.laptoparena.net", args.rows // 4)
+        print(f"{args.rows} rows x {args.columns + 5} columns, plus {args.rows // 4} URL rows")
+
+        exporter = load_script("Sqlite-To-Excel.py", "sqlite_to_excel")
+        excel_file = os.path.join(workdir, "export.xlsx")
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            exporter.export_to_excel_streaming(db_name, excel_file)
+        excel_write = time.perf_counter() - start
+        start = time.perf_counter()
+        pd.read_excel(excel_file, sheet_name=None)
+        excel_read = time.perf_counter() - start
+        print(f"{'xlsx':8} write {excel_write:7.2f}s  load {excel_read:7.2f}s  "
+              f"{os.path.getsize(excel_file) / 1e6:6.1f} MB")
+
+        runs = []
+        for run in range(2):
+            output_dir = os.path.join(workdir, f"columnar-{run}")
+            start = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):
+                manifest = columnar_export.export_tables(db_name, output_dir, workers=args.workers)
+            runs.append((output_dir, time.perf_counter() - start))
+        output_dir, write_time = runs[0]
+        print(f"{'columnar':8} write {write_time:7.2f}s for Parquet and CSV of both tables")
+
+        start = time.perf_counter()
+        frame = pd.read_parquet(os.path.join(output_dir, "products.parquet"))
+        parquet_read = time.perf_counter() - start
+        start = time.perf_counter()
+        for name in manifest["products"]["files"]:
+            if name.endswith(".csv"):
+                pd.read_csv(os.path.join(output_dir, name))
+        csv_read = time.perf_counter() - start
+        print(f"{'parquet':8} load {parquet_read:7.2f}s  "
+              f"{os.path.getsize(os.path.join(output_dir, 'products.parquet')) / 1e6:6.1f} MB, "
+              f"{manifest['products']['row_group_rows']} rows per row group")
+        print(f"{'csv':8} load {csv_read:7.2f}s")
+
+        type_counts = Counter(type_name for _, type_name in manifest["products"]["columns"])
+        print(f"Inferred column types: {dict(sorted(type_counts.items()))}")
+        print("Row count matches" if len(frame) == args.rows else "ROW COUNT DIFFERS")
+        names = sorted(os.listdir(runs[0][0]))
+        identical = names == sorted(os.listdir(runs[1][0])) and all(
+            file_digest(os.path.join(runs[0][0], name)) == file_digest(os.path.join(runs[1][0], name))
+            for name in names)
+        print("Two exports are byte-identical" if identical else "EXPORTS DIFFER")
+
+# Incremental export: full export vs deltas of the rows changed by a recrawl
+def bench_incremental(args):
+    import pandas as pd
+
+    def export_frame(path):
+        frame = pd.read_parquet(path).drop(columns=["ID", extractor.PRODUCTS_VERSION_COLUMN])
+        return frame.sort_values("Url").reset_index(drop=True)
+
+    with tempfile.TemporaryDirectory() as workdir:
+        db_name = os.path.join(workdir, "Products.db")
+        create_wide_products_db(db_name, args.rows, args.columns)
+        with closing(sqlite3.connect(db_name)) as conn, conn:
+            conn.execute(f"ALTER TABLE products ADD COLUMN {extractor.PRODUCTS_VERSION_COLUMN} INTEGER")
+            conn.execute(f"UPDATE products SET {extractor.PRODUCTS_VERSION_COLUMN} = rowid")
+        output_dir = os.path.join(workdir, "export")
+        quiet = contextlib.redirect_stdout(io.StringIO())
+
+        start = time.perf_counter()
+        with quiet:
+            columnar_export.export_tables(db_name, output_dir)
+        print(f"{'full':8} {time.perf_counter() - start:7.2f}s  {args.rows} rows")
+
+        for run in range(args.runs):
+            # A recrawl rewrites some products through the sink, as prducts-fast.py does
+            sink = get_sink(db_name, table="products", key_column="Url",
+                            version_column=extractor.PRODUCTS_VERSION_COLUMN)
+            for n in range(run, args.rows, args.rows // args.changed):
+                sink.put({"Brand": f"Brand {n % 7}", "ProductName": f"Book {n} rev {run + 1}",
+                          "Url": f"https://www.laptoparena.net/product/{n}", "Price": f"{999 + run}"})
+            close_sinks()
+            start = time.perf_counter()
+            with quiet:
+                manifest = columnar_export.export_changes(db_name, output_dir)
+            delta = manifest["products"]["deltas"][-1]
+            print(f"{'delta':8} {time.perf_counter() - start:7.2f}s  {delta['rows']} rows")
+
+        start = time.perf_counter()
+        with quiet:
+            columnar_export.compact(output_dir)
+        print(f"{'compact':8} {time.perf_counter() - start:7.2f}s")
+
+        with quiet:
+            columnar_export.export_tables(db_name, os.path.join(workdir, "full"))
+        same = export_frame(os.path.join(output_dir, "products.parquet")).equals(
+            export_frame(os.path.join(workdir, "full", "products.parquet")))
+        print("Compacted export matches a full export" if same else "COMPACTED EXPORT DIFFERS")
+
+# Typed spec store: range query on product_specs vs scanning and parsing text columns
+def scan_products(db_name, min_ram_gb, max_weight_kg):
+    # What a query had to do before: read every row and parse the text in Python
+    urls = []
+    with closing(sqlite3.connect(db_name)) as conn:
+        cursor = conn.execute("SELECT * FROM products")
+        columns = [description[0] for description in cursor.description]
+        for row in cursor:
+            typed = spec_store.normalize_specs(dict(zip(columns, row)))
+            if typed.get("ram_gb", 0) >= min_ram_gb and typed.get("weight_kg", float("inf")) < max_weight_kg:
+                urls.append(row[columns.index("Url")])
+    return sorted(urls)
+
+def bench_specs(args):
+    with tempfile.TemporaryDirectory() as workdir:
+        db_name = os.path.join(workdir, "products.db")
+        sink = get_sink(db_name, table="products", key_column="Url",
+                        version_column=extractor.PRODUCTS_VERSION_COLUMN,
+                        create_sql=(extractor.PRODUCTS_TABLE_SQL, *spec_store.SPEC_SCHEMA_SQL))
+        start = time.perf_counter()
+        for n in range(args.products):
+            url = f"https://www.laptoparena.net/product/{n}"
+            row = extractor.product_row(extractor.extract_product_page(product_page(n, revision=n % 3)), url)
+            sink.put(row)
+            spec_store.queue_specs(sink, url, row)
+        close_sinks()
+        print(f"stored {args.products} products with typed specs in {time.perf_counter() - start:.2f}s")
+
+        start = time.perf_counter()
+        scanned = scan_products(db_name, args.min_ram, args.max_weight)
+        scan_time = time.perf_counter() - start
+        start = time.perf_counter()
+        for _ in range(args.repeat):
+            found = spec_store.find_products(db_name, minimum={"ram_gb": args.min_ram},
+                                             maximum={"weight_kg": args.max_weight})
+        query_time = (time.perf_counter() - start) / args.repeat
+        print(f"RAM >= {args.min_ram:g} GB and weight < {args.max_weight:g} kg")
+        print(f"{'scan':8} {scan_time * 1000:9.1f} ms  {len(scanned)} products")
+        print(f"{'indexed':8} {query_time * 1000:9.1f} ms  {len(found)} products")
+        with closing(sqlite3.connect(db_name)) as conn:
+            plan = conn.execute(f"EXPLAIN QUERY PLAN SELECT url FROM {spec_store.SPEC_TABLE} "
+                                f"WHERE ram_gb >= ? AND weight_kg < ?", (args.min_ram, args.max_weight)).fetchall()
+        print(f"plan: {'; '.join(row[-1] for row in plan)}")
+        print("Same products" if scanned == [row["url"] for row in found] else "RESULTS DIFFER")
+
+        # Rebuilding from the stored rows must give what the sink kept in sync
+        synced = spec_store.find_products(db_name)
+        start = time.perf_counter()
+        rebuilt = spec_store.rebuild(db_name)
+        same = spec_store.find_products(db_name) == synced
+        print(f"rebuild  {time.perf_counter() - start:9.2f} s  {rebuilt} rows, "
+              f"{'same as kept in sync' if same else 'DIFFERENT FROM THE SYNCED ROWS'}")
+
+# Full-text search: FTS5 index vs LIKE over the name and every spec column
+def search_specs(n):
+    specs = {
+        "Brand": f"Brand{n % 12}",
+        "Model Name": f"Book {n // 10}",
+        "Part Number": f"{n * 7919 % 16 ** 6:06X}EA",
+        "Processor": f"Intel Core i{5 + 2 * (n % 2)}-{1200 + n % 90}{'U' if n % 3 else 'H'}",
+        "RAM": f"{8 * (1 + n % 4)} GB",
+        "Storage": f"{256 * (1 + n % 3)} GB SSD",
+        "Graphics": ("Intel Iris Xe", "NVIDIA GeForce RTX 4060", "AMD Radeon 780M")[n % 3],
+    }
+    for i in range(20):
+        specs[f"Feature {i}"] = f"option {(n + i) % 17} level {i}"
+    return specs
+
+def bench_search(args):
+    with tempfile.TemporaryDirectory() as workdir:
+        db_name = os.path.join(workdir, "products.db")
+        sink = get_sink(db_name, table="products", key_column="Url",
+                        create_sql=(extractor.PRODUCTS_TABLE_SQL, *search_index.SEARCH_SCHEMA_SQL))
+        start = time.perf_counter()
+        for n in range(args.products):
+            url = f"https://www.laptoparena.net/product/{n}"
+            row = extractor.product_row(extractor.ProductPage(search_specs(n), []), url)
+            sink.put(row)
+            search_index.queue_search_entry(sink, url, row)
+        close_sinks()
+        print(f"stored and indexed {args.products} products in {time.perf_counter() - start:.2f}s")
+
+        with closing(sqlite3.connect(db_name)) as conn:
+            text_columns = [row[1] for row in conn.execute("PRAGMA table_info(products)")
+                            if row[1] not in ("ID", "Url", "Images")]
+        like_sql = (f"SELECT Url FROM products WHERE "
+                    + " OR ".join(f'"{column}" LIKE ?' for column in text_columns))
+
+        part_number = search_specs(args.products // 2)["Part Number"]
+        for text in (part_number, "i7-1255U", "RTX 4060 Book 42"):
+            start = time.perf_counter()
+            with closing(sqlite3.connect(db_name)) as conn:
+                scanned = {row[0] for row in conn.execute(like_sql, [f"%{text}%"] * len(text_columns))}
+            scan_time = time.perf_counter() - start
+            start = time.perf_counter()
+            for _ in range(args.repeat):
+                search_index.search(db_name, text, limit=20)
+            search_time = (time.perf_counter() - start) / args.repeat
+            found = search_index.search(db_name, text, limit=args.products)
+            print(f"{text!r:20} LIKE {scan_time * 1000:8.1f} ms {len(scanned):6} hits   "
+                  f"FTS5 top 20 {search_time * 1000:7.2f} ms of {len(found):6} hits")
+            if text == part_number:
+                same = scanned == {result["url"] for result in found}
+                print(f"{'':20} part number lookup {'finds the same product' if same else 'DIFFERS'}")
+
+# Upserts and variant groups: idempotent re-stores, then MinHash/LSH groups vs exact pairwise Jaccard
+def variant_specs(n, family_size):
+    family = n // family_size
+    specs = {
+        "Brand": f"Brand{family % 12}",
+        "Model Name": f"Book {family}",
+        "Part Number": f"{n * 7919 % 16 ** 6:06X}EA",
+        # The last variant of a family also differs in one spec
+        "RAM": f"{8 * (1 + family % 4) * (2 if n % family_size == family_size - 1 else 1)} GB",
+    }
+    for i in range(24):
+        specs[f"Feature {i}"] = f"option {hashlib.blake2b(f'{family}/{i}'.encode(), digest_size=2).hexdigest()}"
+    return specs
+
+def store_variants(sink, products, family_size):
+    for n in range(products):
+        url = f"https://www.laptoparena.net/product/{n:07d}"
+        sink.put(extractor.product_row(extractor.ProductPage(variant_specs(n, family_size), []), url))
+
+def same_group_pairs(groups):
+    pairs = set()
+    for urls in groups:
+        urls = sorted(urls)
+        pairs.update((first, second) for i, first in enumerate(urls) for second in urls[i + 1:])
+    return pairs
+
+def bench_variants(args):
+    with tempfile.TemporaryDirectory() as workdir:
+        db_name = os.path.join(workdir, "products.db")
+        def products_sink():
+            return get_sink(db_name, table="products", key_column="Url", create_sql=extractor.PRODUCTS_TABLE_SQL,
+                            unchanged_columns=(extractor.PRODUCTS_FINGERPRINT_COLUMN, "Images"),
+                            version_column=extractor.PRODUCTS_VERSION_COLUMN)
+        def table_state():
+            with closing(sqlite3.connect(db_name)) as conn:
+                return conn.execute("SELECT COUNT(*), MAX(RowVersion) FROM products").fetchone()
+
+        for attempt in ("first store", "re-store"):
+            start = time.perf_counter()
+            store_variants(products_sink(), args.products, args.family_size)
+            close_sinks()
+            rows, version = table_state()
+            print(f"{attempt:12} {time.perf_counter() - start:6.2f}s  {rows} rows, max RowVersion {version}")
+
+        start = time.perf_counter()
+        hashed, groups = variants.build(db_name)
+        build_time = time.perf_counter() - start
+        print(f"LSH build    {build_time:6.2f}s  {hashed} products hashed, {groups} groups")
+
+        families = {}
+        for n in range(args.products):
+            families.setdefault(n // args.family_size, []).append(f"https://www.laptoparena.net/product/{n:07d}")
+        expected = same_group_pairs(families.values())
+        found = same_group_pairs(urls for _, urls in variants.variant_groups(db_name))
+        print(f"{'':12} pair recall {len(expected & found) / len(expected):.4f}, "
+              f"precision {len(expected & found) / max(1, len(found)):.4f}")
+
+        # Exact Jaccard over every pair of a sample, as the grouping would cost without LSH
+        sample = min(args.brute, args.products)
+        features = [variants.spec_features(variant_specs(n, args.family_size)) for n in range(sample)]
+        start = time.perf_counter()
+        similar = sum(1 for i in range(sample) for j in range(i + 1, sample)
+                      if len(features[i] & features[j]) / len(features[i] | features[j]) >= variants.THRESHOLD)
+        brute_time = time.perf_counter() - start
+        estimate = brute_time * (args.products / sample) ** 2
+        print(f"pairwise     {brute_time:6.2f}s  for {sample} products ({similar} similar pairs); "
+              f"~{estimate:.0f}s for {args.products}")
+
+        # A recrawl that changes a few products only re-hashes those
+        with closing(sqlite3.connect(db_name)) as conn, conn:
+            conn.execute("UPDATE products SET RowVersion = RowVersion + 1000000 WHERE ID % ? = 0",
+                         (max(1, args.products // args.changed),))
+        start = time.perf_counter()
+        hashed, groups = variants.build(db_name)
+        print(f"incremental  {time.perf_counter() - start:6.2f}s  {hashed} products hashed, {groups} groups")
+
+# Gallery images: serial per-URL downloads vs the concurrent content-addressed store
+def create_image_products_db(db_name, base_url, first, last):
+    with closing(sqlite3.connect(db_name)) as conn, conn:
+        conn.execute(extractor.PRODUCTS_TABLE_SQL)
+        conn.executemany("INSERT INTO products (Url, Images) VALUES (?, ?)",
+                         [(f"{base_url}/product/{n}", json.dumps([f"/img/{n}/{i}.jpg" for i in range(3)]))
+                          for n in range(first, last)])
+
+def directory_size(directory):
+    files = size = 0
+    for root, _, names in os.walk(directory):
+        for name in names:
+            files += 1
+            size += os.path.getsize(os.path.join(root, name))
+    return files, size
+
+def bench_images(args):
+    server, base_url = start_fixture_server(latency=args.latency)
+    proxies = start_fake_proxies(args.proxies, dead=0, slow=0, flaky=0)
+    print(f"{args.products} products x 3 images, {args.latency * 1000:.0f} ms latency, "
+          f"{len(proxies)} fake proxies")
+
+    with tempfile.TemporaryDirectory() as workdir:
+        os.chdir(workdir)
+        create_image_products_db("products.db", base_url, 0, args.products)
+
+        # What the downstream team did: one image after the other, one file per URL
+        start = time.perf_counter()
+        os.makedirs("serial")
+        with requests.Session() as session, closing(sqlite3.connect("products.db")) as conn:
+            for row_id, url, images in conn.execute("SELECT ID, Url, Images FROM products"):
+                for position, image_url in enumerate(image_store.product_image_urls(url, images)):
+                    with open(os.path.join("serial", f"{row_id}-{position}.jpg"), "wb") as f:
+                        f.write(session.get(image_url, timeout=10).content)
+        files, size = directory_size("serial")
+        print(f"{'serial':12} {time.perf_counter() - start:7.2f}s  {files} files, {size / 2 ** 20:6.1f} MiB")
+
+        scraper = load_script("prducts-fast.py", "prducts_fast")
+        scraper.get_proxies = lambda port: {"http": f"http://127.0.0.1:{port}"}
+        scraper.proxy_scheduler = ProxyScheduler(sorted(proxies))
+
+        def download(label, directory="images", **options):
+            start = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):
+                stats = scraper.download_product_images(directory, workers=args.workers, **options)
+            elapsed = time.perf_counter() - start
+            files, size = directory_size(directory)
+            print(f"{label:12} {elapsed:7.2f}s  fetched {stats['images_fetched']:5}, "
+                  f"reused {stats['images_reused']:5}, skipped {stats['products_skipped']:5} products; "
+                  f"{files} files, {size / 2 ** 20:6.1f} MiB on disk")
+            return stats, elapsed
+
+        # An interrupted run: half the products first, the rest on the next run
+        os.remove("products.db")
+        create_image_products_db("products.db", base_url, 0, args.products // 2)
+        download("first half")
+        create_image_products_db("products.db", base_url, args.products // 2, args.products)
+        download("resumed")
+        download("rerun")
+        with closing(sqlite3.connect("products.db")) as conn:
+            manifest, unique = conn.execute("SELECT COUNT(*), COUNT(DISTINCT hash) FROM product_images").fetchone()
+        print(f"{'':12} manifest: {manifest} product images, {unique} distinct hashes")
+
+        sample = min(args.products, 200)
+        os.remove("products.db")
+        create_image_products_db("products.db", base_url, 0, sample)
+        stats, elapsed = download("rate capped", "capped", max_rate=args.rate)
+        print(f"{'':12} {stats['bytes_fetched'] / elapsed / 2 ** 20:.2f} MiB/s with a cap of "
+              f"{args.rate / 2 ** 20:.2f} MiB/s")
+        if image_store.Image is not None:
+            os.remove("products.db")
+            create_image_products_db("products.db", base_url, 0, sample)
+            stats, _ = download("thumbnails", "thumbnailed", thumbnail_size=64)
+            print(f"{'':12} {stats['thumbnails_written']} thumbnails")
+        os.chdir(HERE)
+
+    server.shutdown()
+
+# HTML extraction backends: identical output on the fixture corpus, then pages/sec
+def load_corpus():
+    pages_dir = os.path.join(HERE, "fixtures", "pages")
+    corpus = []
+    for name in sorted(os.listdir(pages_dir)):
+        with open(os.path.join(pages_dir, name), "rb") as f:
+            corpus.append((name, f.read()))
+    corpus += [(f"generated-{n}", product_page(n).encode("utf-8")) for n in range(20)]
+    return corpus
+
+def bench_extract(args):
+    corpus = load_corpus()
+    backends = extractor.available_backends()
+    print(f"{len(corpus)} pages, backends: {', '.join(backends)}")
+
+    reference = {name: extractor.extract_product_page(content, "html.parser") for name, content in corpus}
+    mismatches = 0
+    for backend in backends:
+        for name, content in corpus:
+            result = extractor.extract_product_page(content, backend)
+            if result != reference[name]:
+                mismatches += 1
+                print(f"MISMATCH {backend} on {name}:\n  {result}\n  {reference[name]}")
+    if mismatches:
+        raise SystemExit(f"{mismatches} pages differ between backends")
+    print("All backends return identical output")
+
+    for backend in backends:
+        start = time.perf_counter()
+        for _ in range(args.rounds):
+            for _, content in corpus:
+                extractor.extract_product_page(content, backend)
+        elapsed = time.perf_counter() - start
+        print(f"{backend:12} {args.rounds * len(corpus) / elapsed:9.1f} pages/s")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmarks for the scraping kit using local fixtures.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    fetch = commands.add_parser("fetch", help="compare the thread-pool, pipeline and asyncio fetch engines")
+    fetch.add_argument("--urls", type=int, default=2000)
+    fetch.add_argument("--latency", type=float, default=0.05, help="simulated server latency in seconds")
+    fetch.add_argument("--threads", type=int, default=100, help="thread pool size for the threads run")
+    fetch.add_argument("--concurrency", type=int, nargs="+", default=[100, 500],
+                       help="in-flight limits for the async runs")
+    fetch.add_argument("--parsers", type=int, default=None, help="parser processes for the pipeline run")
+    fetch.set_defaults(func=bench_fetch)
+
+    sessions = commands.add_parser("sessions", help="compare pooled keep-alive sessions with requests.get")
+    sessions.add_argument("--urls", type=int, default=2000)
+    sessions.add_argument("--latency", type=float, default=0.0, help="simulated server latency in seconds")
+    sessions.add_argument("--threads", type=int, default=20)
+    sessions.add_argument("--ports", type=int, default=20, help="simulated proxy ports to key sessions by")
+    sessions.set_defaults(func=bench_sessions)
+
+    proxies = commands.add_parser("proxies", help="compare linear port rotation with the proxy scheduler")
+    proxies.add_argument("--urls", type=int, default=1000)
+    proxies.add_argument("--proxies", type=int, default=40)
+    proxies.add_argument("--dead", type=float, default=0.2, help="share of proxies that drop connections")
+    proxies.add_argument("--slow", type=float, default=0.2, help="share of proxies that add a 1 s delay")
+    proxies.add_argument("--flaky", type=float, default=0.2, help="share of proxies that fail half the time")
+    proxies.add_argument("--threads", type=int, default=20)
+    proxies.set_defaults(func=bench_proxies)
+
+    adaptive = commands.add_parser("adaptive", help="compare fixed and AIMD concurrency on a throttling server")
+    adaptive.add_argument("--urls", type=int, default=2000)
+    adaptive.add_argument("--latency", type=float, default=0.05)
+    adaptive.add_argument("--capacity", type=int, default=30, help="concurrent requests before 429s")
+    adaptive.add_argument("--retry-after", type=int, default=1)
+    adaptive.add_argument("--threads", type=int, default=100)
+    adaptive.set_defaults(func=bench_adaptive)
+
+    recrawl = commands.add_parser("recrawl", help="compare a full crawl with incremental recrawls")
+    recrawl.add_argument("--urls", type=int, default=2000)
+    recrawl.add_argument("--latency", type=float, default=0.02)
+    recrawl.add_argument("--changed", type=float, default=0.05, help="share of pages changed per recrawl")
+    recrawl.add_argument("--threads", type=int, default=50)
+    recrawl.set_defaults(func=bench_recrawl)
+
+    reparse = commands.add_parser("reparse", help="archive a crawl, then rebuild products from the archive")
+    reparse.add_argument("--urls", type=int, default=5000)
+    reparse.add_argument("--threads", type=int, default=50)
+    reparse.set_defaults(func=bench_reparse)
+
+    discovery = commands.add_parser("discovery", help="discover models over HTTP from the fixture brand pages")
+    discovery.add_argument("--models", type=int, default=5000, help="models listed across all brands")
+    discovery.add_argument("--page-size", type=int, default=24, help="models per listing page or fragment")
+    discovery.add_argument("--latency", type=float, default=0.05)
+    discovery.set_defaults(func=bench_discovery)
+
+    browser = commands.add_parser("browser", help="discover models in Playwright from the fixture brand pages, "
+                                                  "one brand at a time vs concurrent browser contexts")
+    browser.add_argument("--models", type=int, default=600, help="models listed across all brands")
+    browser.add_argument("--page-size", type=int, default=24, help="models per listing page or fragment")
+    browser.add_argument("--latency", type=float, default=0.05)
+    browser.set_defaults(func=bench_browser)
+
+    stream = commands.add_parser("stream", help="compare phased and streaming discovery-to-fetch in complete.py")
+    stream.add_argument("--models", type=int, default=3000)
+    stream.add_argument("--latency", type=float, default=0.05)
+    stream.set_defaults(func=bench_stream)
+
+    window = commands.add_parser("window", help="compare submitting every URL up front with a bounded window")
+    window.add_argument("--urls", type=int, default=300000)
+    window.add_argument("--threads", type=int, default=100)
+    window.set_defaults(func=bench_window)
+
+    excel = commands.add_parser("excel", help="compare the pandas and streaming Excel exporters")
+    excel.add_argument("--rows", type=int, default=100000)
+    excel.add_argument("--columns", type=int, default=60, help="spec columns besides the base ones")
+    excel.set_defaults(func=bench_excel)
+
+    columnar = commands.add_parser("columnar", help="compare Excel with the Parquet/CSV export")
+    columnar.add_argument("--rows", type=int, default=100000)
+    columnar.add_argument("--columns", type=int, default=60, help="spec columns besides the base ones")
+    columnar.add_argument("--workers", type=int, default=None)
+    columnar.set_defaults(func=bench_columnar)
+
+    incremental = commands.add_parser("incremental", help="compare a full export with delta exports and compaction")
+    incremental.add_argument("--rows", type=int, default=100000)
+    incremental.add_argument("--columns", type=int, default=60, help="spec columns besides the base ones")
+    incremental.add_argument("--changed", type=int, default=300, help="products rewritten per recrawl")
+    incremental.add_argument("--runs", type=int, default=3, help="recrawl + delta export rounds")
+    incremental.set_defaults(func=bench_incremental)
+
+    specs = commands.add_parser("specs", help="compare an indexed typed spec query with a text scan")
+    specs.add_argument("--products", type=int, default=50000)
+    specs.add_argument("--min-ram", type=float, default=16)
+    specs.add_argument("--max-weight", type=float, default=1.5)
+    specs.add_argument("--repeat", type=int, default=20, help="indexed queries to average over")
+    specs.set_defaults(func=bench_specs)
+
+    search = commands.add_parser("search", help="compare FTS5 lookups with LIKE scans")
+    search.add_argument("--products", type=int, default=100000)
+    search.add_argument("--repeat", type=int, default=20, help="FTS5 queries to average over")
+    search.set_defaults(func=bench_search)
+
+    variant = commands.add_parser("variants", help="check idempotent upserts, then compare LSH variant groups "
+                                                   "with pairwise comparison")
+    variant.add_argument("--products", type=int, default=100000)
+    variant.add_argument("--family-size", type=int, default=5, help="variants per product family")
+    variant.add_argument("--brute", type=int, default=3000, help="products compared pairwise")
+    variant.add_argument("--changed", type=int, default=300, help="products changed before the incremental build")
+    variant.set_defaults(func=bench_variants)
+
+    images = commands.add_parser("images", help="compare serial image downloads with the content-addressed store")
+    images.add_argument("--products", type=int, default=1000)
+    images.add_argument("--latency", type=float, default=0.02)
+    images.add_argument("--proxies", type=int, default=8)
+    images.add_argument("--workers", type=int, default=32)
+    images.add_argument("--rate", type=image_store.parse_size, default=2 * 2 ** 20, help="byte-rate cap to check")
+    images.set_defaults(func=bench_images)
+
+    errors = commands.add_parser("errors", help="compare error_log.txt appends with the JSONL error log")
+    errors.add_argument("--threads", type=int, default=100)
+    errors.add_argument("--errors", type=int, default=500, help="failed requests per thread")
+    errors.add_argument("--max-bytes", type=int, default=10 * 2 ** 20, help="rotation size of the JSONL log")
+    errors.add_argument("--backups", type=int, default=5)
+    errors.set_defaults(func=bench_errors)
+
+    retries = commands.add_parser("retries", help="compare immediate retries with the backoff retry queue")
+    retries.add_argument("--urls", type=int, default=1000)
+    retries.add_argument("--latency", type=float, default=0.01)
+    retries.add_argument("--threads", type=int, default=50)
+    retries.add_argument("--gone", type=float, default=0.02, help="share of pages answering 404")
+    retries.add_argument("--no-specs", type=float, default=0.02, help="share of pages without a spec table")
+    retries.add_argument("--flaky", type=float, default=0.05, help="share of pages answering 503 for a while")
+    retries.add_argument("--flaky-failures", type=int, default=6, help="503s before a flaky page loads")
+    retries.add_argument("--base-delay", type=float, default=5.0, help="backoff after a URL's first failure")
+    retries.add_argument("--runs", type=int, default=6, help="most crawls per strategy")
+    retries.set_defaults(func=bench_retries)
+
+    workers = commands.add_parser("workers", help="run several prducts-fast.py workers on one URL DB, "
+                                                   "with and without leases")
+    workers.add_argument("--urls", type=int, default=3000)
+    workers.add_argument("--latency", type=float, default=0.05)
+    workers.add_argument("--workers", type=int, default=4)
+    workers.add_argument("--threads", type=int, default=20,
+                         help="fetch threads (in async mode, concurrent requests) per worker")
+    workers.add_argument("--mode", choices=("threads", "async", "pipeline"), default="threads")
+    workers.add_argument("--lease-seconds", type=float, default=3.0)
+    workers.add_argument("--kill-after", type=float, default=2.0,
+                         help="seconds after its first claim that one worker is killed")
+    workers.set_defaults(func=bench_workers)
+
+    metric = commands.add_parser("metrics", help="time the metrics and scrape /metrics during a crawl")
+    metric.add_argument("--urls", type=int, default=2000)
+    metric.add_argument("--latency", type=float, default=0.05)
+    metric.add_argument("--threads", type=int, default=100)
+    metric.add_argument("--calls", type=int, default=1000000, help="calls to time per metric type")
+    metric.set_defaults(func=bench_metrics)
+
+    extract = commands.add_parser("extract", help="check and time the HTML extraction backends")
+    extract.add_argument("--rounds", type=int, default=50, help="passes over the fixture corpus")
+    extract.set_defaults(func=bench_extract)
+
+    args = parser.parse_args()
+    args.func(args)
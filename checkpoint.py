@@ -0,0 +1,129 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from contextlib import closing
+
+class Checkpoint:
+    """Append-only journal of processed URL IDs with set membership and batched fsync.
+
+    Each processed ID is one line in the journal, so recording progress costs
+    O(1) bytes. When a URL database is given, the journal is folded into its
+    `processed` column in a single transaction on open (crash recovery) and on
+    close, after which the journal is truncated.
+    """
+
+    def __init__(self, journal_file="progress.journal", url_db_name=None, url_table=None,
+                 sync_every=500, sync_interval=2.0, legacy_file="progress.json"):
+        self.journal_file = journal_file
+        self.url_db_name = url_db_name
+        self.url_table = url_table
+        self.sync_every = sync_every
+        self.sync_interval = sync_interval
+        self.legacy_file = legacy_file
+        self.processed = set()
+        self._buffer = []
+        self._last_sync = time.monotonic()
+        self._lock = threading.Lock()
+        self._file = None
+
+    def __enter__(self):
+        return self.open()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def __contains__(self, row_id):
+        return row_id in self.processed
+
+    def __len__(self):
+        return len(self.processed)
+
+    def open(self):
+        """Load the journal (and any legacy progress.json) and start appending."""
+        self.processed = self._read_journal()
+
+        legacy_ids = []
+        if self.legacy_file and os.path.exists(self.legacy_file):
+            with open(self.legacy_file, "r") as f:
+                legacy_ids = [row_id for row_id in json.load(f).get("processed", [])
+                              if row_id not in self.processed]
+
+        self._file = open(self.journal_file, "a", encoding="utf-8")
+        if legacy_ids:
+            self.processed.update(legacy_ids)
+            self._file.write("".join(f"{row_id}\n" for row_id in legacy_ids))
+            self._fsync()
+        if self.legacy_file and os.path.exists(self.legacy_file):
+            os.replace(self.legacy_file, self.legacy_file + ".migrated")
+
+        # Anything left in the journal was not folded into the DB by the last run
+        if self.url_db_name and self.processed:
+            self._fold_into_db()
+        return self
+
+    def mark(self, row_id):
+        """Record `row_id` as processed; durable after the next batched fsync."""
+        with self._lock:
+            if row_id in self.processed:
+                return
+            self.processed.add(row_id)
+            self._buffer.append(f"{row_id}\n")
+            if (len(self._buffer) >= self.sync_every
+                    or time.monotonic() - self._last_sync >= self.sync_interval):
+                self._sync()
+
+    def sync(self):
+        """Write and fsync every buffered ID."""
+        with self._lock:
+            self._sync()
+
+    def close(self):
+        """Sync the journal and, with a URL database, fold it into `processed`."""
+        if self._file is None:
+            return
+        self.sync()
+        if self.url_db_name and self.processed:
+            self._fold_into_db()
+        self._file.close()
+        self._file = None
+
+    def _sync(self):
+        if self._buffer:
+            self._file.write("".join(self._buffer))
+            self._buffer = []
+            self._fsync()
+        self._last_sync = time.monotonic()
+
+    def _fsync(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def _read_journal(self):
+        processed = set()
+        if not os.path.exists(self.journal_file):
+            return processed
+        with open(self.journal_file, "r+b") as f:
+            journal = f.read()
+            # A crash can leave a torn last line without its newline: drop it, or
+            # the next ID appended would be glued onto it
+            end = journal.rfind(b"\n") + 1
+            if end < len(journal):
+                f.truncate(end)
+        for line in journal[:end].splitlines():
+            if line.strip().isdigit():
+                processed.add(int(line))
+        return processed
+
+    def _fold_into_db(self):
+        with closing(sqlite3.connect(self.url_db_name, timeout=30.0)) as conn:
+            conn.execute("PRAGMA busy_timeout=30000")
+            with conn:
+                conn.executemany(f"UPDATE {self.url_table} SET processed = 1 WHERE id = ?",
+                                 ((row_id,) for row_id in self.processed))
+        # The flags are committed, so the journal can start over
+        with self._lock:
+            self._file.truncate(0)
+            self._fsync()
+            self.processed = set()
@@ -0,0 +1,524 @@
+import argparse
+import csv
+import json
+import os
+import pathlib
+import re
+import sqlite3
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import closing
+
+from extractor import PRODUCTS_VERSION_COLUMN
+from spec_store import SPEC_TABLE
+from sqlite_sink import user_tables
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # CSV export still works
+    pa = pq = None
+
+# Columnar export of the scraper databases for analytics. Every table is
+# read twice in rowid order: the first pass infers a type per column, the
+# second writes `<table>.parquet` and/or `<table>-00001.csv`, ... with the
+# converted values. Tables are exported in parallel, one process each, and
+# the same database always produces byte-identical files.
+#
+# Later runs of export_changes() write only the rows added or changed since
+# the previous run as `<table>.delta-000001.*` files; compact() merges the
+# deltas back into the base files. `manifest.json` keeps the files, types
+# and watermark of every table.
+FORMATS = ("parquet", "csv")
+BOOL_VALUES = {"yes": True, "true": True, "no": False, "false": False}
+# No leading zeros, so part numbers and codes like "007" stay text
+INT_PATTERN = re.compile(r"[+-]?(?:0|[1-9]\d*)")
+FLOAT_PATTERN = re.compile(r"[+-]?(?:(?:0|[1-9]\d*)(?:\.\d+)?|\.\d+)(?:[eE][+-]?\d+)?")
+INT64_MAX = 2 ** 63 - 1
+# Uncompressed bytes per Parquet row group: large enough for fast scans,
+# small enough that one group of a wide table fits comfortably in memory
+ROW_GROUP_BYTES = 64 * 1024 * 1024
+CSV_CHUNK_ROWS = 500_000
+FETCH_SIZE = 2000
+MANIFEST = "manifest.json"
+# Tables with a version column written by the sink (version_column=...) are
+# tracked by it, so changed rows are exported again; the others by rowid,
+# which only picks up new rows
+VERSION_COLUMNS = (PRODUCTS_VERSION_COLUMN,)
+# Column identifying a row across exports; compaction keeps its newest row.
+# A table tracked by rowid needs one: a row rewritten with INSERT OR REPLACE
+# gets a new rowid and reaches a delta, and only the key tells compaction
+# which older row it replaces. Keyless rowid tables are re-exported in full.
+KEY_COLUMNS = {"products": "Url", SPEC_TABLE: "url"}
+
+def require_pyarrow():
+    if pa is None:
+        raise RuntimeError("Parquet export requires pyarrow (pip install pyarrow)")
+
+class ColumnType:
+    """Narrowest type that fits every non-null value seen so far."""
+
+    def __init__(self):
+        self.seen = False
+        self.can_bool = True
+        self.can_int = True
+        self.can_float = True
+
+    @classmethod
+    def from_name(cls, name):
+        """The flags of a column already exported as `name`."""
+        column_type = cls()
+        column_type.seen = True
+        column_type.can_bool = name == "bool"
+        column_type.can_int = name == "int64"
+        column_type.can_float = name in ("int64", "float64")
+        return column_type
+
+    def merge(self, other):
+        """Narrowest type that fits the values of both columns."""
+        if not other.seen:
+            return self
+        if not self.seen:
+            return other
+        merged = ColumnType()
+        merged.seen = True
+        merged.can_bool = self.can_bool and other.can_bool
+        merged.can_int = self.can_int and other.can_int
+        merged.can_float = self.can_float and other.can_float
+        return merged
+
+    def add(self, value):
+        if value is None:
+            return
+        self.seen = True
+        if isinstance(value, int):
+            self.can_bool = False
+            self.can_int = self.can_int and -INT64_MAX - 1 <= value <= INT64_MAX
+        elif isinstance(value, float):
+            self.can_bool = self.can_int = False
+        elif isinstance(value, str):
+            text = value.strip()
+            self.can_bool = self.can_bool and text.lower() in BOOL_VALUES
+            if self.can_int:
+                self.can_int = INT_PATTERN.fullmatch(text) is not None and abs(int(text)) <= INT64_MAX
+            self.can_float = self.can_float and FLOAT_PATTERN.fullmatch(text) is not None
+        else:
+            self.can_bool = self.can_int = self.can_float = False
+
+    @property
+    def name(self):
+        if not self.seen:
+            return "string"
+        if self.can_bool:
+            return "bool"
+        if self.can_int:
+            return "int64"
+        if self.can_float:
+            return "float64"
+        return "string"
+
+def convert(value, type_name):
+    """Convert a SQLite (or already exported) value to the column type."""
+    if value is None:
+        return None
+    if type_name == "bool":
+        return value if isinstance(value, bool) else BOOL_VALUES[value.strip().lower()]
+    if type_name == "int64":
+        return int(value.strip()) if isinstance(value, str) else value
+    if type_name == "float64":
+        return float(value.strip()) if isinstance(value, str) else float(value)
+    if isinstance(value, bytes):
+        return value.decode("utf-8", errors="replace")
+    return str(value)
+
+def csv_value(value):
+    if value is None:
+        return ""
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    return value
+
+def connect_read_only(db_file):
+    return sqlite3.connect(pathlib.Path(db_file).absolute().as_uri() + "?mode=ro", uri=True)
+
+def list_tables(db_file):
+    """Tables to export, in name order, without the search index and its shadow tables."""
+    with closing(connect_read_only(db_file)) as conn:
+        return sorted(user_tables(conn))
+
+def watermark_column(conn, table_name):
+    """The table's version column if it has one, else rowid."""
+    columns = {row[1].lower(): row[1] for row in conn.execute(f'PRAGMA table_info("{table_name}")')}
+    return next((columns[name.lower()] for name in VERSION_COLUMNS if name.lower() in columns), "rowid")
+
+def read_rows(conn, table_name, since=None, order_by="rowid"):
+    """Return (column names, row iterator), optionally only rows with `order_by` > `since`."""
+    where = f' WHERE "{order_by}" > ?' if since is not None else ""
+    cursor = conn.execute(f'SELECT * FROM "{table_name}"{where} ORDER BY "{order_by}"',
+                          () if since is None else (since,))
+    columns = [description[0] for description in cursor.description]
+
+    def rows():
+        while True:
+            chunk = cursor.fetchmany(FETCH_SIZE)
+            if not chunk:
+                return
+            yield from chunk
+    return columns, rows()
+
+def infer_types(rows, columns):
+    """Return (ColumnType per column, row count, mean row size in bytes)."""
+    types = [ColumnType() for _ in columns]
+    row_count = total_bytes = 0
+    for row in rows:
+        row_count += 1
+        for column_type, value in zip(types, row):
+            column_type.add(value)
+            total_bytes += len(value) if isinstance(value, (str, bytes)) else 8
+    return types, row_count, total_bytes / max(1, row_count)
+
+def rows_per_group(mean_row_bytes, row_group_bytes=ROW_GROUP_BYTES):
+    return int(min(1_000_000, max(1000, row_group_bytes // max(1, mean_row_bytes))))
+
+ARROW_TYPES = {"bool": "bool_", "int64": "int64", "float64": "float64", "string": "string"}
+
+class TableWriter:
+    """Writes converted rows to `<stem>.parquet` and/or `<stem>-00001.csv`, ...
+
+    Files are written under a .tmp name and only renamed into place by
+    close(), so an interrupted export never replaces a complete one.
+    """
+
+    def __init__(self, output_dir, stem, columns, type_names, formats, group_rows, csv_chunk_rows):
+        self.output_dir = output_dir
+        self.stem = stem
+        self.columns = columns
+        self.formats = formats
+        self.group_rows = group_rows
+        self.csv_chunk_rows = csv_chunk_rows
+        self.paths = []
+        self._group = []
+        self._parquet = None
+        self._csv_file = None
+        self._csv_writer = None
+        self._csv_rows = 0
+        if "parquet" in formats:
+            schema = pa.schema([(column, getattr(pa, ARROW_TYPES[type_name])())
+                                for column, type_name in zip(columns, type_names)])
+            path = os.path.join(output_dir, f"{stem}.parquet")
+            self._parquet = pq.ParquetWriter(path + ".tmp", schema, compression="zstd")
+            self.paths.append(path)
+
+    def write(self, row):
+        """Write one row of converted values, in column order."""
+        if "csv" in self.formats:
+            if self._csv_file is None or self._csv_rows == self.csv_chunk_rows:
+                self._next_csv()
+            self._csv_writer.writerow([csv_value(value) for value in row])
+            self._csv_rows += 1
+        if self._parquet is not None:
+            self._group.append(row)
+            if len(self._group) == self.group_rows:
+                self._write_row_group()
+
+    def _next_csv(self):
+        if self._csv_file is not None:
+            self._csv_file.close()
+        path = os.path.join(self.output_dir, f"{self.stem}-{len(self.paths) + 1 - bool(self._parquet):05d}.csv")
+        self.paths.append(path)
+        self._csv_file = open(path + ".tmp", "w", newline="", encoding="utf-8")
+        self._csv_writer = csv.writer(self._csv_file)
+        self._csv_writer.writerow(self.columns)
+        self._csv_rows = 0
+
+    def _write_row_group(self):
+        schema = self._parquet.schema
+        arrays = [pa.array(values, type=field.type) for values, field in zip(zip(*self._group), schema)]
+        self._parquet.write_table(pa.Table.from_arrays(arrays, schema=schema))
+        self._group = []
+
+    def close(self, complete=True):
+        """Finish the files; returns their names, or discards them if not `complete`."""
+        try:
+            if self._parquet is not None:
+                if complete and self._group:
+                    self._write_row_group()
+                self._parquet.close()
+        finally:
+            if self._csv_file is not None:
+                self._csv_file.close()
+        for path in self.paths:
+            if complete:
+                os.replace(path + ".tmp", path)
+            elif os.path.exists(path + ".tmp"):
+                os.remove(path + ".tmp")
+        return [os.path.basename(path) for path in self.paths]
+
+def write_part(conn, table_name, output_dir, stem, formats, row_group_bytes, csv_chunk_rows,
+               since=None, order_by="rowid", base_columns=None):
+    """Export the matching rows of one table; returns the part's manifest entry.
+
+    Columns already exported with another type are widened so that every
+    part of a table can be merged by compact().
+    """
+    columns, rows = read_rows(conn, table_name, since, order_by)
+    types, row_count, mean_row_bytes = infer_types(rows, columns)
+    for i, column in enumerate(columns):
+        if base_columns and column in base_columns:
+            types[i] = ColumnType.from_name(base_columns[column]).merge(types[i])
+    type_names = [column_type.name for column_type in types]
+    group_rows = rows_per_group(mean_row_bytes, row_group_bytes)
+
+    writer = TableWriter(output_dir, stem, columns, type_names, formats, group_rows, csv_chunk_rows)
+    try:
+        _, rows = read_rows(conn, table_name, since, order_by)
+        for row in rows:
+            writer.write([convert(value, type_name) for value, type_name in zip(row, type_names)])
+    except BaseException:
+        writer.close(complete=False)
+        raise
+    return {
+        "rows": row_count,
+        "columns": [[column, type_name] for column, type_name in zip(columns, type_names)],
+        "row_group_rows": group_rows if "parquet" in formats else None,
+        "files": writer.close(),
+    }
+
+def export_table(db_file, table_name, output_dir, formats=FORMATS, row_group_bytes=ROW_GROUP_BYTES,
+                 csv_chunk_rows=CSV_CHUNK_ROWS):
+    """Export one table in full; returns its manifest entry. Runs in a worker process."""
+    with closing(connect_read_only(db_file)) as conn:
+        # One read transaction, so both passes and the watermark see the same rows
+        conn.execute("BEGIN")
+        column = watermark_column(conn, table_name)
+        watermark = conn.execute(f'SELECT MAX("{column}") FROM "{table_name}"').fetchone()[0] or 0
+        entry = write_part(conn, table_name, output_dir, table_name, formats, row_group_bytes, csv_chunk_rows)
+    return {**entry, "formats": list(formats), "watermark_column": column, "watermark": watermark, "deltas": []}
+
+def export_table_changes(db_file, table_name, output_dir, entry, row_group_bytes=ROW_GROUP_BYTES,
+                         csv_chunk_rows=CSV_CHUNK_ROWS):
+    """Export the rows added or changed since `entry`'s watermark as the next delta."""
+    with closing(connect_read_only(db_file)) as conn:
+        conn.execute("BEGIN")
+        column = watermark_column(conn, table_name)
+        if column != entry["watermark_column"]:
+            # The table gained a version column: versions and rowids are not comparable
+            return None
+        watermark = conn.execute(f'SELECT MAX("{column}") FROM "{table_name}"').fetchone()[0] or 0
+        if watermark <= entry["watermark"]:
+            return entry
+        known = dict(entry["columns"])
+        for delta in entry["deltas"]:
+            known.update(delta["columns"])
+        stem = f"{table_name}.delta-{len(entry['deltas']) + 1:06d}"
+        delta = write_part(conn, table_name, output_dir, stem, entry["formats"], row_group_bytes, csv_chunk_rows,
+                           since=entry["watermark"], order_by=column, base_columns=known)
+    return {**entry, "watermark": watermark, "deltas": entry["deltas"] + [{**delta, "watermark": watermark}]}
+
+def read_part(output_dir, part, formats):
+    """Yield the rows of one exported part as dicts."""
+    if "parquet" in formats:
+        parquet_file = pq.ParquetFile(os.path.join(output_dir, next(
+            name for name in part["files"] if name.endswith(".parquet"))))
+        for batch in parquet_file.iter_batches(batch_size=FETCH_SIZE):
+            yield from batch.to_pylist()
+        return
+    for name in part["files"]:
+        with open(os.path.join(output_dir, name), newline="", encoding="utf-8") as f:
+            for row in csv.DictReader(f):
+                yield {column: value if value != "" else None for column, value in row.items()}
+
+def compact_table(output_dir, table_name, entry, key_column=None, csv_chunk_rows=CSV_CHUNK_ROWS):
+    """Merge a table's deltas into its base files; returns the new manifest entry.
+
+    With `key_column`, only the newest row of each key is kept. Without one
+    the parts are concatenated, which is right for tables that only grow.
+    """
+    if not entry["deltas"]:
+        return entry
+    formats = entry["formats"]
+    parts = [entry] + entry["deltas"]
+    types = {}
+    for part in parts:
+        for column, type_name in part["columns"]:
+            types[column] = types.get(column, ColumnType()).merge(ColumnType.from_name(type_name))
+    columns = list(types)
+    type_names = [types[column].name for column in columns]
+    # SQLite column names are case-insensitive: complete.py's products has "url"
+    key_column = next((column for column in types if key_column and column.lower() == key_column.lower()), None)
+
+    # Where the newest row of every key changed in a delta is
+    newest = {}
+    if key_column:
+        for part_index, part in enumerate(parts[1:], 1):
+            for row_index, row in enumerate(read_part(output_dir, part, formats)):
+                if row.get(key_column) is not None:
+                    newest[row[key_column]] = (part_index, row_index)
+
+    writer = TableWriter(output_dir, table_name, columns, type_names, formats,
+                         entry["row_group_rows"] or 1000, csv_chunk_rows)
+    row_count = 0
+    try:
+        for part_index, part in enumerate(parts):
+            for row_index, row in enumerate(read_part(output_dir, part, formats)):
+                key = row.get(key_column) if key_column else None
+                if key is not None and newest.get(key, (part_index, row_index)) != (part_index, row_index):
+                    continue
+                writer.write([convert(row.get(column), type_name)
+                              for column, type_name in zip(columns, type_names)])
+                row_count += 1
+    except BaseException:
+        writer.close(complete=False)
+        raise
+    files = writer.close()
+
+    # Base CSV chunks beyond the new count and every delta file are now stale
+    for part in parts:
+        for name in part["files"]:
+            if name not in files:
+                os.remove(os.path.join(output_dir, name))
+    return {**entry, "rows": row_count, "columns": [[column, type_name] for column, type_name
+                                                    in zip(columns, type_names)],
+            "files": files, "deltas": []}
+
+def load_manifest(output_dir):
+    path = os.path.join(output_dir, MANIFEST)
+    if not os.path.exists(path):
+        return {}
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+def save_manifest(output_dir, manifest):
+    path = os.path.join(output_dir, MANIFEST)
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True, ensure_ascii=False)
+    os.replace(path + ".tmp", path)
+
+def run_per_table(jobs, workers=None):
+    """Run {table: (fn, *args)} in a process pool; yields (table, result) in table order."""
+    if not jobs:
+        return
+    with ProcessPoolExecutor(max_workers=workers or min(len(jobs), os.cpu_count() or 1)) as executor:
+        futures = {table_name: executor.submit(*job) for table_name, job in jobs.items()}
+        for table_name, future in futures.items():
+            yield table_name, future.result()
+
+def describe(entry):
+    return ", ".join(entry["files"]) or "no files"
+
+def export_tables(db_file, output_dir, formats=FORMATS, tables=None, workers=None,
+                  row_group_bytes=ROW_GROUP_BYTES, csv_chunk_rows=CSV_CHUNK_ROWS):
+    """Export every table (or `tables`) of `db_file` in full, in parallel; returns the manifest.
+
+    The manifest is also written to `manifest.json` in `output_dir`: row
+    count, inferred column types, files and watermark per table.
+    """
+    if "parquet" in formats:
+        require_pyarrow()
+    os.makedirs(output_dir, exist_ok=True)
+    manifest = load_manifest(output_dir)
+    jobs = {table_name: (export_table, db_file, table_name, output_dir, formats, row_group_bytes, csv_chunk_rows)
+            for table_name in tables or list_tables(db_file)}
+    for table_name, entry in run_per_table(jobs, workers):
+        # A full export supersedes the table's deltas
+        for delta in manifest.get(table_name, {}).get("deltas", []):
+            for name in delta["files"]:
+                os.remove(os.path.join(output_dir, name))
+        manifest[table_name] = entry
+        save_manifest(output_dir, manifest)
+        print(f"Exported {entry['rows']} rows of table '{table_name}' to {describe(entry)}")
+    return manifest
+
+def export_changes(db_file, output_dir, formats=FORMATS, tables=None, workers=None,
+                   row_group_bytes=ROW_GROUP_BYTES, csv_chunk_rows=CSV_CHUNK_ROWS, key_columns=KEY_COLUMNS):
+    """Export only the rows added or changed since the last export, as delta files.
+
+    Tables without a previous export (or whose watermark column changed) are
+    exported in full, as are tables tracked by rowid without a key in
+    `key_columns`, whose deltas compaction could not merge. Returns the
+    updated manifest.
+    """
+    manifest = load_manifest(output_dir)
+    if any("parquet" in entry["formats"] for entry in manifest.values()):
+        require_pyarrow()
+    tables = tables or list_tables(db_file)
+
+    def deltas_allowed(table_name):
+        entry = manifest.get(table_name)
+        return entry is not None and (entry["watermark_column"] != "rowid" or table_name in key_columns)
+
+    jobs = {table_name: (export_table_changes, db_file, table_name, output_dir, manifest[table_name],
+                         row_group_bytes, csv_chunk_rows)
+            for table_name in tables if deltas_allowed(table_name)}
+    full = [table_name for table_name in tables if not deltas_allowed(table_name)]
+    for table_name, entry in run_per_table(jobs, workers):
+        if entry is None:
+            full.append(table_name)
+        elif entry["deltas"] != manifest[table_name]["deltas"]:
+            manifest[table_name] = entry
+            save_manifest(output_dir, manifest)
+            delta = entry["deltas"][-1]
+            print(f"Exported {delta['rows']} changed rows of table '{table_name}' to {describe(delta)}")
+        else:
+            print(f"No changes in table '{table_name}'")
+    if full:
+        manifest = export_tables(db_file, output_dir, formats, full, workers, row_group_bytes, csv_chunk_rows)
+    return manifest
+
+def compact(output_dir, tables=None, workers=None, key_columns=KEY_COLUMNS, csv_chunk_rows=CSV_CHUNK_ROWS):
+    """Merge every table's delta files into its base files; returns the manifest."""
+    manifest = load_manifest(output_dir)
+    if any("parquet" in entry["formats"] for entry in manifest.values()):
+        require_pyarrow()
+    jobs = {table_name: (compact_table, output_dir, table_name, entry, key_columns.get(table_name),
+                         csv_chunk_rows)
+            for table_name, entry in manifest.items()
+            if entry["deltas"] and (not tables or table_name in tables)}
+    for table_name, entry in run_per_table(jobs, workers):
+        deltas = len(manifest[table_name]["deltas"])
+        manifest[table_name] = entry
+        save_manifest(output_dir, manifest)
+        print(f"Merged {deltas} deltas of table '{table_name}' into {describe(entry)} ({entry['rows']} rows)")
+    return manifest
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export SQLite tables to Parquet and/or chunked CSV.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    def add_export_options(command_parser):
+        command_parser.add_argument("--db", default="Products.db")
+        command_parser.add_argument("--format", choices=FORMATS + ("both",), default="both")
+        command_parser.add_argument("--csv-chunk-rows", type=int, default=CSV_CHUNK_ROWS, help="rows per CSV file")
+        command_parser.add_argument("--row-group-mb", type=int, default=ROW_GROUP_BYTES // (1024 * 1024),
+                                    help="target uncompressed size of a Parquet row group")
+
+    export_parser = commands.add_parser("export", help="export every table in full")
+    add_export_options(export_parser)
+    changes_parser = commands.add_parser("changes", help="export rows changed since the last export as deltas")
+    add_export_options(changes_parser)
+    compact_parser = commands.add_parser("compact", help="merge the delta files into the base files")
+    for command_parser in (changes_parser, compact_parser):
+        command_parser.add_argument("--key", action="append", default=[], metavar="TABLE=COLUMN",
+                                    help="column identifying a row of TABLE (default: products=Url, "
+                                         "product_specs=url)")
+    for command_parser in (export_parser, changes_parser, compact_parser):
+        command_parser.add_argument("--output-dir", default="export")
+        command_parser.add_argument("--table", action="append", dest="tables",
+                                    help="table to process (repeatable; default all)")
+        command_parser.add_argument("--workers", type=int, default=None,
+                                    help="tables processed at once (default: cores)")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    key_columns = {**KEY_COLUMNS, **dict(key.split("=", 1) for key in getattr(args, "key", []))}
+    formats = FORMATS if getattr(args, "format", "both") == "both" else (args.format,)
+    if args.command == "compact":
+        compact(args.output_dir, args.tables, args.workers, key_columns)
+    elif args.command == "changes":
+        export_changes(args.db, args.output_dir, formats, tables=args.tables, workers=args.workers,
+                       row_group_bytes=args.row_group_mb * 1024 * 1024, csv_chunk_rows=args.csv_chunk_rows,
+                       key_columns=key_columns)
+    else:
+        export_tables(args.db, args.output_dir, formats, tables=args.tables, workers=args.workers,
+                      row_group_bytes=args.row_group_mb * 1024 * 1024, csv_chunk_rows=args.csv_chunk_rows)
+    print(f"{args.command.capitalize()} finished in {time.perf_counter() - start:.2f}s")
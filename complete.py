@@ -1,19 +1,49 @@
 import sqlite3
-from playwright.sync_api import sync_playwright
+import asyncio
+import argparse
+import queue
+import threading
 import requests
-from bs4 import BeautifulSoup
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from contextlib import closing
+from concurrent.futures import ThreadPoolExecutor
 import json
-import os
-from datetime import datetime
-import traceback
+from functools import partial
+import time
+from contextlib import closing
+from urllib.parse import urljoin
+
+from checkpoint import Checkpoint
+from concurrency import AdaptiveLimiter, submit_bounded
+from discovery import DiscoveryUnsupported, discover_brand_models, discover_brands
+from error_log import ErrorLog
+from extractor import PRODUCTS_VERSION_COLUMN, extract_product_page
+from proxy_scheduler import ProxyScheduler, proxy_ok
+from session_pool import SessionPool
+from search_index import SEARCH_SCHEMA_SQL, queue_search_entry
+from spec_store import SPEC_SCHEMA_SQL, queue_specs
+from sqlite_sink import enable_wal, get_sink, close_sinks
+from url_store import iter_url_rows
+
+try:
+    from playwright.sync_api import sync_playwright
+    from playwright.async_api import async_playwright, TimeoutError as PlaywrightTimeoutError
+except ImportError:  # Only needed for browser discovery
+    sync_playwright = async_playwright = PlaywrightTimeoutError = None
 
 # Global Database Names
 BRANDS_DB = "Brands.db"
 PRODUCTS_DB = "Products.db"
-progress_file = "progress.json"
-error_log_file = "error_log.txt"
+progress_file = "progress.json"  # Legacy format, migrated into the checkpoint journal
+checkpoint_file = "progress.journal"
+error_log_file = "error_log.jsonl"  # See error_log.py summary
+
+SITE_URL = "https://www.laptoparena.net/"
+
+headers = {
+    "User-Agent": (
+        "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 "
+        "(KHTML, like Gecko) Chrome/114.0.0.0 Safari/537.36"
+    )
+}
 
 # Proxy Configuration
 username = ""
@@ -22,20 +52,29 @@ proxy_base = ""
 starting_port = 8001
 max_port = 9000
 
+# Keep-alive sessions reused across URLs, one pool per proxy port
+session_pool = SessionPool()
+# Health-weighted port choice across the whole range
+proxy_scheduler = ProxyScheduler(range(starting_port, max_port + 1))
+
+# Worker threads are the ceiling; the limiter adapts in-flight requests below it
+max_workers = 50
+concurrency_limiter = AdaptiveLimiter(initial=10, maximum=max_workers)
+
+# Model discovery: brands are loaded this many at once (HTTP threads, or
+# browser contexts with --browser async)
+discovery_contexts = 4
+# Nothing on the listing pages needs these to find model links
+BLOCKED_RESOURCE_TYPES = {"image", "font", "stylesheet", "media"}
+MODEL_LINK_SELECTOR = ".product_container .product a"
+LOAD_MORE_SELECTOR = ".load_more_products"
+# How long to wait for a "load more" click to add products before giving up
+load_more_timeout = 15000
+
 # Utility Functions
-def log_error(error_message, url_id=None, url=None):
-    """Log errors to error_log.txt with timestamp and details."""
-    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    with open(error_log_file, "a", encoding='utf-8') as f:
-        error_entry = f"""
-[{timestamp}]
-URL ID: {url_id if url_id else 'N/A'}
-URL: {url if url else 'N/A'}
-Error: {error_message}
-Stack Trace: {traceback.format_exc()}
-{'=' * 80}
-"""
-        f.write(error_entry)
+# Errors are queued and written as JSON lines by a background thread
+error_log = ErrorLog(error_log_file)
+log_error = error_log.log
 
 def get_proxies(port):
     proxy = f"{proxy_base}:{port}"
@@ -43,20 +82,18 @@ def get_proxies(port):
         "https": f"https://user-{username}:{password}@{proxy}",
     }
 
-def load_progress():
-    if os.path.exists(progress_file):
-        with open(progress_file, "r") as f:
-            return json.load(f)
-    return {}
-
-def save_progress(progress):
-    with open(progress_file, "w") as f:
-        json.dump(progress, f)
+def get_products_sink():
+    """Return the batched writer for the products table."""
+    # Upserted on url, so a re-scraped page updates its specs instead of being ignored; the
+    # RowVersion stamp lets columnar_export.py changes and variants.py pick up updated rows
+    return get_sink(PRODUCTS_DB, table="products", key_column="url", unchanged_columns=("specs", "images"),
+                    version_column=PRODUCTS_VERSION_COLUMN, create_sql=(*SPEC_SCHEMA_SQL, *SEARCH_SCHEMA_SQL),
+                    dynamic_columns=False, log_error=log_error)
 
 def get_db_connection(db_name):
     """Create a new database connection."""
     conn = sqlite3.connect(db_name, timeout=30.0)
-    conn.execute("PRAGMA journal_mode=WAL")
+    enable_wal(conn)
     conn.execute("PRAGMA busy_timeout=30000")
     return conn
 
@@ -70,9 +107,13 @@ def setup_databases():
         CREATE TABLE IF NOT EXISTS models (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             brand TEXT NOT NULL,
-            url TEXT NOT NULL UNIQUE
+            url TEXT NOT NULL UNIQUE,
+            processed INTEGER DEFAULT 0
         )
     """)
+    cursor.execute("PRAGMA table_info(models)")
+    if "processed" not in {row[1] for row in cursor.fetchall()}:
+        cursor.execute("ALTER TABLE models ADD COLUMN processed INTEGER DEFAULT 0")
     conn.commit()
     conn.close()
 
@@ -93,41 +134,58 @@ def setup_databases():
     conn.close()
 
 # Scrape Brand URLs
+def block_heavy_resources(route):
+    if route.request.resource_type in BLOCKED_RESOURCE_TYPES:
+        route.abort()
+    else:
+        route.continue_()
+
+def require_playwright():
+    if sync_playwright is None:
+        raise RuntimeError("Browser discovery requires playwright (pip install playwright)")
+
 def scrape_brand_urls():
     """Scrape brand URLs from the main website."""
+    require_playwright()
     brands = []
     with sync_playwright() as p:
         browser = p.chromium.launch(headless=True)
         page = browser.new_page()
-        CATEGORY_PAGE_URL = "https://www.laptoparena.net/"
-        page.goto(CATEGORY_PAGE_URL)
+        page.route("**/*", block_heavy_resources)
+        page.goto(SITE_URL)
 
         brand_elements = page.query_selector_all(".brand a.brand-link")
         for element in brand_elements:
             brand_name = element.inner_text().strip()
             relative_url = element.get_attribute("href")
-            full_url = f"https://www.laptoparena.net{relative_url}"
+            full_url = urljoin(SITE_URL, relative_url)
             brands.append((brand_name, full_url))
 
         browser.close()
     return brands
 
 # Load All Models
-def load_all_models(page, brand_name):
-    """Load all models for a brand."""
+def load_all_models(page, brand_name, on_model=None):
+    """Load all models for a brand.
+
+    With `on_model(brand, url)` models are handed over as they appear
+    instead of being returned.
+    """
     model_data = []
     unique_urls = set()
     while True:
-        model_elements = page.query_selector_all(".product_container .product a")
+        model_elements = page.query_selector_all(MODEL_LINK_SELECTOR)
         for element in model_elements:
-            model_name = element.inner_text().strip()
             relative_url = element.get_attribute("href")
-            full_url = f"https://www.laptoparena.net{relative_url}"
+            full_url = urljoin(SITE_URL, relative_url)
             if full_url not in unique_urls:
                 unique_urls.add(full_url)
-                model_data.append((brand_name, full_url))
+                if on_model:
+                    on_model(brand_name, full_url)
+                else:
+                    model_data.append((brand_name, full_url))
 
-        load_more_button = page.query_selector(".load_more_products")
+        load_more_button = page.query_selector(LOAD_MORE_SELECTOR)
         if load_more_button:
             load_more_button.click()
             page.wait_for_timeout(2000)
@@ -135,125 +193,404 @@ def load_all_models(page, brand_name):
             break
     return model_data
 
+async def block_heavy_resources_async(route):
+    if route.request.resource_type in BLOCKED_RESOURCE_TYPES:
+        await route.abort()
+    else:
+        await route.continue_()
+
+async def load_all_models_async(page, brand_name, on_model=None):
+    """Load all models for a brand by clicking "load more" until it runs out.
+
+    Each round reads only the links added since the previous one, in a single
+    round trip, and waits for new links (or network idle) instead of a fixed
+    sleep. With `on_model(brand, url)` models are handed over as they appear
+    instead of being returned.
+    """
+    model_data = []
+    unique_urls = set()
+    scanned = 0
+    while True:
+        new_links = await page.eval_on_selector_all(
+            MODEL_LINK_SELECTOR,
+            "(elements, start) => elements.slice(start).map(e => [e.innerText.trim(), e.getAttribute('href')])",
+            scanned,
+        )
+        scanned += len(new_links)
+        for model_name, relative_url in new_links:
+            full_url = urljoin(SITE_URL, relative_url)
+            if full_url not in unique_urls:
+                unique_urls.add(full_url)
+                if on_model:
+                    on_model(brand_name, full_url)
+                else:
+                    model_data.append((brand_name, full_url))
+
+        load_more_button = await page.query_selector(LOAD_MORE_SELECTOR)
+        if load_more_button is None or not await load_more_button.is_visible():
+            break
+        await load_more_button.click()
+        try:
+            await page.wait_for_function(
+                "([selector, count]) => document.querySelectorAll(selector).length > count",
+                arg=[MODEL_LINK_SELECTOR, scanned], timeout=load_more_timeout,
+            )
+        except PlaywrightTimeoutError:
+            # Nothing new appeared: let pending requests settle, then stop if still nothing
+            try:
+                await page.wait_for_load_state("networkidle", timeout=load_more_timeout)
+            except PlaywrightTimeoutError:
+                pass
+            count = await page.eval_on_selector_all(MODEL_LINK_SELECTOR, "elements => elements.length")
+            if count <= scanned:
+                break
+    return model_data
+
 # Scrape Models for Each Brand
-def scrape_models_for_brands(brand_data):
-    """Scrape models for each brand."""
+async def scrape_models_for_brands_async(brand_data, contexts=None, on_model=None):
+    """Scrape models for each brand, `contexts` brands at a time."""
+    require_playwright()
+    contexts = contexts or discovery_contexts
+    all_models = []
+    pending = iter(brand_data)
+
+    async def worker(context):
+        # Workers share one iterator, so each brand is loaded exactly once
+        for brand_name, brand_url in pending:
+            page = await context.new_page()
+            try:
+                await page.goto(brand_url)
+                models = await load_all_models_async(page, brand_name, on_model)
+                all_models.extend(models)
+                print(f"Loaded models for {brand_name}")
+            except Exception as e:
+                log_error(f"Error loading models for brand {brand_name}: {e}", url=brand_url)
+            finally:
+                await page.close()
+
+    async with async_playwright() as p:
+        browser = await p.chromium.launch(headless=True)
+        browser_contexts = []
+        for _ in range(max(1, min(contexts, len(brand_data)))):
+            context = await browser.new_context()
+            await context.route("**/*", block_heavy_resources_async)
+            browser_contexts.append(context)
+        await asyncio.gather(*(worker(context) for context in browser_contexts))
+        await browser.close()
+    return all_models
+
+def scrape_models_for_brands(brand_data, on_model=None, browser_engine="sync"):
+    """Scrape models for each brand.
+
+    The sync engine loads one brand at a time. `browser_engine="async"` loads
+    `discovery_contexts` brands at once with event-driven waits
+    (scrape_models_for_brands_async); check it with `benchmarks.py browser`
+    before relying on it.
+    """
+    if browser_engine == "async":
+        return asyncio.run(scrape_models_for_brands_async(brand_data, on_model=on_model))
+    require_playwright()
     all_models = []
     with sync_playwright() as p:
         browser = p.chromium.launch(headless=True)
         for brand_name, brand_url in brand_data:
             page = browser.new_page()
-            page.goto(brand_url)
-            models = load_all_models(page, brand_name)
-            all_models.extend(models)
-            page.close()
+            page.route("**/*", block_heavy_resources)
+            try:
+                page.goto(brand_url)
+                all_models.extend(load_all_models(page, brand_name, on_model))
+                print(f"Loaded models for {brand_name}")
+            except Exception as e:
+                log_error(f"Error loading models for brand {brand_name}: {e}", url=brand_url)
+            finally:
+                page.close()
         browser.close()
     return all_models
 
-# Fetch Specifications
-def fetch_and_store_to_db(url, row_id, port, retries=10):
-    """Fetch product specifications and store them in the Products DB."""
-    headers = {
-        "User-Agent": (
-            "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 "
-            "(KHTML, like Gecko) Chrome/114.0.0.0 Safari/537.36"
-        )
-    }
-    base_domain = "https://www.laptoparena.net"
+# Browserless Discovery
+def fetch_html(url):
+    """Fetch a listing page or fragment through the proxy pool; None if every retry fails."""
+    response = fetch_page(url)
+    return None if response is None else response.text
+
+def discover_models_http(brand_data, on_model):
+    """Discover models by requesting the load-more endpoint directly, brands in parallel.
 
+    Every model is passed to `on_model(brand, url)` as soon as its page has
+    been read. Returns the brands left for the browser: those whose load-more
+    endpoint could not be derived, or that yielded no models.
+    """
+    fallback = []
+
+    def discover(brand):
+        brand_name, brand_url = brand
+        found = 0
+        try:
+            for model in discover_brand_models(fetch_html, brand_name, brand_url):
+                on_model(*model)
+                found += 1
+        except DiscoveryUnsupported as e:
+            log_error(f"HTTP discovery unsupported, falling back to the browser: {e}", url=brand_url)
+            found = 0
+        if found:
+            print(f"Found {found} models for {brand_name}")
+        else:
+            fallback.append(brand)
+
+    with ThreadPoolExecutor(max_workers=discovery_contexts) as executor:
+        list(executor.map(discover, brand_data))
+    return fallback
+
+def discover_all_models(discovery="http", on_model=None, browser_engine="sync"):
+    """Find every (brand, model_url), over HTTP with Playwright as the fallback.
+
+    Models go to `on_model(brand, url)` as they are found; without it they
+    are collected and returned. `browser_engine` is passed to
+    scrape_models_for_brands.
+    """
+    models = []
+    if on_model is None:
+        lock = threading.Lock()
+
+        def on_model(brand, url):
+            with lock:
+                models.append((brand, url))
+
+    if discovery == "browser":
+        scrape_models_for_brands(scrape_brand_urls(), on_model, browser_engine)
+        return models
+
+    brands = discover_brands(fetch_html, SITE_URL)
+    if not brands:
+        print("No brands found over HTTP, falling back to the browser...")
+        brands = scrape_brand_urls()
+    fallback = discover_models_http(brands, on_model)
+    if fallback:
+        print(f"Falling back to the browser for {len(fallback)} brands...")
+        scrape_models_for_brands(fallback, on_model, browser_engine)
+    return models
+
+# Fetch Specifications
+def fetch_page(url, row_id=None, retries=10):
+    """GET `url` through the proxy pool, retrying on other ports; None if every retry fails."""
+    port = None
     for attempt in range(retries):
         try:
-            proxies = get_proxies(port)
-            response = requests.get(url, headers=headers, proxies=proxies, timeout=10)
+            with concurrency_limiter.slot():
+                port = proxy_scheduler.acquire(previous=port)
+                proxies = get_proxies(port)
+                start = time.monotonic()
+                try:
+                    with session_pool.session(port, proxies) as session:
+                        response = session.get(url, headers=headers, proxies=proxies, timeout=10)
+                except requests.RequestException:
+                    elapsed = time.monotonic() - start
+                    proxy_scheduler.report(port, False, elapsed)
+                    concurrency_limiter.record(None, elapsed)
+                    raise
+                elapsed = time.monotonic() - start
+                proxy_scheduler.report(port, proxy_ok(response.status_code), elapsed)
+                concurrency_limiter.record(response.status_code, elapsed,
+                                           response.headers.get("Retry-After"))
             if response.status_code != 200:
                 if attempt == retries - 1:
-                    log_error(f"Failed with status code: {response.status_code}", row_id, url)
+                    log_error(f"Failed with status code: {response.status_code}", row_id, url,
+                              status=response.status_code)
                 raise requests.RequestException(f"Status code: {response.status_code}")
-            
-            soup = BeautifulSoup(response.content, "html.parser")
-            table = soup.find("table", class_="specs responsive")
-            gallery = soup.find("div", class_="gallery")
-            
-            if not table:
-                log_error("Specified table not found", row_id, url)
-                return False
-            
-            rows = table.find_all("tr")
-            product_data = {row.find_all("td")[0].get_text(strip=True): row.find_all("td")[1].get_text(strip=True) for row in rows if row.find_all("td")}
-
-            images = [f"{base_domain}{img.get('src')}" for img in gallery.find_all("img", class_="gallery-image")] if gallery else []
-            images_json = json.dumps(images)
-
-            product_name = product_data.get("Model Name", "Unknown")
-            brand = product_data.get("Brand", "Unknown")
-
-            with closing(get_db_connection(PRODUCTS_DB)) as conn:
-                cursor = conn.cursor()
-                cursor.execute("""
-                    INSERT OR IGNORE INTO products (brand, product_name, url, specs, images)
-                    VALUES (?, ?, ?, ?, ?)
-                """, (brand, product_name, url, json.dumps(product_data), images_json))
-                conn.commit()
-
-            return True
+            return response
 
         except Exception as e:
             if attempt == retries - 1:
-                log_error(f"Error fetching specifications: {e}", row_id, url)
-            port += 1
-            if port > max_port:
-                port = starting_port
-
-    return False
+                log_error(f"Error fetching {url}: {e}", row_id, url)
+
+    return None
+
+def fetch_and_store_to_db(url, row_id, retries=10, on_stored=None):
+    """Fetch product specifications and queue them for the Products DB."""
+    response = fetch_page(url, row_id, retries)
+    if response is None:
+        return False
+
+    page = extract_product_page(response.content)
+    
+    if page is None:
+        log_error("Specified table not found", row_id, url, category="parse")
+        return False
+    
+    product_data = page.specs
+    images_json = json.dumps(page.images)
+
+    product_name = product_data.get("Model Name", "Unknown")
+    brand = product_data.get("Brand", "Unknown")
+
+    sink = get_products_sink()
+    sink.put({
+        "brand": brand,
+        "product_name": product_name,
+        "url": url,
+        "specs": json.dumps(product_data),
+        "images": images_json,
+    })
+    queue_search_entry(sink, url, product_data)
+    queue_specs(sink, url, product_data, on_stored)
+
+    return True
 
 # Process URLs from Models DB
 def process_urls_from_db():
     """Fetch unprocessed URLs and scrape specifications."""
-    conn = get_db_connection(BRANDS_DB)
-    cursor = conn.cursor()
-    cursor.execute("SELECT id, url FROM models")
-    urls = cursor.fetchall()
-    conn.close()
-
-    progress = load_progress()
-    already_processed = progress.get("processed", [])
-
-    urls = [url for url in urls if url[0] not in already_processed]
-
-    batch_start = starting_port
-    with ThreadPoolExecutor(max_workers=10) as executor:
-        future_to_url = {
-            executor.submit(fetch_and_store_to_db, url, row_id, batch_start + (i % 100)): (row_id, url)
-            for i, (row_id, url) in enumerate(urls)
-        }
-        for future in as_completed(future_to_url):
-            row_id, url = future_to_url[future]
-            try:
-                if future.result():
-                    already_processed.append(row_id)
-                    progress["processed"] = already_processed
-                    save_progress(progress)
-            except Exception as e:
-                log_error(f"Unhandled error during URL processing: {e}", row_id, url)
+    # Opening the checkpoint folds any journal left by a crashed run into `processed`
+    checkpoint = Checkpoint(checkpoint_file, url_db_name=BRANDS_DB, url_table="models",
+                            legacy_file=progress_file).open()
+
+    # Read page by page and keep only a few tasks per worker pending
+    urls = (url for url in iter_url_rows(BRANDS_DB, "models") if url[0] not in checkpoint)
+
+    def process(item):
+        row_id, url = item
+        return fetch_and_store_to_db(url, row_id, on_stored=partial(checkpoint.mark, row_id))
+
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            for (row_id, url), future in submit_bounded(executor, process, urls, window=4 * max_workers):
+                try:
+                    future.result()
+                except Exception as e:
+                    log_error(f"Unhandled error during URL processing: {e}", row_id, url)
+    finally:
+        close_sinks()
+        checkpoint.close()
+        error_log.close()
+
+# Stream Discovery into Fetching
+class ModelFeed:
+    """Saves discovered models in small batches and queues the new ones for fetching.
+
+    Rows that existed before the run (id <= `last_existing_id`) are queued
+    separately by queue_unprocessed. Each flush queues only the rows it
+    inserted: ids only grow, so those are the batch's rows above the highest
+    id queued so far, and a model discovered again later in the run (the same
+    model listed under two pages) is not queued twice. Memory stays flat.
+    """
+
+    def __init__(self, url_queue, checkpoint, last_existing_id, batch_size=50, flush_interval=1.0):
+        self.url_queue = url_queue
+        self.checkpoint = checkpoint
+        self.last_existing_id = last_existing_id
+        self.last_queued_id = last_existing_id
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.found = 0
+        self.queued = 0
+        self._buffer = []
+        self._last_flush = time.monotonic()
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(BRANDS_DB, timeout=30.0, check_same_thread=False)
+        self._conn.execute("PRAGMA busy_timeout=30000")
+
+    def add(self, brand, url):
+        with self._lock:
+            self._buffer.append((brand, url))
+            self.found += 1
+            if (len(self._buffer) >= self.batch_size
+                    or time.monotonic() - self._last_flush >= self.flush_interval):
+                self._flush()
+
+    def close(self):
+        with self._lock:
+            self._flush()
+        self._conn.close()
+
+    def _flush(self):
+        batch, self._buffer = self._buffer, []
+        self._last_flush = time.monotonic()
+        if not batch:
+            return
+        with self._conn:
+            self._conn.executemany("INSERT OR IGNORE INTO models (brand, url) VALUES (?, ?)", batch)
+            placeholders = ", ".join("?" * len(batch))
+            new_rows = self._conn.execute(
+                f"SELECT id, url FROM models WHERE url IN ({placeholders}) AND id > ? AND processed = 0",
+                [url for _, url in batch] + [self.last_queued_id],
+            ).fetchall()
+        if new_rows:
+            self.last_queued_id = max(row[0] for row in new_rows)
+        # Blocks while the fetch queue is full, which keeps discovery's memory flat
+        for row in new_rows:
+            if row[0] not in self.checkpoint:
+                self.url_queue.put(row)
+                self.queued += 1
+
+def queue_unprocessed(url_queue, checkpoint, last_existing_id):
+    """Queue URLs left unprocessed by earlier runs, reading them page by page."""
+    for row in iter_url_rows(BRANDS_DB, "models", where=f"processed = 0 AND id <= {int(last_existing_id)}"):
+        if row[0] not in checkpoint:
+            url_queue.put(row)
+
+def fetch_worker(url_queue, checkpoint):
+    while True:
+        item = url_queue.get()
+        if item is None:
+            return
+        row_id, url = item
+        try:
+            fetch_and_store_to_db(url, row_id, on_stored=partial(checkpoint.mark, row_id))
+        except Exception as e:
+            log_error(f"Unhandled error during URL processing: {e}", row_id, url)
+
+def discover_and_process(discovery="http", queue_size=None, browser_engine="sync"):
+    """Discover models and fetch their specifications at the same time.
+
+    Discovered models are saved to the models table and queued for the
+    `max_workers` fetch threads within about a second, so fetching starts
+    as soon as the first brand page has been read. The queue is bounded, so
+    memory stays flat however large the catalogue is.
+    """
+    # Opening the checkpoint folds any journal left by a crashed run into `processed`
+    checkpoint = Checkpoint(checkpoint_file, url_db_name=BRANDS_DB, url_table="models",
+                            legacy_file=progress_file).open()
+    url_queue = queue.Queue(maxsize=queue_size or 2 * max_workers)
+    with closing(get_db_connection(BRANDS_DB)) as conn:
+        last_existing_id = conn.execute("SELECT COALESCE(MAX(id), 0) FROM models").fetchone()[0]
+
+    workers = [threading.Thread(target=fetch_worker, args=(url_queue, checkpoint), daemon=True)
+               for _ in range(max_workers)]
+    for worker in workers:
+        worker.start()
+    leftovers = threading.Thread(target=queue_unprocessed, args=(url_queue, checkpoint, last_existing_id),
+                                 daemon=True)
+    leftovers.start()
+
+    feed = ModelFeed(url_queue, checkpoint, last_existing_id)
+    try:
+        discover_all_models(discovery, on_model=feed.add, browser_engine=browser_engine)
+    finally:
+        feed.close()
+        leftovers.join()
+        for _ in workers:
+            url_queue.put(None)
+        for worker in workers:
+            worker.join()
+        close_sinks()
+        checkpoint.close()
+        error_log.close()
+    print(f"Discovered {feed.found} models, {feed.queued} new")
 
 # Main Execution
 if __name__ == "__main__":
-    setup_databases()
-
-    print("Scraping brand URLs...")
-    brands = scrape_brand_urls()
+    parser = argparse.ArgumentParser(description="Discover every model, then scrape its specifications.")
+    parser.add_argument("--discovery", choices=("http", "browser"), default="http",
+                        help="request the load-more endpoint directly (Playwright as fallback), "
+                             "or click through every brand page in Playwright")
+    parser.add_argument("--browser", choices=("sync", "async"), default="sync",
+                        help="Playwright engine: one brand at a time, or several browser contexts at once "
+                             "with event-driven waits (see benchmarks.py browser)")
+    args = parser.parse_args()
 
-    print("Scraping models for each brand...")
-    models = scrape_models_for_brands(brands)
-
-    print("Saving models to database...")
-    conn = get_db_connection(BRANDS_DB)
-    cursor = conn.cursor()
-    cursor.executemany("INSERT OR IGNORE INTO models (brand, url) VALUES (?, ?)", models)
-    conn.commit()
-    conn.close()
+    setup_databases()
 
-    print("Fetching product specifications...")
-    process_urls_from_db()
+    # Specifications are fetched while discovery is still running
+    print("Discovering models and fetching product specifications...")
+    discover_and_process(args.discovery, browser_engine=args.browser)
 
     print("All tasks completed!")
@@ -0,0 +1,235 @@
+import asyncio
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, as_completed, wait
+from contextlib import asynccontextmanager, contextmanager
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+
+# How a response status (None for a network error) is read, in one place for
+# the limiters here, proxy_scheduler.proxy_ok and error_log.classify.
+# The site wants us to slow down: the limiter backs off, the proxy port is not blamed
+THROTTLE_STATUSES = {429, 503}
+# The proxy failed (refused, blocked or a gateway error): the port is blamed,
+# the limiter ignores the response
+PROXY_ERROR_STATUSES = {None, 403, 407, 502, 504}
+
+def parse_retry_after(value):
+    """Return the delay in seconds from a Retry-After header (seconds or HTTP date)."""
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        when = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=timezone.utc)
+    return max(0.0, (when - datetime.now(timezone.utc)).total_seconds())
+
+class AIMDController:
+    """Additive-increase / multiplicative-decrease limit on in-flight requests.
+
+    Every `window` completed requests (or one limit's worth, if larger), the
+    limit grows by `increase` if the success rate is at least `min_success`
+    and p95 latency is within `target_p95`; otherwise it shrinks by
+    `decrease`. Until the first back-off the limit doubles instead (slow
+    start), so a run reaches its working level quickly. A throttling response
+    (429/503) shrinks it immediately, at most once per `backoff_interval` so
+    one burst of failures counts as a single signal. Retry-After pauses new
+    requests until the given time. Network and gateway errors are ignored:
+    they say the proxy is bad, not that the site is overloaded.
+    """
+
+    def __init__(self, initial=10, minimum=1, maximum=100, increase=1, decrease=0.5,
+                 window=20, min_success=0.95, target_p95=3.0, backoff_interval=1.0):
+        self.limit = float(min(max(initial, minimum), maximum))
+        self.minimum = minimum
+        self.maximum = maximum
+        self.increase = increase
+        self.decrease = decrease
+        self.window = window
+        self.min_success = min_success
+        self.target_p95 = target_p95
+        self.backoff_interval = backoff_interval
+        self.in_flight = 0
+        self.paused_until = 0.0
+        self.throttled = 0
+        self._outcomes = deque()
+        self._last_backoff = 0.0
+        self._slow_start = True
+
+    @property
+    def max_in_flight(self):
+        return int(self.limit)
+
+    def _record(self, status_code=None, latency=None, retry_after=None):
+        now = time.monotonic()
+        delay = parse_retry_after(retry_after) if isinstance(retry_after, str) else retry_after
+        if delay:
+            self.paused_until = max(self.paused_until, now + delay)
+
+        if status_code in PROXY_ERROR_STATUSES:
+            return
+        ok = status_code < 500
+
+        if status_code in THROTTLE_STATUSES:
+            self.throttled += 1
+            self._back_off(now)
+            return
+
+        self._outcomes.append((ok, latency))
+        if len(self._outcomes) >= max(self.window, self.max_in_flight):
+            successes = sum(1 for ok, _ in self._outcomes if ok)
+            latencies = sorted(latency for _, latency in self._outcomes if latency is not None)
+            p95 = latencies[int(len(latencies) * 0.95)] if latencies else 0.0
+            success_rate = successes / len(self._outcomes)
+            self._outcomes.clear()
+            if success_rate >= self.min_success and p95 <= self.target_p95:
+                step = self.limit if self._slow_start else self.increase
+                self.limit = min(self.maximum, self.limit + step)
+            else:
+                self._back_off(now)
+
+    def _back_off(self, now):
+        self._slow_start = False
+        if now - self._last_backoff >= self.backoff_interval:
+            self.limit = max(self.minimum, self.limit * self.decrease)
+            self._last_backoff = now
+            self._outcomes.clear()
+
+    def stats(self):
+        return {
+            "limit": self.max_in_flight,
+            "in_flight": self.in_flight,
+            "throttled": self.throttled,
+            "paused_for": round(max(0.0, self.paused_until - time.monotonic()), 2),
+        }
+
+class AdaptiveLimiter(AIMDController):
+    """Thread-safe AIMD limiter for the thread-pool fetch paths."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._condition = threading.Condition()
+
+    @contextmanager
+    def slot(self):
+        """Hold one in-flight slot for the duration of a request."""
+        self.acquire()
+        try:
+            yield
+        finally:
+            self.release()
+
+    def acquire(self):
+        with self._condition:
+            while True:
+                wait = self.paused_until - time.monotonic()
+                if wait <= 0 and self.in_flight < self.max_in_flight:
+                    self.in_flight += 1
+                    return
+                self._condition.wait(timeout=wait if wait > 0 else None)
+
+    def release(self):
+        with self._condition:
+            self.in_flight -= 1
+            self._condition.notify()
+
+    def record(self, status_code=None, latency=None, retry_after=None):
+        """Feed back one response (status_code None for a network error)."""
+        with self._condition:
+            self._record(status_code, latency, retry_after)
+            self._condition.notify_all()
+
+class AsyncAdaptiveLimiter(AIMDController):
+    """AIMD limiter for the asyncio fetch path; use from a single event loop."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._waiters = deque()
+
+    @asynccontextmanager
+    async def slot(self):
+        """Hold one in-flight slot for the duration of a request."""
+        await self.acquire()
+        try:
+            yield
+        finally:
+            self.release()
+
+    async def acquire(self):
+        while True:
+            wait = self.paused_until - time.monotonic()
+            if wait > 0:
+                await asyncio.sleep(wait)
+                continue
+            if self.in_flight < self.max_in_flight:
+                self.in_flight += 1
+                return
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append(waiter)
+            await waiter
+
+    def release(self):
+        self.in_flight -= 1
+        self._wake()
+
+    def record(self, status_code=None, latency=None, retry_after=None):
+        """Feed back one response (status_code None for a network error)."""
+        self._record(status_code, latency, retry_after)
+        self._wake()
+
+    def _wake(self):
+        free = self.max_in_flight - self.in_flight
+        while free > 0 and self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                free -= 1
+
+class ByteRateLimiter:
+    """Thread-safe token bucket capping the bytes read per second across threads.
+
+    Readers call consume() for every chunk they receive; once the bucket is
+    empty they sleep until the rate has paid for the chunk. `burst` bytes
+    (one second's worth by default) may be read without waiting.
+    """
+
+    def __init__(self, bytes_per_second, burst=None):
+        self.rate = float(bytes_per_second)
+        self.burst = float(burst if burst is not None else bytes_per_second)
+        self.consumed = 0
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def consume(self, size):
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate) - size
+            self._updated = now
+            self.consumed += size
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0.0
+        if wait:
+            time.sleep(wait)
+
+def submit_bounded(executor, fn, items, window):
+    """Run `fn(item)` for each item with at most `window` tasks pending at once.
+
+    Items are pulled from the iterable only as slots free up, so memory is
+    O(window) however many items there are. Yields (item, future) as each
+    task completes.
+    """
+    pending = {}
+    for item in items:
+        if len(pending) >= window:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield pending.pop(future), future
+        pending[executor.submit(fn, item)] = item
+    for future in as_completed(pending):
+        yield pending[future], future
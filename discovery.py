@@ -0,0 +1,104 @@
+from urllib.parse import parse_qsl, urlencode, urljoin, urlsplit, urlunsplit
+
+from bs4 import BeautifulSoup
+
+# Browserless model discovery. The brand pages list models in
+# `.product_container .product a` and append more through a
+# `.load_more_products` button; this module requests the button's pagination
+# endpoint directly instead of clicking it in Chromium. Pages are fetched
+# through a caller-supplied `fetch(url) -> html or None`, so the scrapers'
+# proxy, session and concurrency machinery is reused.
+BRAND_LINK_SELECTOR = ".brand a.brand-link"
+MODEL_LINK_SELECTOR = ".product_container .product a"
+FRAGMENT_LINK_SELECTOR = ".product a"
+LOAD_MORE_SELECTOR = ".load_more_products"
+# Attributes that may carry the endpoint and the page number of the next fragment
+ENDPOINT_ATTRIBUTES = ("data-url", "data-href", "data-endpoint", "href")
+PAGE_ATTRIBUTES = ("data-page", "data-next-page", "data-next")
+
+class DiscoveryUnsupported(Exception):
+    """The page has a load-more control whose endpoint cannot be worked out."""
+
+def parse_brand_index(html, page_url):
+    """Return [(brand_name, brand_url)] from the site's brand index page."""
+    soup = BeautifulSoup(html, "html.parser")
+    return [(link.get_text(strip=True), urljoin(page_url, link["href"]))
+            for link in soup.select(BRAND_LINK_SELECTOR) if link.get("href")]
+
+def parse_model_links(html, page_url):
+    """Return (model URLs, next fragment URL or None) from a brand page or fragment."""
+    soup = BeautifulSoup(html, "html.parser")
+    # Fragments may hold bare .product items without the surrounding container
+    links = soup.select(MODEL_LINK_SELECTOR) or soup.select(FRAGMENT_LINK_SELECTOR)
+    urls = [urljoin(page_url, link["href"]) for link in links if link.get("href")]
+    return urls, next_fragment_url(soup, page_url)
+
+def next_fragment_url(soup, page_url):
+    """Work out the request the load-more button would make, or None without one."""
+    button = soup.select_one(LOAD_MORE_SELECTOR)
+    if button is None or button.has_attr("disabled") or button.has_attr("hidden"):
+        return None
+
+    endpoint = None
+    for attribute in ENDPOINT_ATTRIBUTES:
+        value = (button.get(attribute) or "").strip()
+        if value and value != "#" and not value.startswith("javascript:"):
+            endpoint = urljoin(page_url, value)
+            break
+    page = next((button.get(attribute) for attribute in PAGE_ATTRIBUTES if button.get(attribute)), None)
+
+    if endpoint is None and page is None:
+        raise DiscoveryUnsupported(f"Load-more button without an endpoint on {page_url}")
+    if page is None:
+        return endpoint
+    # A page number alone (or next to a base endpoint) goes into the query string
+    return with_page(endpoint or page_url, str(page).strip())
+
+def with_page(url, page):
+    parts = urlsplit(url)
+    query = [(key, value) for key, value in parse_qsl(parts.query) if key != "page"]
+    query.append(("page", str(page)))
+    return urlunsplit(parts._replace(query=urlencode(query)))
+
+def page_number(url):
+    """The `page` query parameter of a fragment URL as an int, or None."""
+    value = dict(parse_qsl(urlsplit(url).query)).get("page", "")
+    return int(value) if value.isdigit() else None
+
+def discover_brands(fetch, index_url):
+    """Return [(brand_name, brand_url)] listed on `index_url`."""
+    html = fetch(index_url)
+    if html is None:
+        return []
+    return parse_brand_index(html, index_url)
+
+def discover_brand_models(fetch, brand_name, brand_url, max_pages=1000):
+    """Yield (brand_name, model_url) for every model of a brand, page by page.
+
+    Stops when a page adds no new models, cannot be fetched, or has no
+    load-more button. Fragments requested by page number are assumed to
+    continue with the next number even without a button of their own, as
+    when the page keeps the counter in JavaScript. Raises
+    DiscoveryUnsupported when the endpoint cannot be derived, so the caller
+    can fall back to the browser.
+    """
+    seen = set()
+    url = brand_url
+    visited = set()
+    for _ in range(max_pages):
+        if url in visited:
+            return
+        visited.add(url)
+        html = fetch(url)
+        if html is None:
+            return
+        model_urls, next_url = parse_model_links(html, url)
+        if next_url is None and url != brand_url and page_number(url) is not None:
+            next_url = with_page(url, page_number(url) + 1)
+        url = next_url
+        new_urls = [model_url for model_url in model_urls if model_url not in seen]
+        for model_url in new_urls:
+            seen.add(model_url)
+            yield brand_name, model_url
+        if url is None or not new_urls:
+            return
@@ -0,0 +1,276 @@
+import argparse
+import atexit
+import glob
+import hashlib
+import json
+import os
+import queue
+import re
+import sqlite3
+import sys
+import threading
+import traceback
+from collections import Counter, defaultdict
+from datetime import datetime
+
+import requests
+
+from concurrency import PROXY_ERROR_STATUSES
+from metrics import ERRORS
+
+try:
+    import aiohttp
+except ImportError:  # Only the async fetch mode raises its errors
+    aiohttp = None
+
+# Structured replacement for the error_log.txt appends of the scrapers: one
+# JSON object per line, queued by the calling thread and written in batches
+# by a background thread. A stack trace is formatted only the first time it
+# is seen; later errors with the same trace carry just its id. The file is
+# rotated to <file>.1 ... <file>.<backups> once it reaches max_bytes, and
+# every file repeats the stacks it refers to, so each one can be read alone.
+CATEGORIES = ("http_status", "timeout", "proxy", "parse", "db", "other")
+STATUS_PATTERN = re.compile(r"status code:? (\d{3})", re.IGNORECASE)
+PARSE_PATTERN = re.compile(r"table not found|parse", re.IGNORECASE)
+
+TIMEOUT_ERRORS = (requests.Timeout, TimeoutError)
+PROXY_ERRORS = (requests.ConnectionError,)
+if aiohttp is not None:
+    TIMEOUT_ERRORS += (aiohttp.ServerTimeoutError,)
+    PROXY_ERRORS += (aiohttp.ClientConnectionError,)
+
+def classify(message, error=None, status=None):
+    """Return (category, status) for a logged error and the exception being handled, if any.
+
+    Network and gateway failures count as proxy errors, as in concurrency.py.
+    """
+    if status is None:
+        match = STATUS_PATTERN.search(message)
+        status = int(match.group(1)) if match else None
+    if status is not None:
+        return ("proxy" if status in PROXY_ERROR_STATUSES else "http_status"), status
+    if isinstance(error, TIMEOUT_ERRORS):
+        return "timeout", None
+    if isinstance(error, PROXY_ERRORS):
+        return "proxy", None
+    if isinstance(error, sqlite3.Error):
+        return "db", None
+    if PARSE_PATTERN.search(message):
+        return "parse", None
+    return "other", None
+
+def trace_key(error):
+    """Cheap identity of a traceback: exception type plus the code and line of every frame."""
+    frames = []
+    tb = error.__traceback__
+    while tb is not None:
+        frames.append(f"{tb.tb_frame.f_code.co_filename}:{tb.tb_frame.f_code.co_name}:{tb.tb_lineno}")
+        tb = tb.tb_next
+    text = f"{type(error).__module__}.{type(error).__qualname__}|" + "|".join(frames)
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=8).hexdigest()
+
+class ErrorLog:
+    """Background-flushed JSONL error log; `log` is a drop-in for the scrapers' log_error.
+
+    The writer thread starts with the first error, so the file is created
+    relative to the working directory at that time. When the writer falls
+    `max_queue` entries behind, callers wait up to `put_timeout` seconds for
+    room; errors that still do not fit are counted and dropped rather than
+    stalling the crawl.
+    """
+
+    def __init__(self, path="error_log.jsonl", max_bytes=10 * 1024 * 1024, backups=5,
+                 batch_size=1000, flush_interval=1.0, max_queue=10000, put_timeout=1.0):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.put_timeout = put_timeout
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.logged = 0
+        self.dropped = 0
+        self._unreported = 0  # Dropped errors not yet noted in the file
+        self._stacks = {}  # trace id -> formatted stack, for every trace seen so far
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stopping = None
+        atexit.register(self.close)
+
+    def log(self, error_message, url_id=None, url=None, category=None, status=None):
+        """Queue one error; the exception being handled, if any, supplies its type and stack."""
+        error = sys.exc_info()[1]
+        message = str(error_message)
+        if category is None:
+            category, status = classify(message, error, status)
+        entry = {"time": datetime.now().isoformat(timespec="milliseconds"), "category": category,
+                 "message": message, "url_id": url_id, "url": url}
+        if status is not None:
+            entry["status"] = status
+        if error is not None:
+            entry["error"] = type(error).__name__
+            entry["trace"] = key = trace_key(error)
+            if key not in self._stacks:
+                stack = traceback.format_exc()
+                with self._lock:
+                    self._stacks.setdefault(key, stack)
+        ERRORS.inc(category)
+
+        self._start()
+        try:
+            self.queue.put(entry, timeout=self.put_timeout)
+            self.logged += 1
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+                self._unreported += 1
+
+    def _start(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._stopping = threading.Event()
+                self._thread = threading.Thread(target=self._run, args=(self._stopping,), name="error-log",
+                                                daemon=True)
+                self._thread.start()
+
+    def _run(self, stopping):
+        self._file = None
+        self._written = set()  # trace ids whose stack is in the current file
+        try:
+            while True:
+                try:
+                    batch = [self.queue.get(timeout=0.05 if stopping.is_set() else self.flush_interval)]
+                except queue.Empty:
+                    if stopping.is_set():
+                        return
+                    continue
+                while len(batch) < self.batch_size:
+                    try:
+                        batch.append(self.queue.get_nowait())
+                    except queue.Empty:
+                        break
+                try:
+                    self._write(batch)
+                except OSError as e:  # e.g. disk full; keep the thread alive for later batches
+                    print(f"Error log write failed, {len(batch)} entries lost: {e}", file=sys.stderr)
+        finally:
+            if self._file is not None:
+                self._file.close()
+
+    def _write(self, batch):
+        if self._file is None:
+            self._file = open(self.path, "a", encoding="utf-8")
+        if self._unreported:
+            with self._lock:
+                dropped, self._unreported = self._unreported, 0
+            batch.append({"time": datetime.now().isoformat(timespec="milliseconds"), "category": "other",
+                          "message": f"{dropped} errors dropped, error log queue full"})
+        lines = []
+        for entry in batch:
+            key = entry.get("trace")
+            if key is not None and key not in self._written:
+                entry["stack"] = self._stacks.get(key)
+                self._written.add(key)
+            lines.append(json.dumps(entry, ensure_ascii=False, default=str))
+        self._file.write("\n".join(lines) + "\n")
+        self._file.flush()
+        if self._file.tell() >= self.max_bytes:
+            self._rotate()
+
+    def _rotate(self):
+        self._file.close()
+        for index in range(self.backups - 1, 0, -1):
+            if os.path.exists(f"{self.path}.{index}"):
+                os.replace(f"{self.path}.{index}", f"{self.path}.{index + 1}")
+        if self.backups:
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.remove(self.path)
+        self._file = open(self.path, "a", encoding="utf-8")
+        self._written = set()
+
+    def close(self):
+        """Write everything queued so far and stop the writer thread; logging again restarts it."""
+        # Holding the lock keeps log() from starting a second writer meanwhile
+        with self._lock:
+            if self._thread is not None:
+                self._stopping.set()
+                self._thread.join()
+                self._thread = None
+
+def log_files(path):
+    """The current log and its rotated backups, oldest first."""
+    backups = []
+    for name in glob.glob(glob.escape(path) + ".*"):
+        suffix = name[len(path) + 1:]
+        if suffix.isdigit():
+            backups.append((int(suffix), name))
+    return [name for _, name in sorted(backups, reverse=True)] + ([path] if os.path.exists(path) else [])
+
+def read_entries(path):
+    for name in log_files(path):
+        with open(name, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    continue  # A line cut short by a crash
+
+def summarize(path, since=None):
+    """Aggregate the log (and its backups) by category, URL and message shape."""
+    categories = Counter()
+    category_urls = defaultdict(set)
+    messages = defaultdict(Counter)
+    urls = defaultdict(Counter)
+    statuses = Counter()
+    traces = set()
+    first = last = None
+    for entry in read_entries(path):
+        if since and entry.get("time", "") < since:
+            continue
+        category = entry.get("category", "other")
+        categories[category] += 1
+        first = first or entry.get("time")
+        last = entry.get("time")
+        if entry.get("status") is not None:
+            statuses[entry["status"]] += 1
+        if entry.get("trace"):
+            traces.add(entry["trace"])
+        # Digits (ports, IDs, counts) vary between otherwise identical errors
+        messages[category][re.sub(r"\d+", "#", entry.get("message", ""))[:120]] += 1
+        if entry.get("url"):
+            category_urls[category].add(entry["url"])
+            urls[entry["url"]][category] += 1
+    return {"errors": sum(categories.values()), "first": first, "last": last, "categories": categories,
+            "category_urls": category_urls, "messages": messages, "urls": urls, "statuses": statuses,
+            "traces": len(traces)}
+
+def print_summary(summary, top=10):
+    print(f"{summary['errors']} errors from {summary['first']} to {summary['last']}, "
+          f"{summary['traces']} distinct stack traces")
+    for category, count in summary["categories"].most_common():
+        print(f"\n{category:12} {count:8}  on {len(summary['category_urls'][category])} URLs")
+        for message, message_count in summary["messages"][category].most_common(3):
+            print(f"    {message_count:8}  {message}")
+    if summary["statuses"]:
+        print("\nStatus codes: " + ", ".join(f"{status}: {count}"
+                                               for status, count in summary["statuses"].most_common()))
+    worst = sorted(summary["urls"].items(), key=lambda item: (-sum(item[1].values()), item[0]))[:top]
+    if worst:
+        print("\nURLs with the most failures:")
+        for url, by_category in worst:
+            detail = ", ".join(f"{category} {count}" for category, count in by_category.most_common())
+            print(f"{sum(by_category.values()):8}  {url}  ({detail})")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Inspect the structured error log written by the scrapers.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    summary_parser = commands.add_parser("summary", help="count failures by category and URL")
+    summary_parser.add_argument("--file", default="error_log.jsonl", help="log file; rotated backups are included")
+    summary_parser.add_argument("--top", type=int, default=10, help="URLs to list")
+    summary_parser.add_argument("--since", help="only errors at or after this ISO time, e.g. 2024-06-01T12:00")
+    args = parser.parse_args()
+    print_summary(summarize(args.file, args.since), args.top)
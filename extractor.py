@@ -0,0 +1,224 @@
+import hashlib
+import json
+from collections import namedtuple
+
+from bs4 import BeautifulSoup, SoupStrainer
+
+try:
+    import lxml.html
+except ImportError:
+    lxml = None
+
+try:
+    from selectolax.lexbor import LexborHTMLParser
+except ImportError:
+    LexborHTMLParser = None
+
+# Shared product page extraction. Every backend reads only the spec table
+# (`table.specs.responsive`) and the gallery (`div.gallery`) and must return
+# identical output; `python benchmarks.py extract` checks this on fixtures/pages.
+BASE_DOMAIN = "https://www.laptoparena.net"
+SKIPPED_TEXT_TAGS = {"script", "style", "template"}
+
+ProductPage = namedtuple("ProductPage", ["specs", "images"])
+
+def _join_text(fragments):
+    # Same rule as BeautifulSoup's get_text(strip=True)
+    return "".join(fragment.strip() for fragment in fragments)
+
+def _page(rows, image_sources):
+    specs = {}
+    for label, value in rows:
+        specs[label] = value
+    images = [f"{BASE_DOMAIN}{src}" for src in image_sources if src]
+    return ProductPage(specs, images)
+
+# html.parser (always available)
+_STRAINER = SoupStrainer(["table", "div"])
+
+def extract_html_parser(content):
+    """Extract with BeautifulSoup, building only table and div subtrees."""
+    soup = BeautifulSoup(content, "html.parser", parse_only=_STRAINER)
+    table = soup.select_one("table.specs.responsive")
+    if table is None:
+        return None
+
+    rows = []
+    for row in table.find_all("tr"):
+        cells = row.find_all("td")
+        if len(cells) == 2:
+            rows.append((cells[0].get_text(strip=True), cells[1].get_text(strip=True)))
+
+    gallery = soup.select_one("div.gallery")
+    images = []
+    if gallery is not None:
+        images = [img.get("data-src") or img.get("src")
+                  for img in gallery.find_all("img", class_="gallery-image")]
+    return _page(rows, images)
+
+# lxml
+_SPEC_TABLE_XPATH = ("(//table[contains(concat(' ', normalize-space(@class), ' '), ' specs ')"
+                     " and contains(concat(' ', normalize-space(@class), ' '), ' responsive ')])[1]")
+_GALLERY_XPATH = "(//div[contains(concat(' ', normalize-space(@class), ' '), ' gallery ')])[1]"
+_GALLERY_IMAGE_XPATH = ".//img[contains(concat(' ', normalize-space(@class), ' '), ' gallery-image ')]"
+
+def _lxml_fragments(element):
+    if isinstance(element.tag, str) and element.tag not in SKIPPED_TEXT_TAGS:
+        if element.text:
+            yield element.text
+        for child in element:
+            yield from _lxml_fragments(child)
+            if child.tail:
+                yield child.tail
+
+def _lxml_text(element):
+    return _join_text(_lxml_fragments(element))
+
+def extract_lxml(content):
+    """Extract with lxml.html and XPath."""
+    root = lxml.html.fromstring(content)
+    tables = root.xpath(_SPEC_TABLE_XPATH)
+    if not tables:
+        return None
+
+    rows = []
+    for row in tables[0].iter("tr"):
+        cells = list(row.iter("td"))
+        if len(cells) == 2:
+            rows.append((_lxml_text(cells[0]), _lxml_text(cells[1])))
+
+    galleries = root.xpath(_GALLERY_XPATH)
+    images = []
+    if galleries:
+        images = [img.get("data-src") or img.get("src")
+                  for img in galleries[0].xpath(_GALLERY_IMAGE_XPATH)]
+    return _page(rows, images)
+
+# selectolax (lexbor engine)
+def _lexbor_text(node):
+    if node.css_first("script, style, template") is None:
+        return node.text(deep=True, separator="", strip=True)
+    fragments = []
+    for child in node.traverse(include_text=True):
+        if child.tag == "-text" and child.parent.tag not in SKIPPED_TEXT_TAGS:
+            # Skip text nested deeper inside a script/style element
+            ancestor = child.parent
+            while ancestor is not None and ancestor is not node and ancestor.tag not in SKIPPED_TEXT_TAGS:
+                ancestor = ancestor.parent
+            if ancestor is None or ancestor is node:
+                fragments.append(child.text_content)
+    return _join_text(fragments)
+
+def extract_selectolax(content):
+    """Extract with selectolax's lexbor parser and CSS selectors."""
+    tree = LexborHTMLParser(content)
+    table = tree.css_first("table.specs.responsive")
+    if table is None:
+        return None
+
+    rows = []
+    for row in table.css("tr"):
+        cells = row.css("td")
+        if len(cells) == 2:
+            rows.append((_lexbor_text(cells[0]), _lexbor_text(cells[1])))
+
+    gallery = tree.css_first("div.gallery")
+    images = []
+    if gallery is not None:
+        images = [img.attributes.get("data-src") or img.attributes.get("src")
+                  for img in gallery.css("img.gallery-image")]
+    return _page(rows, images)
+
+BACKENDS = {
+    "html.parser": extract_html_parser,
+    "lxml": extract_lxml,
+    "selectolax": extract_selectolax,
+}
+
+def available_backends():
+    """Names of the backends whose parser library is installed, fastest first."""
+    names = []
+    if LexborHTMLParser is not None:
+        names.append("selectolax")
+    if lxml is not None:
+        names.append("lxml")
+    names.append("html.parser")
+    return names
+
+# "auto" picks the fastest installed backend
+DEFAULT_BACKEND = "auto"
+
+def extract_product_page(content, backend=None):
+    """Return ProductPage(specs, images) for a product page, or None without a spec table."""
+    backend = backend or DEFAULT_BACKEND
+    if backend == "auto":
+        backend = available_backends()[0]
+    if backend not in available_backends():
+        raise ValueError(f"HTML extraction backend '{backend}' is not available")
+    return BACKENDS[backend](content)
+
+def product_identity(specs):
+    """Return (brand, model_name, part_number) from a spec dict, "Unknown" when missing."""
+    brand = model_name = part_number = "Unknown"
+    for label, value in specs.items():
+        if label.lower() == "brand":
+            brand = value
+        elif label.lower() == "model name":
+            model_name = value
+        elif label.lower() == "part number":
+            part_number = value
+    return brand, model_name, part_number
+
+# Layout of the products table filled by prducts-fast.py and rebuilt by
+# `page_archive.py reparse`: the base columns, then one column per spec label.
+# Url is UNIQUE; the sink upserts on it (see get_product_sink in prducts-fast.py)
+PRODUCTS_TABLE_SQL = """
+    CREATE TABLE IF NOT EXISTS products (
+        ID INTEGER PRIMARY KEY AUTOINCREMENT,
+        Brand TEXT,
+        ProductName TEXT,
+        Url TEXT UNIQUE,
+        Images TEXT,
+        Fingerprint TEXT,
+        RowVersion INTEGER
+    )
+"""
+# Bumped by the products sink on every write; see columnar_export.export_changes
+PRODUCTS_VERSION_COLUMN = "RowVersion"
+PRODUCTS_FINGERPRINT_COLUMN = "Fingerprint"
+
+def _canonical_text(text):
+    return " ".join(str(text).split())
+
+def canonical_specs(specs):
+    """Return `specs` with labels case-folded and whitespace collapsed, empty values dropped.
+
+    The first of several labels that canonicalise the same way wins.
+    """
+    canonical = {}
+    for label, value in specs.items():
+        if value is None:
+            continue
+        value = _canonical_text(value)
+        if value:
+            canonical.setdefault(_canonical_text(label).casefold(), value)
+    return canonical
+
+def spec_fingerprint(specs):
+    """Hash of the canonical spec dict, sorted by label.
+
+    Products with the same fingerprint have identical specs, however the
+    page laid them out.
+    """
+    payload = json.dumps(sorted(canonical_specs(specs).items()), ensure_ascii=False)
+    return hashlib.blake2b(payload.encode("utf-8"), digest_size=16).hexdigest()
+
+def product_row(page, url):
+    """Return the products table row (column -> value) for an extracted page."""
+    brand, model_name, part_number = product_identity(page.specs)
+    row = {"Brand": brand, "ProductName": f"{brand} {model_name} {part_number}",
+           "Url": url, "Images": json.dumps(page.images),
+           PRODUCTS_FINGERPRINT_COLUMN: spec_fingerprint(page.specs)}
+    for column, value in page.specs.items():
+        row.setdefault(column, value)
+    return row
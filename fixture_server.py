@@ -0,0 +1,358 @@
+import random
+import sqlite3
+import struct
+import threading
+import time
+import argparse
+import urllib.error
+import urllib.request
+import zlib
+from collections import Counter
+from contextlib import closing
+from email.utils import formatdate
+from functools import lru_cache
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+# Stand-in for www.laptoparena.net used by the benchmarks. Pages are generated
+# deterministically from their number so every run serves identical content.
+BRANDS = ["Acer", "Asus", "Dell", "HP", "Lenovo", "MSI"]
+
+def product_page(number, revision=0):
+    """Render a product page with the same markup the scrapers parse.
+
+    A non-zero `revision` adds a price row, i.e. a spec change since revision 0.
+    """
+    brand = BRANDS[number % len(BRANDS)]
+    specs = [
+        ("Brand", brand),
+        ("Model Name", f"Book {number // 10}"),
+        ("Part Number", f"PN-{number:06d}"),
+        ("Processor", f"Core i{5 + 2 * (number % 2)}-{1200 + number % 90}H"),
+        ("RAM", f"{8 * (1 + number % 4)} GB"),
+        ("Storage", f"{256 * (1 + number % 3)} GB SSD"),
+        ("Display size", f'{13 + number % 5}.{number % 10}"'),
+        ("Weight", f"{1 + (number % 15) / 10:.2f} kg"),
+        ("Battery", f"{40 + number % 60} Wh"),
+    ]
+    if revision:
+        specs.append(("Price", f"{999 + 50 * revision} EUR"))
+    rows = "\n".join(f"<tr><td>{label}</td><td>{value}</td></tr>" for label, value in specs)
+    images = "\n".join(
+        f'<img class="gallery-image" data-src="/img/{number}/{i}.jpg" src="/img/placeholder.gif">'
+        for i in range(3)
+    )
+    return f"""<!DOCTYPE html>
+<html><head><title>{brand} Book {number // 10}</title></head>
+<body>
+<div class="header"><a href="/">LaptopArena</a></div>
+<div class="gallery">
+{images}
+</div>
+<table class="specs responsive">
+<tr><th colspan="2">Specifications</th></tr>
+{rows}
+</table>
+</body></html>
+"""
+
+@lru_cache(maxsize=1024)
+def product_image(number, index, width=160, height=120):
+    """PNG for gallery image `index` of product `number`.
+
+    Products of the same model (ten consecutive numbers) share their images,
+    as variants do on the site. Pixels are noise, so the PNG does not compress.
+    """
+    rng = random.Random((number // 10) * 100 + index)
+    rows = b"".join(b"\x00" + rng.randbytes(width * 3) for _ in range(height))
+
+    def chunk(kind, data):
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+
+    header = struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)
+    return (b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", header) + chunk(b"IDAT", zlib.compress(rows, 1))
+            + chunk(b"IEND", b""))
+
+# Brand listings: the index links to /brand/<name>, which lists the first
+# page of models and a load-more button pointing at /brand/<name>/more?page=N
+def brand_index_page():
+    links = "\n".join(f'<div class="brand"><a class="brand-link" href="/brand/{brand.lower()}">{brand}</a></div>'
+                      for brand in BRANDS)
+    return f"<!DOCTYPE html>\n<html><body>\n<div class=\"brands\">\n{links}\n</div>\n</body></html>\n"
+
+def brand_models(brand, catalogue_size):
+    """Product numbers of `brand` among the first `catalogue_size` pages."""
+    index = BRANDS.index(brand)
+    return list(range(index, catalogue_size, len(BRANDS)))
+
+def model_listing(brand, catalogue_size, page, page_size):
+    """Return (product items html, load-more button html) for one listing page."""
+    numbers = brand_models(brand, catalogue_size)
+    items = "\n".join(f'<div class="product"><a href="/product/{n}">{brand} Book {n // 10}</a></div>'
+                      for n in numbers[(page - 1) * page_size:page * page_size])
+    button = ""
+    if page * page_size < len(numbers):
+        button = (f'<a class="load_more_products" href="#" data-url="/brand/{brand.lower()}/more" '
+                  f'data-page="{page + 1}">Load more</a>')
+    return items, button
+
+# What the site's XHR does when "load more" is clicked in a browser: fetch the
+# next fragment, append its products and swap in its button
+LOAD_MORE_SCRIPT = """<script>
+document.addEventListener("click", async (event) => {
+  const button = event.target.closest(".load_more_products");
+  if (!button) return;
+  event.preventDefault();
+  const response = await fetch(`${button.dataset.url}?page=${button.dataset.page}`);
+  const fragment = document.createElement("div");
+  fragment.innerHTML = await response.text();
+  const next = fragment.querySelector(".load_more_products");
+  if (next) next.remove();
+  document.querySelector(".product_container").append(...fragment.children);
+  if (next) button.replaceWith(next); else button.remove();
+});
+</script>"""
+
+def brand_page(brand, catalogue_size, page_size):
+    items, button = model_listing(brand, catalogue_size, 1, page_size)
+    return f"""<!DOCTYPE html>
+<html><head><title>{brand} laptops</title></head>
+<body>
+<div class="product_container">
+{items}
+</div>
+{button}
+{LOAD_MORE_SCRIPT}
+</body></html>
+"""
+
+class FixtureHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.in_flight += 1
+            throttled = server.capacity is not None and server.in_flight > server.capacity
+            if throttled:
+                server.throttled += 1
+        try:
+            if throttled:
+                self.send_body(429, "<html><body>Too many requests</body></html>",
+                               {"Retry-After": str(server.retry_after)})
+                return
+            if server.latency:
+                time.sleep(server.latency)
+            self.serve_page()
+        finally:
+            with server.lock:
+                server.in_flight -= 1
+
+    def serve_page(self):
+        url = urlsplit(self.path)
+        parts = url.path.strip("/").split("/")
+        brands = {brand.lower(): brand for brand in BRANDS}
+        if parts == [""]:
+            self.send_body(200, brand_index_page())
+        elif len(parts) == 2 and parts[0] == "brand" and parts[1] in brands:
+            self.send_body(200, brand_page(brands[parts[1]], self.server.catalogue_size, self.server.page_size))
+        elif len(parts) == 3 and parts[0] == "brand" and parts[1] in brands and parts[2] == "more":
+            page = parse_qs(url.query).get("page", ["2"])[0]
+            # Fragments hold bare .product items and the next button, as the site's XHR does
+            items, button = model_listing(brands[parts[1]], self.server.catalogue_size,
+                                          int(page) if page.isdigit() else 2, self.server.page_size)
+            self.send_body(200, f"{items}\n{button}\n")
+        elif len(parts) == 2 and parts[0] == "product" and parts[1].isdigit():
+            number = int(parts[1])
+            with self.server.lock:
+                self.server.product_requests[number] += 1
+            broken = self.server.broken_response(number)
+            if broken is not None:
+                self.send_body(*broken)
+                return
+            revision = self.server.revisions.get(number, 0)
+            validators = {}
+            if self.server.conditional:
+                validators = {"ETag": f'"{number}-{revision}"',
+                              "Last-Modified": formatdate(self.server.modified_at[revision], usegmt=True)}
+                if self.headers.get("If-None-Match") == validators["ETag"]:
+                    with self.server.lock:
+                        self.server.not_modified += 1
+                    self.send_body(304, "", validators)
+                    return
+            self.send_body(200, product_page(number, revision), validators)
+        elif len(parts) == 3 and parts[0] == "img" and parts[1].isdigit() and parts[2].split(".")[0].isdigit():
+            self.send_body(200, product_image(int(parts[1]), int(parts[2].split(".")[0])),
+                           content_type="image/png")
+        else:
+            self.send_body(404, "<html><body>Not found</body></html>")
+
+    def send_body(self, status, html, extra_headers=None, content_type="text/html; charset=utf-8"):
+        body = html.encode("utf-8") if isinstance(html, str) else html
+        self.send_response(status)
+        if status != 304:
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+        for name, value in (extra_headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        if status != 304:
+            self.wfile.write(body)
+            with self.server.lock:
+                self.server.bytes_sent += len(body)
+
+    def log_message(self, format, *args):
+        pass
+
+class FixtureServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 4096
+
+    def __init__(self, address, latency=0.0, capacity=None, retry_after=1, conditional=True,
+                 catalogue_size=600, page_size=24):
+        super().__init__(address, FixtureHandler)
+        self.catalogue_size = catalogue_size  # Products listed across the brand pages
+        self.page_size = page_size            # Models per brand page or fragment
+        self.latency = latency
+        self.capacity = capacity  # Concurrent requests served before answering 429
+        self.retry_after = retry_after
+        self.conditional = conditional  # Send ETag/Last-Modified and answer 304
+        self.revisions = {}  # Page number -> revision, see change_pages
+        self.broken = {}     # Page number -> "gone", "no_specs" or failures left, see break_pages
+        self.modified_at = {0: time.time() - 86400}
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.throttled = 0
+        self.not_modified = 0
+        self.bytes_sent = 0
+        self.connections = 0  # Accepted TCP connections, i.e. client handshakes
+        self.product_requests = Counter()  # Page number -> requests, to spot duplicate fetches
+
+    def get_request(self):
+        request = super().get_request()
+        self.connections += 1
+        return request
+
+    def break_pages(self, numbers, behaviour):
+        """Make product pages fail: "gone" (404), "no_specs" (no spec table), or n for n 503s first."""
+        with self.lock:
+            for number in numbers:
+                self.broken[number] = behaviour
+
+    def broken_response(self, number):
+        with self.lock:
+            behaviour = self.broken.get(number)
+            if behaviour == "gone":
+                return 404, "<html><body>Not found</body></html>"
+            if behaviour == "no_specs":
+                return 200, f"<html><body><h1>Product {number}</h1><p>No specifications yet.</p></body></html>"
+            if behaviour:
+                self.broken[number] = behaviour - 1
+                return 503, "<html><body>Service unavailable</body></html>"
+        return None
+
+    def change_pages(self, numbers):
+        """Bump the revision of the given product pages, changing their specs."""
+        with self.lock:
+            for number in numbers:
+                revision = self.revisions.get(number, 0) + 1
+                self.revisions[number] = revision
+                self.modified_at.setdefault(revision, time.time())
+
+def start_fixture_server(port=0, latency=0.0, capacity=None, retry_after=1, conditional=True,
+                         catalogue_size=600, page_size=24):
+    """Start the stand-in server on a background thread and return (server, base_url)."""
+    server = FixtureServer(("127.0.0.1", port), latency=latency, capacity=capacity,
+                           retry_after=retry_after, conditional=conditional,
+                           catalogue_size=catalogue_size, page_size=page_size)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+# Fake forward proxies for the scheduler benchmarks. Each one forwards plain
+# http:// requests to the fixture server but can be dead, slow or flaky.
+class FakeProxyHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        behaviour = self.server.behaviour
+        if behaviour == "dead":
+            self.close_connection = True
+            return
+        if behaviour == "slow":
+            time.sleep(self.server.slow_delay)
+        if behaviour == "flaky" and self.server.random.random() < self.server.failure_rate:
+            self.send_body(502, b"Bad gateway")
+            return
+
+        self.server.forwarded += 1
+        forwarded_headers = {name: self.headers[name] for name in ("If-None-Match", "If-Modified-Since")
+                             if name in self.headers}
+        request = urllib.request.Request(self.path, headers=forwarded_headers)
+        try:
+            with self.server.opener.open(request, timeout=10) as upstream:
+                self.send_body(upstream.status, upstream.read())
+        except urllib.error.HTTPError as e:
+            self.send_body(e.code, e.read())
+
+    def send_body(self, status, body):
+        self.send_response(status)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+class FakeProxy(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024
+
+    def __init__(self, behaviour="healthy", slow_delay=1.0, failure_rate=0.5, seed=0):
+        super().__init__(("127.0.0.1", 0), FakeProxyHandler)
+        self.behaviour = behaviour
+        self.slow_delay = slow_delay
+        self.failure_rate = failure_rate
+        self.random = random.Random(seed)
+        self.forwarded = 0
+        self.opener = urllib.request.build_opener(urllib.request.ProxyHandler({}))
+
+def start_fake_proxies(count, dead=0.2, slow=0.2, flaky=0.2, seed=1):
+    """Start `count` fake proxies with the given share of bad behaviours; return {port: proxy}."""
+    rng = random.Random(seed)
+    behaviours = (["dead"] * round(count * dead) + ["slow"] * round(count * slow)
+                  + ["flaky"] * round(count * flaky))
+    behaviours += ["healthy"] * (count - len(behaviours))
+    rng.shuffle(behaviours)
+
+    proxies = {}
+    for i, behaviour in enumerate(behaviours):
+        proxy = FakeProxy(behaviour, seed=seed + i)
+        threading.Thread(target=proxy.serve_forever, daemon=True).start()
+        proxies[proxy.server_address[1]] = proxy
+    return proxies
+
+def create_url_db(db_name, base_url, count, url_table="models_urls"):
+    """Create a URL database pointing at `count` fixture product pages."""
+    with closing(sqlite3.connect(db_name)) as conn:
+        with conn:
+            conn.execute(f"""
+                CREATE TABLE IF NOT EXISTS {url_table} (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    url TEXT NOT NULL UNIQUE
+                )
+            """)
+            conn.executemany(f"INSERT OR IGNORE INTO {url_table} (url) VALUES (?)",
+                             ((f"{base_url}/product/{n}",) for n in range(count)))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve LaptopArena-like fixture pages locally.")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds to delay every response")
+    parser.add_argument("--capacity", type=int, default=None,
+                        help="concurrent requests served before answering 429")
+    args = parser.parse_args()
+
+    server = FixtureServer(("127.0.0.1", args.port), latency=args.latency, capacity=args.capacity)
+    print(f"Serving fixture pages on http://127.0.0.1:{args.port}/ (brands) and /product/<n>")
+    server.serve_forever()
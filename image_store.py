@@ -0,0 +1,434 @@
+import argparse
+import io
+import itertools
+import json
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
+from urllib.parse import urljoin
+
+import requests
+
+from concurrency import AdaptiveLimiter, ByteRateLimiter, submit_bounded
+from proxy_scheduler import proxy_ok
+from session_pool import SessionPool
+from sqlite_sink import close_sinks, get_sink
+from url_store import content_hash, iter_url_rows
+
+try:
+    from PIL import Image
+except ImportError:  # Only needed for thumbnails
+    Image = None
+
+# Content-addressed store for the gallery images listed in the `Images` /
+# `images` JSON of the products table. Each image is written once, as
+# `<hash[:2]>/<hash><extension>` under the image directory, however many
+# products or URLs share it. In the products database, `image_files` maps
+# every image URL to its hash and `product_images` maps each product ID to
+# the hashes of its gallery, in order. A run skips products whose manifest is
+# complete and URLs already downloaded, so an interrupted run resumes.
+IMAGE_FILES_TABLE = "image_files"
+MANIFEST_TABLE = "product_images"
+IMAGE_SCHEMA_SQL = (
+    f"""
+    CREATE TABLE IF NOT EXISTS {IMAGE_FILES_TABLE} (
+        url TEXT PRIMARY KEY,
+        hash TEXT,
+        extension TEXT,
+        size INTEGER,
+        status INTEGER,
+        fetched_at REAL
+    )
+    """,
+    f"""
+    CREATE TABLE IF NOT EXISTS {MANIFEST_TABLE} (
+        product_id INTEGER NOT NULL,
+        position INTEGER NOT NULL,
+        url TEXT NOT NULL,
+        hash TEXT,
+        PRIMARY KEY (product_id, position)
+    )
+    """,
+    f"CREATE INDEX IF NOT EXISTS idx_{MANIFEST_TABLE}_hash ON {MANIFEST_TABLE} (hash)",
+)
+IMAGE_FILE_SQL = (f"INSERT OR REPLACE INTO {IMAGE_FILES_TABLE} (url, hash, extension, size, status, fetched_at) "
+                  f"VALUES (?, ?, ?, ?, ?, ?)")
+MANIFEST_SQL = f"INSERT OR REPLACE INTO {MANIFEST_TABLE} (product_id, position, url, hash) VALUES (?, ?, ?, ?)"
+
+# Statuses that will not change on a retry; other failures are retried by the next run
+PERMANENT_STATUSES = {400, 401, 403, 404, 410, 413, 415}
+TOO_LARGE = 413
+MAX_IMAGE_SIZE = 20 * 1024 * 1024
+CHUNK_SIZE = 64 * 1024
+IMAGE_SIGNATURES = (
+    (b"\xff\xd8\xff", ".jpg"),
+    (b"\x89PNG\r\n\x1a\n", ".png"),
+    (b"GIF87a", ".gif"),
+    (b"GIF89a", ".gif"),
+    (b"BM", ".bmp"),
+)
+
+def image_extension(content):
+    """File extension for an image, from its leading bytes."""
+    if content[:4] == b"RIFF" and content[8:12] == b"WEBP":
+        return ".webp"
+    if content[4:12] in (b"ftypavif", b"ftypavis"):
+        return ".avif"
+    for signature, extension in IMAGE_SIGNATURES:
+        if content.startswith(signature):
+            return extension
+    if content.lstrip()[:5] in (b"<svg ", b"<?xml"):
+        return ".svg"
+    return ".bin"
+
+def parse_size(text):
+    """Parse "500K", "2M" or "1048576" into bytes."""
+    text = text.strip().upper().rstrip("B")
+    scale = {"K": 1024, "M": 1024 ** 2, "G": 1024 ** 3}.get(text[-1:], 1)
+    return int(float(text[:-1] if scale > 1 else text) * scale)
+
+class ImageStore:
+    """Thread-safe content-addressed image directory, with optional thumbnails.
+
+    With `thumbnail_size`, a JPEG no larger than that many pixels per side is
+    made from the downloaded bytes of every new image (requires Pillow).
+    """
+
+    def __init__(self, directory="images", thumbnail_size=None, log_error=print):
+        if thumbnail_size and Image is None:
+            raise RuntimeError("Thumbnails require Pillow (pip install Pillow)")
+        self.directory = directory
+        self.thumbnail_size = thumbnail_size
+        self.log_error = log_error
+        self.objects_written = 0
+        self.duplicates = 0
+        self.bytes_written = 0
+        self.thumbnails_written = 0
+        self._seen = set()  # Hashes stored or found by this run
+        self._lock = threading.Lock()
+
+    def path(self, digest, extension):
+        return os.path.join(self.directory, digest[:2], digest + extension)
+
+    def thumbnail_path(self, digest):
+        return os.path.join(self.directory, "thumbnails", digest[:2], digest + ".jpg")
+
+    def put(self, content):
+        """Store `content` unless an identical image is already there; returns (hash, extension)."""
+        digest = content_hash(content)
+        extension = image_extension(content)
+        path = self.path(digest, extension)
+        # Only the first thread to see a hash writes it, even if others have the same bytes
+        with self._lock:
+            first = digest not in self._seen
+            self._seen.add(digest)
+        if not first or os.path.exists(path):
+            with self._lock:
+                self.duplicates += 1
+        else:
+            self._write(path, content)
+            with self._lock:
+                self.objects_written += 1
+                self.bytes_written += len(content)
+        if first and self.thumbnail_size and not os.path.exists(self.thumbnail_path(digest)):
+            self._thumbnail(content, digest)
+        return digest, extension
+
+    @staticmethod
+    def _write(path, content):
+        # Written under a private name and renamed, so a crash never leaves a partial image
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temporary = f"{path}.{threading.get_ident()}.tmp"
+        with open(temporary, "wb") as f:
+            f.write(content)
+        os.replace(temporary, path)
+
+    def _thumbnail(self, content, digest):
+        size = (self.thumbnail_size, self.thumbnail_size)
+        try:
+            with Image.open(io.BytesIO(content)) as image:
+                # Lets JPEG decode at a reduced scale instead of full size
+                image.draft("RGB", size)
+                image = image.convert("RGB")
+                image.thumbnail(size)
+                output = io.BytesIO()
+                image.save(output, "JPEG", quality=85)
+        except (OSError, ValueError, Image.DecompressionBombError) as e:
+            self.log_error(f"Could not thumbnail image {digest}: {e}")
+            return
+        self._write(self.thumbnail_path(digest), output.getvalue())
+        with self._lock:
+            self.thumbnails_written += 1
+
+    def stats(self):
+        return {
+            "objects_written": self.objects_written,
+            "duplicates": self.duplicates,
+            "bytes_written": self.bytes_written,
+            "thumbnails_written": self.thumbnails_written,
+        }
+
+class ImageFetcher:
+    """Download images through the proxy pool, streaming them under an optional byte-rate cap.
+
+    `get_proxies(port)` returns the requests proxies for a port of
+    `proxy_scheduler`; without a scheduler, images are fetched directly.
+    fetch() returns (status code or None, content or None).
+    """
+
+    def __init__(self, session_pool=None, proxy_scheduler=None, get_proxies=None, limiter=None,
+                 rate_limiter=None, retries=3, timeout=20, max_size=MAX_IMAGE_SIZE):
+        self.session_pool = session_pool or SessionPool()
+        self.proxy_scheduler = proxy_scheduler
+        self.get_proxies = get_proxies
+        self.limiter = limiter or AdaptiveLimiter(initial=10, maximum=100)
+        self.rate_limiter = rate_limiter
+        self.retries = retries
+        self.timeout = timeout
+        self.max_size = max_size
+
+    def fetch(self, url):
+        status_code = None
+        port = None
+        for _ in range(self.retries):
+            with self.limiter.slot():
+                if self.proxy_scheduler is not None:
+                    port = self.proxy_scheduler.acquire(previous=port)
+                proxies = self.get_proxies(port) if self.get_proxies and port is not None else None
+                start = time.monotonic()
+                try:
+                    with self.session_pool.session(port, proxies) as session:
+                        with session.get(url, proxies=proxies, timeout=self.timeout, stream=True) as response:
+                            status_code = response.status_code
+                            content = self._read(response) if status_code == 200 else None
+                except requests.RequestException:
+                    status_code = None
+                    self._report(port, False, start)
+                    continue
+                self._report(port, proxy_ok(status_code), start, status_code)
+
+            if status_code == 200 and content is None:
+                return TOO_LARGE, None
+            if status_code == 200 or status_code in PERMANENT_STATUSES:
+                return status_code, content
+        return status_code, None
+
+    def _read(self, response):
+        chunks = []
+        size = 0
+        for chunk in response.iter_content(CHUNK_SIZE):
+            if self.rate_limiter is not None:
+                self.rate_limiter.consume(len(chunk))
+            size += len(chunk)
+            if size > self.max_size:
+                return None
+            chunks.append(chunk)
+        return b"".join(chunks)
+
+    def _report(self, port, ok, start, status_code=None):
+        elapsed = time.monotonic() - start
+        if self.proxy_scheduler is not None:
+            self.proxy_scheduler.report(port, ok, elapsed)
+        self.limiter.record(status_code, elapsed)
+
+def product_image_urls(product_url, images_json):
+    """Absolute image URLs of a product, from its Images JSON."""
+    try:
+        images = json.loads(images_json or "[]")
+    except ValueError:
+        return []
+    return [urljoin(product_url or "", image) for image in images if isinstance(image, str) and image]
+
+class ImageDownloader:
+    """Fetch the gallery images of every product concurrently into an ImageStore.
+
+    Each image URL is downloaded at most once per run, even when several
+    products (or threads) want it at the same time.
+    """
+
+    def __init__(self, products_db, store, fetch, table="products", log_error=print):
+        self.products_db = products_db
+        self.store = store
+        self.fetch = fetch
+        self.table = table
+        self.log_error = log_error
+        self.products = 0
+        self.products_skipped = 0
+        self.images_fetched = 0
+        self.bytes_fetched = 0
+        self.images_failed = 0
+        self.images_reused = 0
+        self._resolved = {}  # url -> hash (None if it failed) for this run
+        self._claims = {}    # url -> Event set once its download finishes
+        self._lock = threading.Lock()
+
+    @property
+    def sink(self):
+        return get_sink(self.products_db, table=IMAGE_FILES_TABLE, create_sql=IMAGE_SCHEMA_SQL,
+                        dynamic_columns=False, log_error=self.log_error)
+
+    def run(self, workers=32, batch_size=500):
+        self.sink  # Creates the tables before they are read
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for item, future in submit_bounded(executor, self._download, self._pending(batch_size),
+                                               window=4 * workers):
+                try:
+                    future.result()
+                except Exception as e:
+                    self.log_error(f"Error downloading image {item[2]} of product {item[0]}: {e}")
+        return self.stats()
+
+    def _pending(self, batch_size):
+        """Yield (product_id, position, url) for every image still to fetch, queueing the rest."""
+        rows = iter_url_rows(self.products_db, self.table, columns=("id", "url", "images"), where=None)
+        with closing(sqlite3.connect(self.products_db, timeout=30.0)) as conn:
+            while True:
+                batch = [(row_id, product_image_urls(url, images)) for row_id, url, images
+                         in itertools.islice(rows, batch_size)]
+                if not batch:
+                    return
+                manifest = self._manifest(conn, [row_id for row_id, _ in batch])
+                known = self._known(conn, {url for _, urls in batch for url in urls})
+                for row_id, urls in batch:
+                    self.products += 1
+                    stored = manifest.get(row_id, [])
+                    if [url for url, _ in stored] == urls and all(digest for _, digest in stored):
+                        self.products_skipped += 1
+                        continue
+                    self.sink.put_statement(f"DELETE FROM {MANIFEST_TABLE} WHERE product_id = ? AND position >= ?",
+                                            (row_id, len(urls)))
+                    for position, url in enumerate(urls):
+                        if url in self._resolved or url in known:
+                            self.images_reused += 1
+                            digest = self._resolved[url] if url in self._resolved else known[url]
+                            self.sink.put_statement(MANIFEST_SQL, (row_id, position, url, digest))
+                        else:
+                            yield row_id, position, url
+
+    def _manifest(self, conn, product_ids):
+        manifest = {}
+        for start in range(0, len(product_ids), 500):
+            chunk = product_ids[start:start + 500]
+            for product_id, url, digest in conn.execute(
+                    f"SELECT product_id, url, hash FROM {MANIFEST_TABLE} "
+                    f"WHERE product_id IN ({', '.join('?' * len(chunk))}) ORDER BY product_id, position", chunk):
+                manifest.setdefault(product_id, []).append((url, digest))
+        return manifest
+
+    def _known(self, conn, urls):
+        """Hashes of URLs downloaded by earlier runs, and None for ones that failed for good."""
+        known = {}
+        urls = list(urls)
+        for start in range(0, len(urls), 500):
+            chunk = urls[start:start + 500]
+            for url, digest, extension, status in conn.execute(
+                    f"SELECT url, hash, extension, status FROM {IMAGE_FILES_TABLE} "
+                    f"WHERE url IN ({', '.join('?' * len(chunk))})", chunk):
+                if digest and os.path.exists(self.store.path(digest, extension)):
+                    known[url] = digest
+                elif digest is None and status in PERMANENT_STATUSES:
+                    known[url] = None
+        return known
+
+    def _download(self, item):
+        product_id, position, url = item
+        self.sink.put_statement(MANIFEST_SQL, (product_id, position, url, self._resolve(url)))
+
+    def _resolve(self, url):
+        with self._lock:
+            if url in self._resolved:
+                return self._resolved[url]
+            claim = self._claims.get(url)
+            owner = claim is None
+            if owner:
+                claim = self._claims[url] = threading.Event()
+        if not owner:
+            claim.wait()
+            return self._resolved.get(url)
+
+        digest = None
+        try:
+            status_code, content = self.fetch(url)
+            if content is None:
+                with self._lock:
+                    self.images_failed += 1
+                self.sink.put_statement(IMAGE_FILE_SQL, (url, None, None, None, status_code, time.time()))
+                self.log_error(f"Image download failed ({status_code or 'network error'}): {url}")
+            else:
+                digest, extension = self.store.put(content)
+                with self._lock:
+                    self.images_fetched += 1
+                    self.bytes_fetched += len(content)
+                self.sink.put_statement(IMAGE_FILE_SQL, (url, digest, extension, len(content), status_code,
+                                                         time.time()))
+        finally:
+            with self._lock:
+                self._resolved[url] = digest
+                self._claims.pop(url).set()
+        return digest
+
+    def stats(self):
+        return {
+            "products": self.products,
+            "products_skipped": self.products_skipped,
+            "images_fetched": self.images_fetched,
+            "images_reused": self.images_reused,
+            "images_failed": self.images_failed,
+            "bytes_fetched": self.bytes_fetched,
+            **self.store.stats(),
+        }
+
+def download_images(products_db, directory, fetch, table="products", workers=32, thumbnail_size=None,
+                    log_error=print):
+    """Download the gallery images of every product in `table`; returns the run's counters.
+
+    `fetch(url)` returns (status code, content or None), e.g. ImageFetcher.fetch.
+    """
+    store = ImageStore(directory, thumbnail_size, log_error)
+    downloader = ImageDownloader(products_db, store, fetch, table, log_error)
+    try:
+        return downloader.run(workers)
+    finally:
+        close_sinks()
+
+def image_stats(products_db, directory):
+    with closing(sqlite3.connect(products_db, timeout=30.0)) as conn:
+        products, images, missing = conn.execute(
+            f"SELECT COUNT(DISTINCT product_id), COUNT(*), COUNT(*) - COUNT(hash) FROM {MANIFEST_TABLE}").fetchone()
+        unique, size = conn.execute(
+            f"SELECT COUNT(DISTINCT hash), SUM(size) FROM {IMAGE_FILES_TABLE} WHERE rowid IN "
+            f"(SELECT MIN(rowid) FROM {IMAGE_FILES_TABLE} WHERE hash IS NOT NULL GROUP BY hash)").fetchone()
+        failed = dict(conn.execute(f"SELECT COALESCE(status, 'network'), COUNT(*) FROM {IMAGE_FILES_TABLE} "
+                                   f"WHERE hash IS NULL GROUP BY 1").fetchall())
+    return {"products": products, "images": images, "images_missing": missing, "unique_images": unique,
+            "stored_bytes": size or 0, "failed_urls": failed, "directory": directory}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Download product gallery images into a content-addressed store.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    download_parser = commands.add_parser("download", help="fetch the images of every product, resuming earlier runs")
+    download_parser.add_argument("--db", default="products.db")
+    download_parser.add_argument("--table", default="products")
+    download_parser.add_argument("--dir", default="images")
+    download_parser.add_argument("--workers", type=int, default=32)
+    download_parser.add_argument("--max-rate", type=parse_size, default=None, metavar="BYTES",
+                                 help="cap on download bytes per second, e.g. 2M")
+    download_parser.add_argument("--thumbnails", type=int, default=None, metavar="PIXELS",
+                                 help="also write JPEG thumbnails this size (requires Pillow)")
+
+    stats_parser = commands.add_parser("stats", help="summarise the manifest")
+    stats_parser.add_argument("--db", default="products.db")
+    stats_parser.add_argument("--dir", default="images")
+    args = parser.parse_args()
+
+    if args.command == "download":
+        # Direct downloads; prducts-fast.py --images goes through the proxies
+        fetcher = ImageFetcher(limiter=AdaptiveLimiter(initial=10, maximum=args.workers),
+                               rate_limiter=ByteRateLimiter(args.max_rate) if args.max_rate else None)
+        print(download_images(args.db, args.dir, fetcher.fetch, args.table, args.workers, args.thumbnails))
+    else:
+        print(image_stats(args.db, args.dir))
@@ -0,0 +1,319 @@
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Counters and latency histograms for crawl runs, served as Prometheus text
+# on a local HTTP endpoint and written as periodic JSON snapshots. Recording
+# is a lock, a dict update and (for histograms) a bisect, about a microsecond,
+# so the metrics stay on in production. State that other objects already keep
+# (proxy port health, limiter, session pool) is read by collectors when the
+# metrics are scraped, at no cost on the hot path.
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+QUANTILES = (0.5, 0.95, 0.99)
+
+def _label_text(names, values, extra=""):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+class Counter:
+    """Monotonic count per combination of label values."""
+
+    kind = "counter"
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def values(self):
+        """{label values: count}; label values are a tuple, empty without labels."""
+        with self._lock:
+            return dict(self._values)
+
+    def total(self):
+        with self._lock:
+            return sum(self._values.values())
+
+    def reset(self):
+        with self._lock:
+            self._values.clear()
+
+    def render(self):
+        values = self.values()
+        if not values and not self.labels:
+            values = {(): 0}
+        for label_values, value in sorted(values.items()):
+            yield f"{self.name}{_label_text(self.labels, label_values)} {value}"
+
+    def snapshot(self):
+        return {",".join(map(str, label_values)) or "total": value
+                for label_values, value in sorted(self.values().items())}
+
+class _Timer:
+    __slots__ = ("histogram", "label_values", "start")
+
+    def __init__(self, histogram, label_values):
+        self.histogram = histogram
+        self.label_values = label_values
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.histogram.observe(time.perf_counter() - self.start, *self.label_values)
+
+class Histogram:
+    """Distribution of observed values (seconds by default) in fixed buckets.
+
+    Quantiles are estimated by interpolating within the bucket that holds
+    them, as Prometheus' histogram_quantile() does.
+    """
+
+    kind = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._series = {}  # label values -> [count per bucket (+Inf last), sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def time(self, *label_values):
+        """Context manager observing the time spent in its block."""
+        return _Timer(self, label_values)
+
+    def series(self):
+        with self._lock:
+            return {label_values: (list(counts), total) for label_values, (counts, total) in self._series.items()}
+
+    def reset(self):
+        with self._lock:
+            self._series.clear()
+
+    def quantile(self, q, counts):
+        count = sum(counts)
+        if not count:
+            return None
+        rank = q * count
+        cumulative = 0
+        for index, bucket_count in enumerate(counts):
+            if cumulative + bucket_count >= rank and bucket_count:
+                lower = self.buckets[index - 1] if index else 0.0
+                if index == len(self.buckets):
+                    return lower  # Beyond the last bucket
+                return lower + (self.buckets[index] - lower) * (rank - cumulative) / bucket_count
+            cumulative += bucket_count
+        return self.buckets[-1]
+
+    def render(self):
+        for label_values, (counts, total) in sorted(self.series().items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += bucket_count
+                le = f'le="{bound}"'
+                yield f"{self.name}_bucket{_label_text(self.labels, label_values, le)} {cumulative}"
+            yield f"{self.name}_sum{_label_text(self.labels, label_values)} {total}"
+            yield f"{self.name}_count{_label_text(self.labels, label_values)} {cumulative}"
+
+    def snapshot(self):
+        result = {}
+        for label_values, (counts, total) in sorted(self.series().items()):
+            count = sum(counts)
+            summary = {"count": count, "mean": round(total / count, 6) if count else None}
+            for q in QUANTILES:
+                value = self.quantile(q, counts)
+                summary[f"p{round(q * 100)}"] = round(value, 6) if value is not None else None
+            result[",".join(map(str, label_values)) or "total"] = summary
+        return result
+
+class Registry:
+    """The metrics and collectors of one process."""
+
+    def __init__(self):
+        self.metrics = []
+        self.collectors = {}  # name -> (collect function, label of its dict gauges)
+        self.started = time.time()
+        self._lock = threading.Lock()
+
+    def counter(self, name, help, labels=()):
+        return self._add(Counter(name, help, labels))
+
+    def histogram(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        return self._add(Histogram(name, help, labels, buckets))
+
+    def _add(self, metric):
+        with self._lock:
+            self.metrics.append(metric)
+        return metric
+
+    def add_collector(self, name, collect, label="key"):
+        """Register `collect()`, called at scrape time, returning {gauge name: value or {label value: value}}.
+
+        Gauges given as a dict are labelled with `label`. Registering under
+        an existing name replaces that collector.
+        """
+        with self._lock:
+            self.collectors[name] = (collect, label)
+
+    def reset(self):
+        """Zero every metric, e.g. between runs in one process."""
+        for metric in self.metrics:
+            metric.reset()
+        self.started = time.time()
+
+    def _collected(self):
+        """[(gauge name, label, value)] from every collector."""
+        gauges = []
+        for name, (collect, label) in list(self.collectors.items()):
+            try:
+                gauges.extend((gauge, label, value) for gauge, value in collect().items())
+            except Exception as e:  # A broken collector must not break scraping
+                gauges.append((f"{name}_collector_error", label, str(e)))
+        return gauges
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format."""
+        lines = []
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.render())
+        for name, label, value in self._collected():
+            if isinstance(value, dict):
+                lines.append(f"# TYPE {name} gauge")
+                lines.extend(f'{name}{{{label}="{_escape(key)}"}} {item}' for key, item in value.items()
+                             if isinstance(item, (int, float)))
+            elif isinstance(value, (int, float)):
+                lines.append(f"# TYPE {name} gauge")
+                lines.append(f"{name} {value}")
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self):
+        """JSON-serialisable view: counters, histogram quantiles and collected gauges."""
+        return {
+            "time": time.time(),
+            "uptime": round(time.time() - self.started, 3),
+            "counters": {metric.name: metric.snapshot() for metric in self.metrics if metric.kind == "counter"},
+            "histograms": {metric.name: metric.snapshot() for metric in self.metrics if metric.kind == "histogram"},
+            "gauges": {name: value for name, _, value in self._collected()},
+        }
+
+REGISTRY = Registry()
+
+# Crawl metrics, recorded by prducts-fast.py, sqlite_sink.py and error_log.py
+PAGES = REGISTRY.counter("crawler_pages_total", "Product pages by outcome", ("outcome",))
+FETCH_ATTEMPTS = REGISTRY.counter("crawler_fetch_attempts_total", "Fetch attempts by HTTP status", ("status",))
+FETCH_SECONDS = REGISTRY.histogram("crawler_fetch_seconds", "Duration of one fetch attempt")
+RETRIES = REGISTRY.counter("crawler_retries_total", "Fetch attempts after the first one for a URL")
+PARSE_SECONDS = REGISTRY.histogram("crawler_parse_seconds", "Time to extract one product page")
+DB_WRITE_SECONDS = REGISTRY.histogram("crawler_db_write_seconds", "Time to commit one sink batch", ("table",))
+DB_ROWS = REGISTRY.counter("crawler_db_rows_total", "Rows and statements committed by the sinks", ("table",))
+ERRORS = REGISTRY.counter("crawler_errors_total", "Logged errors by category", ("category",))
+
+def prefixed(prefix, stats):
+    """Turn a stats() dict into collector gauges named `prefix`_<key>."""
+    return {f"{prefix}_{name}": value for name, value in stats.items()}
+
+class StatsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        registry = self.server.registry
+        if self.path.split("?")[0] in ("/", "/metrics"):
+            body, content_type = registry.render(), "text/plain; version=0.0.4; charset=utf-8"
+        elif self.path.split("?")[0] == "/stats.json":
+            body, content_type = json.dumps(registry.snapshot(), default=str), "application/json"
+        else:
+            self.send_error(404)
+            return
+        body = body.encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+class StatsServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, registry):
+        super().__init__(address, StatsHandler)
+        self.registry = registry
+
+def start_stats_server(port=9108, host="127.0.0.1", registry=REGISTRY):
+    """Serve /metrics (Prometheus) and /stats.json on a background thread; returns the server."""
+    server = StatsServer((host, port), registry)
+    threading.Thread(target=server.serve_forever, name="stats-server", daemon=True).start()
+    return server
+
+class SnapshotWriter:
+    """Write registry.snapshot() to `path` every `interval` seconds, replacing the file atomically.
+
+    Each snapshot also carries the per-second rate of every counter since
+    the previous one.
+    """
+
+    def __init__(self, path, interval=10.0, registry=REGISTRY):
+        self.path = path
+        self.interval = interval
+        self.registry = registry
+        self._previous = None
+        self._stopping = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="stats-snapshots", daemon=True)
+        self._thread.start()
+        return self
+
+    def _run(self):
+        while not self._stopping.wait(self.interval):
+            self.write()
+
+    def write(self):
+        snapshot = self.registry.snapshot()
+        previous, self._previous = self._previous, snapshot
+        if previous is not None:
+            elapsed = max(snapshot["time"] - previous["time"], 1e-9)
+            snapshot["rates"] = {
+                name: {key: round((value - previous["counters"].get(name, {}).get(key, 0)) / elapsed, 3)
+                       for key, value in series.items()}
+                for name, series in snapshot["counters"].items()
+            }
+        temporary = f"{self.path}.tmp"
+        with open(temporary, "w", encoding="utf-8") as f:
+            json.dump(snapshot, f, indent=2, default=str)
+        os.replace(temporary, self.path)
+
+    def stop(self):
+        """Stop the timer and write a final snapshot."""
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.write()
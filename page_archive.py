@@ -0,0 +1,258 @@
+import argparse
+import mmap
+import os
+import sqlite3
+import struct
+import threading
+import time
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import closing
+
+import extractor
+from extractor import (PRODUCTS_FINGERPRINT_COLUMN, PRODUCTS_TABLE_SQL, PRODUCTS_VERSION_COLUMN, extract_product_page,
+                       product_row)
+from search_index import SEARCH_SCHEMA_SQL, queue_search_entry
+from spec_store import SPEC_SCHEMA_SQL, queue_specs
+from sqlite_sink import get_sink, close_sinks
+
+try:
+    import zstandard
+except ImportError:  # Pages are compressed with zlib instead
+    zstandard = None
+
+# Append-only archive of raw product pages. Pages go into numbered segment
+# files, each record compressed on its own so it can be read back by offset.
+# `index.db` maps every URL to its records; the newest record per URL wins.
+# Every segment has a single writer, so several processes (leased workers)
+# can share one archive directory.
+#
+# Record layout: header (url length, payload length), url bytes, payload.
+RECORD_HEADER = struct.Struct(">II")
+SEGMENT_NAME = "segment-{:06d}.pages"
+
+INDEX_SQL = (
+    """
+    CREATE TABLE IF NOT EXISTS pages (
+        url TEXT NOT NULL,
+        row_id INTEGER,
+        fetched_at REAL,
+        segment INTEGER NOT NULL,
+        offset INTEGER NOT NULL,
+        length INTEGER NOT NULL,
+        raw_length INTEGER NOT NULL,
+        codec TEXT NOT NULL
+    )
+    """,
+    # Records of one URL, newest (highest rowid) last: index entries carry the rowid
+    "CREATE INDEX IF NOT EXISTS idx_pages_url ON pages (url)",
+)
+
+def compress(content):
+    """Return (codec, payload) using zstandard when installed, else zlib."""
+    if zstandard is not None:
+        return "zstd", zstandard.ZstdCompressor(level=3).compress(content)
+    return "zlib", zlib.compress(content, 6)
+
+def decompress(codec, payload):
+    if codec == "zstd":
+        return zstandard.ZstdDecompressor().decompress(payload)
+    return zlib.decompress(payload)
+
+class PageArchive:
+    """Thread-safe writer for the page archive in `directory`.
+
+    Each open() starts a new segment, created exclusively, so no other
+    writer ever appends to it and record offsets can be taken from the file
+    position. Segments roll over once they reach `segment_size` bytes. Index
+    rows are committed in batches by a sqlite_sink writer after the record
+    bytes have been written, so the index never points past the end of a
+    segment.
+    """
+
+    def __init__(self, directory="page_archive", segment_size=256 * 1024 * 1024, log_error=print):
+        self.directory = directory
+        self.segment_size = segment_size
+        self.log_error = log_error
+        self.pages_written = 0
+        self.raw_bytes = 0
+        self.stored_bytes = 0
+        self._lock = threading.Lock()
+        self._file = None
+        self._segment = None
+
+    def __enter__(self):
+        return self.open()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    @property
+    def index_db(self):
+        return os.path.join(self.directory, "index.db")
+
+    def open(self):
+        """Start appending to a new segment."""
+        os.makedirs(self.directory, exist_ok=True)
+        self._open_segment()
+        return self
+
+    def _open_segment(self):
+        if self._file is not None:
+            self._file.close()
+        segments = list_segments(self.directory)
+        number = (segments[-1] if segments else 0) + 1
+        while True:
+            try:
+                # "x" fails if another writer created this segment first.
+                # Unbuffered, so every record reaches the OS before its index row
+                self._file = open(os.path.join(self.directory, SEGMENT_NAME.format(number)), "xb", buffering=0)
+                break
+            except FileExistsError:
+                number += 1
+        self._segment = number
+
+    def append(self, url, content, row_id=None):
+        """Compress and append one raw page; its index row is queued for commit."""
+        if isinstance(content, str):
+            content = content.encode("utf-8")
+        codec, payload = compress(content)
+        url_bytes = url.encode("utf-8")
+
+        with self._lock:
+            if self._file.tell() >= self.segment_size:
+                self._open_segment()
+            offset = self._file.tell() + RECORD_HEADER.size + len(url_bytes)
+            self._file.write(RECORD_HEADER.pack(len(url_bytes), len(payload)) + url_bytes + payload)
+            segment = self._segment
+            self.pages_written += 1
+            self.raw_bytes += len(content)
+            self.stored_bytes += len(payload)
+
+        get_sink(self.index_db, table="pages", create_sql=INDEX_SQL, dynamic_columns=False,
+                 log_error=self.log_error).put({
+            "url": url, "row_id": row_id, "fetched_at": time.time(), "segment": segment,
+            "offset": offset, "length": len(payload), "raw_length": len(content), "codec": codec,
+        })
+
+    def stats(self):
+        return {
+            "pages": self.pages_written,
+            "raw_bytes": self.raw_bytes,
+            "stored_bytes": self.stored_bytes,
+            "ratio": self.raw_bytes / self.stored_bytes if self.stored_bytes else 0.0,
+        }
+
+    def close(self):
+        """Close the current segment; close_sinks() commits the remaining index rows."""
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+def list_segments(directory):
+    """Numbers of the segment files in `directory`, ascending."""
+    numbers = []
+    for name in os.listdir(directory):
+        if name.startswith("segment-") and name.endswith(".pages"):
+            numbers.append(int(name[len("segment-"):-len(".pages")]))
+    return sorted(numbers)
+
+def latest_records(directory):
+    """Return the newest (url, segment, offset, length, codec) per URL, in file order."""
+    with closing(sqlite3.connect(os.path.join(directory, "index.db"))) as conn:
+        return conn.execute("""
+            SELECT url, segment, offset, length, codec FROM pages
+            WHERE rowid IN (SELECT MAX(rowid) FROM pages GROUP BY url)
+            ORDER BY segment, offset
+        """).fetchall()
+
+# Re-parse worker state, one per process
+_worker_directory = None
+_worker_maps = {}
+
+def _init_worker(directory, backend):
+    global _worker_directory
+    _worker_directory = directory
+    extractor.DEFAULT_BACKEND = backend
+
+def _segment_map(segment, end):
+    # Map each segment once per worker; remap if it has grown past the mapping
+    mapped = _worker_maps.get(segment)
+    if mapped is None or len(mapped) < end:
+        if mapped is not None:
+            mapped.close()
+        with open(os.path.join(_worker_directory, SEGMENT_NAME.format(segment)), "rb") as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        _worker_maps[segment] = mapped
+    return mapped
+
+def _parse_records(records):
+    rows = []
+    missing = []
+    for url, segment, offset, length, codec in records:
+        payload = _segment_map(segment, offset + length)[offset:offset + length]
+        page = extract_product_page(decompress(codec, payload))
+        if page is None:
+            missing.append(url)
+        else:
+            rows.append(product_row(page, url))
+    return rows, missing
+
+def reparse(directory="page_archive", products_db="products.db", workers=None, chunk_size=200,
+            backend=None, log_error=print):
+    """Rebuild the products rows of `products_db` from the archive, no network needed.
+
+    Each archived URL replaces its existing row. Returns (pages stored, pages
+    without a spec table).
+    """
+    records = latest_records(directory)
+    chunks = [records[i:i + chunk_size] for i in range(0, len(records), chunk_size)]
+    sink = get_sink(products_db, table="products", key_column="Url",
+                    unchanged_columns=(PRODUCTS_FINGERPRINT_COLUMN, "Images"), version_column=PRODUCTS_VERSION_COLUMN,
+                    create_sql=(PRODUCTS_TABLE_SQL, *SPEC_SCHEMA_SQL, *SEARCH_SCHEMA_SQL), log_error=log_error)
+
+    stored = missing = 0
+    try:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                 initargs=(directory, backend or extractor.DEFAULT_BACKEND)) as executor:
+            for rows, missing_urls in executor.map(_parse_records, chunks):
+                for row in rows:
+                    sink.put(row)
+                    queue_search_entry(sink, row["Url"], row)
+                    queue_specs(sink, row["Url"], row)
+                for url in missing_urls:
+                    log_error(f"Specified table not found in archived page {url}")
+                stored += len(rows)
+                missing += len(missing_urls)
+    finally:
+        close_sinks()
+    return stored, missing
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Raw page archive written by prducts-fast.py --archive.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    reparse_parser = commands.add_parser("reparse", help="rebuild the products table from archived pages")
+    reparse_parser.add_argument("--archive", default="page_archive", help="archive directory")
+    reparse_parser.add_argument("--db", default="products.db", help="products database to rebuild")
+    reparse_parser.add_argument("--workers", type=int, default=None, help="parser processes (default: all cores)")
+    reparse_parser.add_argument("--parser", choices=["auto"] + list(extractor.BACKENDS), default="auto",
+                                help="HTML extraction backend")
+
+    stats_parser = commands.add_parser("stats", help="show archive size and compression")
+    stats_parser.add_argument("--archive", default="page_archive", help="archive directory")
+    args = parser.parse_args()
+
+    if args.command == "reparse":
+        start = time.perf_counter()
+        stored, missing = reparse(args.archive, args.db, workers=args.workers, backend=args.parser)
+        elapsed = time.perf_counter() - start
+        print(f"Re-parsed {stored} pages into {args.db} in {elapsed:.2f}s "
+              f"({stored / elapsed:.1f} pages/s), {missing} without a spec table")
+    else:
+        with closing(sqlite3.connect(os.path.join(args.archive, "index.db"))) as conn:
+            pages, urls, stored_bytes, raw_bytes = conn.execute(
+                "SELECT COUNT(*), COUNT(DISTINCT url), SUM(length), SUM(raw_length) FROM pages").fetchone()
+        print(f"{pages} pages ({urls} URLs) in {len(list_segments(args.archive))} segments, "
+              f"{(stored_bytes or 0) / 1e6:.1f} MB stored for {(raw_bytes or 0) / 1e6:.1f} MB raw")
@@ -0,0 +1,250 @@
+import os
+import queue
+import threading
+import time
+from collections import Counter, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+import extractor
+from extractor import extract_product_page, product_row
+from metrics import PARSE_SECONDS
+from url_store import spec_hash
+
+_DONE = object()
+
+class Pipeline:
+    """Staged fetch -> parse -> write pipeline with bounded queues between stages.
+
+    `fetchers` threads call `fetch(item)` and queue what it returns (None
+    drops the item). A dispatcher thread groups up to `parse_batch` fetched
+    values and runs `parse(values)` in a pool of `parsers` processes, so
+    parsing never holds the GIL the fetchers need. One writer thread calls
+    `write(item, value, result)` for every parsed value, in completion order.
+
+    Both queues hold at most `queue_size` entries and at most two batches per
+    parser process are in flight, so a slow stage blocks the one before it
+    instead of buffering without bound. `parse` must be a picklable top-level
+    function. `stop()` stops taking new items; everything already fetched is
+    still parsed and written before run() returns.
+    """
+
+    def __init__(self, fetch, parse, write, fetchers=50, parsers=None, queue_size=200, parse_batch=20,
+                 initializer=None, initargs=(), report_interval=5.0, log_error=print):
+        self.fetch = fetch
+        self.parse = parse
+        self.write = write
+        self.fetchers = fetchers
+        self.parsers = parsers or os.cpu_count() or 1
+        self.parse_batch = parse_batch
+        self.initializer = initializer
+        self.initargs = initargs
+        self.report_interval = report_interval
+        self.log_error = log_error
+        self.fetched = queue.Queue(maxsize=queue_size)
+        self.parsed = queue.Queue(maxsize=queue_size)
+        self.counts = Counter()  # fetched, parsed, written and per-stage failures
+        self._parse_slots = threading.Semaphore(2 * self.parsers)
+        self._parse_in_flight = 0
+        self._fetchers_left = 0
+        self._stopping = threading.Event()
+        self._lock = threading.Lock()
+        # Advancing the item iterator can block (UrlLeases waits for claimable
+        # URLs), so it has its own lock rather than holding up the stats
+        self._pending_lock = threading.Lock()
+        self._started = time.monotonic()
+        self._samples = 0
+        self._depth_totals = Counter()
+        self._full_samples = Counter()
+
+    def stop(self):
+        """Stop fetching new items and drain what is already in the pipeline."""
+        self._stopping.set()
+
+    def run(self, items):
+        """Push every item through the pipeline; returns stats() once drained."""
+        pending = iter(items)
+        self._fetchers_left = self.fetchers
+        self._started = time.monotonic()
+        with ProcessPoolExecutor(max_workers=self.parsers, initializer=self.initializer,
+                                 initargs=self.initargs) as executor:
+            threads = [threading.Thread(target=self._fetcher, args=(pending,), name=f"fetcher-{i}", daemon=True)
+                       for i in range(self.fetchers)]
+            threads.append(threading.Thread(target=self._dispatcher, args=(executor,), name="dispatcher",
+                                            daemon=True))
+            writer = threading.Thread(target=self._writer, name="writer", daemon=True)
+            threads.append(writer)
+            for thread in threads:
+                thread.start()
+            try:
+                self._monitor(writer)
+            except KeyboardInterrupt:
+                print("[DEBUG] Pipeline interrupted, draining in-flight pages")
+                self.stop()
+                self._monitor(writer)
+        return self.stats()
+
+    def _fetcher(self, pending):
+        try:
+            while not self._stopping.is_set():
+                with self._pending_lock:
+                    item = next(pending, _DONE)
+                if item is _DONE:
+                    return
+                try:
+                    value = self.fetch(item)
+                except Exception as e:
+                    self._fail("fetch", item, e)
+                    continue
+                if value is not None:
+                    self.fetched.put((item, value))
+                    self._count("fetched")
+        finally:
+            # The last fetcher out tells the dispatcher no more input is coming
+            with self._lock:
+                self._fetchers_left -= 1
+                last = self._fetchers_left == 0
+            if last:
+                self.fetched.put(_DONE)
+
+    def _dispatcher(self, executor):
+        done = False
+        while not done:
+            entry = self.fetched.get()
+            if entry is _DONE:
+                break
+            batch = [entry]
+            # Take whatever else is already waiting, so busy parsers get full batches
+            while len(batch) < self.parse_batch:
+                try:
+                    entry = self.fetched.get_nowait()
+                except queue.Empty:
+                    break
+                if entry is _DONE:
+                    done = True
+                    break
+                batch.append(entry)
+
+            self._parse_slots.acquire()
+            with self._lock:
+                self._parse_in_flight += 1
+            try:
+                future = executor.submit(_timed_parse, self.parse, [value for _, value in batch])
+            except Exception as e:
+                self._parsed_batch(batch, None, error=e)
+                continue
+            future.add_done_callback(partial(self._parsed_batch, batch))
+
+        # Wait for every batch still being parsed before stopping the writer
+        for _ in range(2 * self.parsers):
+            self._parse_slots.acquire()
+        self.parsed.put(_DONE)
+
+    def _parsed_batch(self, batch, future, error=None):
+        try:
+            if error is None:
+                try:
+                    results, elapsed = future.result()
+                except Exception as e:
+                    error = e
+            if error is not None:
+                for item, _ in batch:
+                    self._fail("parse", item, error)
+                return
+            self._count("parsed", len(batch))
+            # Parse time is measured per batch in the worker process
+            for _ in batch:
+                PARSE_SECONDS.observe(elapsed / len(batch))
+            for (item, value), result in zip(batch, results):
+                self.parsed.put((item, value, result))
+        finally:
+            with self._lock:
+                self._parse_in_flight -= 1
+            self._parse_slots.release()
+
+    def _writer(self):
+        while True:
+            entry = self.parsed.get()
+            if entry is _DONE:
+                return
+            item, value, result = entry
+            try:
+                self.write(item, value, result)
+                self._count("written")
+            except Exception as e:
+                self._fail("write", item, e)
+
+    def _monitor(self, writer):
+        last_report = time.monotonic()
+        while writer.is_alive():
+            writer.join(timeout=0.1)
+            self._sample()
+            if self.report_interval and time.monotonic() - last_report >= self.report_interval:
+                last_report = time.monotonic()
+                print(f"[DEBUG] Pipeline: {self.describe()}")
+
+    def _sample(self):
+        depths = {"fetched": self.fetched.qsize(), "parsing": self._parse_in_flight, "parsed": self.parsed.qsize()}
+        capacities = {"fetched": self.fetched.maxsize, "parsing": 2 * self.parsers, "parsed": self.parsed.maxsize}
+        with self._lock:
+            self._samples += 1
+            for stage, depth in depths.items():
+                self._depth_totals[stage] += depth
+                if depth >= capacities[stage]:
+                    self._full_samples[stage] += 1
+
+    def _count(self, key, n=1):
+        with self._lock:
+            self.counts[key] += n
+
+    def _fail(self, stage, item, error):
+        self._count(f"{stage}_failed")
+        self.log_error(f"Pipeline {stage} stage failed for {item!r}: {error}")
+
+    def describe(self):
+        """One line with current queue depths and item counts."""
+        return (f"fetch queue {self.fetched.qsize()}/{self.fetched.maxsize}, "
+                f"parsing {self._parse_in_flight}/{2 * self.parsers} batches, "
+                f"write queue {self.parsed.qsize()}/{self.parsed.maxsize}, "
+                f"fetched {self.counts['fetched']}, parsed {self.counts['parsed']}, "
+                f"written {self.counts['written']}")
+
+    def stats(self):
+        """Item counts plus mean depth and share of time full for each queue.
+
+        A queue that is mostly full points at the stage after it as the
+        bottleneck; one that is mostly empty points at the stage before it.
+        """
+        with self._lock:
+            samples = max(1, self._samples)
+            return {
+                **self.counts,
+                "elapsed": round(time.monotonic() - self._started, 2),
+                "mean_depth": {stage: round(total / samples, 1) for stage, total in self._depth_totals.items()},
+                "full_share": {stage: round(self._full_samples[stage] / samples, 2)
+                               for stage in self._depth_totals},
+            }
+
+def _timed_parse(parse, values):
+    """Run `parse(values)` in a parser process; returns (results, seconds spent)."""
+    start = time.perf_counter()
+    results = parse(values)
+    return results, time.perf_counter() - start
+
+# Product page parsing for the pipeline's process pool
+FetchedPage = namedtuple("FetchedPage", ["url", "content", "etag", "last_modified", "content_hash"])
+
+def init_product_parser(backend):
+    """Process pool initializer: use the same extraction backend as the parent."""
+    extractor.DEFAULT_BACKEND = backend
+
+def parse_product_pages(pages):
+    """Return (products row, spec_hash) per FetchedPage, or None without a spec table."""
+    results = []
+    for page in pages:
+        extracted = extract_product_page(page.content)
+        if extracted is None:
+            results.append(None)
+        else:
+            results.append((product_row(extracted, page.url), spec_hash(extracted)))
+    return results
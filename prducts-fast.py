@@ -1,12 +1,37 @@
 import sqlite3
 import requests
-from bs4 import BeautifulSoup
-import json
-from concurrent.futures import ThreadPoolExecutor, as_completed
-import os
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import closing
-from datetime import datetime
-import traceback
+import time
+import argparse
+import asyncio
+from functools import partial
+from urllib.parse import urlsplit
+
+import extractor
+from checkpoint import Checkpoint
+from concurrency import AdaptiveLimiter, AsyncAdaptiveLimiter, ByteRateLimiter, submit_bounded
+from error_log import ErrorLog, classify
+from extractor import (PRODUCTS_FINGERPRINT_COLUMN, PRODUCTS_TABLE_SQL, PRODUCTS_VERSION_COLUMN, extract_product_page,
+                       product_row)
+from image_store import ImageFetcher, download_images, parse_size
+from metrics import (ERRORS, FETCH_ATTEMPTS, FETCH_SECONDS, PAGES, PARSE_SECONDS, REGISTRY, RETRIES, SnapshotWriter,
+                     prefixed, start_stats_server)
+from page_archive import PageArchive
+from pipeline import FetchedPage, Pipeline, init_product_parser, parse_product_pages
+from proxy_scheduler import ProxyScheduler, proxy_ok
+from session_pool import SessionPool
+from search_index import SEARCH_SCHEMA_SQL, queue_search_entry
+from spec_store import SPEC_SCHEMA_SQL, queue_specs
+from sqlite_sink import enable_wal, get_sink, close_sinks
+from url_store import (RetryPolicy, UrlLeases, Validators, conditional_headers, content_hash, count_url_rows,
+                       default_worker_id, eligible_where, ensure_url_columns, iter_url_rows, mark_processed,
+                       record_failure, record_success, record_validators, retry_stats, spec_hash)
+
+try:
+    import aiohttp
+except ImportError:  # Only needed for --mode async
+    aiohttp = None
 
 # Proxy settings remain the same
 username = "Yusuf_iV5xx"
@@ -14,22 +39,50 @@ password = "AmirAmir994994+"
 proxy_base = "dc.oxylabs.io"
 starting_port = 8001
 max_port = 9000
-progress_file = "progress.json"
-error_log_file = "error_log.txt"
-
-def log_error(error_message, url_id=None, url=None):
-    """Log errors to error_log.txt with timestamp and details."""
-    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    with open(error_log_file, "a", encoding='utf-8') as f:
-        error_entry = f"""
-[{timestamp}]
-URL ID: {url_id if url_id else 'N/A'}
-URL: {url if url else 'N/A'}
-Error: {error_message}
-Stack Trace: {traceback.format_exc()}
-{'=' * 80}
-"""
-        f.write(error_entry)
+progress_file = "progress.json"  # Legacy format, migrated into the checkpoint journal
+checkpoint_file = "progress.journal"
+error_log_file = "error_log.jsonl"  # See error_log.py summary
+
+headers = {
+    "User-Agent": (
+        "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 "
+        "(KHTML, like Gecko) Chrome/114.0.0.0 Safari/537.36"
+    ),
+    "Accept-Language": "en-US,en;q=0.9",
+    "Accept-Encoding": "gzip, deflate, br",
+    "Connection": "keep-alive",
+}
+
+session_pool = SessionPool(headers=headers)
+proxy_scheduler = ProxyScheduler(range(starting_port, max_port + 1))
+concurrency_limiter = AdaptiveLimiter(initial=10, maximum=100)
+# A URL gets a few attempts (on different ports) per run; after that it is
+# retried in a later run with backoff, or moved to the dead-letter table
+retries_per_run = 3
+retry_policy = RetryPolicy()
+raw_archive = None  # PageArchive for raw responses, set by --archive
+
+def proxy_port_gauges():
+    ports = proxy_scheduler.port_stats()
+    return {f"crawler_proxy_{field}": {port: stats[field] for port, stats in ports.items()
+                                       if stats[field] is not None}
+            for field in ("attempts", "failures", "success", "latency", "open")}
+
+# Read when the metrics are scraped; the async and pipeline modes replace "limiter"
+REGISTRY.add_collector("proxy_ports", proxy_port_gauges, label="port")
+REGISTRY.add_collector("limiter", lambda: prefixed("crawler_limiter", concurrency_limiter.stats()))
+REGISTRY.add_collector("session_pool", lambda: prefixed("crawler_session_pool", session_pool.stats()))
+
+def record_attempt(attempt, status_code, elapsed):
+    """Count one fetch attempt (status_code None for a network error)."""
+    FETCH_SECONDS.observe(elapsed)
+    FETCH_ATTEMPTS.inc(status_code or "error")
+    if attempt:
+        RETRIES.inc()
+
+# Errors are queued and written as JSON lines by a background thread
+error_log = ErrorLog(error_log_file)
+log_error = error_log.log
 
 def get_proxies(port):
     proxy = f"{proxy_base}:{port}"
@@ -37,166 +90,141 @@ def get_proxies(port):
         "https": f"https://user-{username}:{password}@{proxy}",
     }
 
-def load_progress():
-    print("[DEBUG] Loading progress from progress.json")
-    if os.path.exists(progress_file):
-        with open(progress_file, "r") as f:
-            return json.load(f)
-    print("[DEBUG] No progress file found. Starting fresh.")
-    return {}
-
-def save_progress(progress):
-    print(f"[DEBUG] Saving progress: {progress}")
-    with open(progress_file, "w") as f:
-        json.dump(progress, f)
-
 def get_db_connection(db_name):
     """Create a new database connection."""
     try:
         conn = sqlite3.connect(db_name, timeout=30.0)
-        conn.execute("PRAGMA journal_mode=WAL")
+        enable_wal(conn)
         conn.execute("PRAGMA busy_timeout=30000")
         return conn
     except sqlite3.Error as e:
         log_error(f"Database connection error: {e}")
         raise
 
-def fetch_and_store_to_db(url, row_id, port, products_db="products.db", retries=10):
-    """Fetch product data and store it in the database."""
-    print(f"[DEBUG] Starting to process URL ID {row_id} on port {port}")
-    headers = {
-        "User-Agent": (
-            "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 "
-            "(KHTML, like Gecko) Chrome/114.0.0.0 Safari/537.36"
-        ),
-        "Accept-Language": "en-US,en;q=0.9",
-        "Accept-Encoding": "gzip, deflate, br",
-        "Connection": "keep-alive",
-    }
-    base_domain = "https://www.laptoparena.net"
+def get_product_sink(products_db):
+    """Return the batched writer for the products table of `products_db`.
+
+    Rows are upserted on Url, so retries and reruns never add duplicates. A
+    row whose fingerprint and images match the stored row leaves it (and its
+    RowVersion) untouched.
+    """
+    return get_sink(products_db, table="products", key_column="Url",
+                    unchanged_columns=(PRODUCTS_FINGERPRINT_COLUMN, "Images"), version_column=PRODUCTS_VERSION_COLUMN,
+                    create_sql=(PRODUCTS_TABLE_SQL, *SPEC_SCHEMA_SQL, *SEARCH_SCHEMA_SQL), log_error=log_error)
+
+def skip_unchanged(row_id, outcome, on_stored=None, **validators):
+    """Mark a page that did not change since the last crawl as done without storing it."""
+    PAGES.inc(outcome)
+    if on_stored:
+        on_stored(**validators)
+    return True
+
+def store_product_page(content, url, row_id, products_db="products.db", on_stored=None,
+                       known=None, etag=None, last_modified=None, on_failed=None):
+    """Parse a product page and queue its specifications for the database.
+
+    `on_stored(**validators)` is called from the writer thread once the row is
+    committed, with the page's new etag, last_modified, content_hash and
+    spec_hash. With `known` validators from a previous crawl, a page whose body
+    or extracted specs are unchanged is not written again. A page without a
+    spec table is reported to `on_failed(category, message, status)`.
+    """
+    validators = {"etag": etag, "last_modified": last_modified, "content_hash": content_hash(content)}
+    if known and known.content_hash == validators["content_hash"]:
+        return skip_unchanged(row_id, "same_body", on_stored, **validators, spec_hash=known.spec_hash)
+
+    with PARSE_SECONDS.time():
+        page = extract_product_page(content)
+    
+    if page is None:
+        return spec_table_missing(url, row_id, on_failed)
+
+    # Columns follow the base table, spec labels become extra columns
+    validators["spec_hash"] = spec_hash(page)
+    return store_product_row(product_row(page, url), row_id, products_db, on_stored, known, validators)
+
+def spec_table_missing(url, row_id, on_failed=None):
+    error_msg = "Specified table not found"
+    PAGES.inc("no_spec_table")
+    log_error(error_msg, row_id, url, category="parse")
+    if on_failed:
+        on_failed("parse", error_msg)
+    return False
+
+def store_product_row(row, row_id, products_db="products.db", on_stored=None, known=None, validators=None):
+    """Queue an extracted products row, unless its specs match the `known` spec_hash."""
+    validators = validators or {}
+    if known and known.spec_hash == validators.get("spec_hash"):
+        return skip_unchanged(row_id, "same_specs", on_stored, **validators)
+
+    try:
+        callback = partial(on_stored, **validators) if on_stored else None
+        sink = get_product_sink(products_db)
+        sink.put(row)
+        queue_search_entry(sink, row["Url"], row)
+        # The typed specs are committed last, so they carry the callback
+        queue_specs(sink, row["Url"], row, callback)
+        PAGES.inc("stored")
+        return True
+
+    except sqlite3.Error as e:
+        error_msg = f"Database error while storing product: {e}"
+        log_error(error_msg, row_id, row.get("Url"))
+        raise
+
+def fetch_product_page(url, row_id, retries=None, known=None, on_failed=None):
+    """Fetch a product page through the proxies.
+
+    Returns the 200 (or, for a conditional request, 304) response, or None
+    once every retry has failed, after reporting the last error to
+    `on_failed(category, message, status)`. `known` holds the Validators from
+    the last crawl for a conditional request.
+    """
+    retries = retries or retries_per_run
+    request_headers = {**headers, **conditional_headers(known)}
+    port = None
+    failure = ("other", "No attempt made", None)
 
     for attempt in range(retries):
         try:
-            proxies = get_proxies(port)
-            print(f"[DEBUG] Using proxy on port: {port} for URL ID: {row_id} "
-                  f"(Attempt {attempt + 1}/{retries})")
-            
-            response = requests.get(url, headers=headers, proxies=proxies, timeout=10)
-            
-            if response.status_code != 200:
+            # Wait for a slot under the adaptive in-flight limit
+            with concurrency_limiter.slot():
+                # Healthy ports are preferred; the one that just failed is avoided
+                port = proxy_scheduler.acquire(previous=port)
+                proxies = get_proxies(port)
+
+                # Reuse a keep-alive session (and its proxy tunnel) for this port
+                start = time.monotonic()
+                try:
+                    with session_pool.session(port, proxies) as session:
+                        response = session.get(url, headers=request_headers, proxies=proxies, timeout=10)
+                except requests.RequestException:
+                    elapsed = time.monotonic() - start
+                    proxy_scheduler.report(port, False, elapsed)
+                    concurrency_limiter.record(None, elapsed)
+                    record_attempt(attempt, None, elapsed)
+                    raise
+                elapsed = time.monotonic() - start
+                proxy_scheduler.report(port, proxy_ok(response.status_code), elapsed)
+                concurrency_limiter.record(response.status_code, elapsed,
+                                           response.headers.get("Retry-After"))
+                record_attempt(attempt, response.status_code, elapsed)
+
+            if response.status_code not in (200, 304):
                 error_msg = f"Failed with status code: {response.status_code}"
-                print(f"[DEBUG] {error_msg}. Retrying...")
-                if attempt == retries - 1:  # Log only on last attempt
-                    log_error(error_msg, row_id, url)
+                # Another port will not bring back a page the site says is gone
+                gone = response.status_code in retry_policy.permanent_statuses
+                if attempt == retries - 1 or gone:  # Log only on last attempt
+                    log_error(error_msg, row_id, url, status=response.status_code)
+                if gone:
+                    failure = ("http_status", response.status_code, error_msg)
+                    break
                 raise requests.RequestException(error_msg)
-            
-            soup = BeautifulSoup(response.content, "html.parser")
-            table = soup.find("table", class_="specs responsive")
-            gallery = soup.find("div", class_="gallery")
-            
-            if not table:
-                error_msg = "Specified table not found"
-                print(f"[DEBUG] {error_msg} for URL ID: {row_id}. Skipping...")
-                log_error(error_msg, row_id, url)
-                return False
-            
-            rows = table.find_all("tr")
-            product_data = {}
-            brand = model_name = part_number = "Unknown"
-
-            for row in rows:
-                if row.find("td"):
-                    cells = row.find_all("td")
-                    if len(cells) == 2:
-                        label = cells[0].get_text(strip=True)
-                        value = cells[1].get_text(strip=True)
-                        product_data[label] = value
-
-                        if label.lower() == "brand":
-                            brand = value
-                        elif label.lower() == "model name":
-                            model_name = value
-                        elif label.lower() == "part number":
-                            part_number = value
-
-            product_name = f"{brand} {model_name} {part_number}"
-
-            image_urls = []
-            if gallery:
-                for img in gallery.find_all("img", class_="gallery-image"):
-                    src = img.get("data-src") or img.get("src")
-                    if src:
-                        full_url = f"{base_domain}{src}"
-                        image_urls.append(full_url)
-
-            images_json = json.dumps(image_urls)
 
-            try:
-                with closing(get_db_connection(products_db)) as conn:
-                    with conn:
-                        cursor = conn.cursor()
-                        
-                        # Create base table with Url after ProductName
-                        cursor.execute("""
-                            CREATE TABLE IF NOT EXISTS products (
-                                ID INTEGER PRIMARY KEY AUTOINCREMENT,
-                                Brand TEXT,
-                                ProductName TEXT,
-                                Url TEXT,
-                                Images TEXT
-                            )
-                        """)
-
-                        # Get existing columns
-                        cursor.execute("PRAGMA table_info(products)")
-                        existing_columns = {column[1] for column in cursor.fetchall()}
-
-                        # Add new columns if they don't exist
-                        new_columns = []
-                        for column in product_data.keys():
-                            if column not in existing_columns:
-                                try:
-                                    cursor.execute(f'ALTER TABLE products ADD COLUMN "{column}" TEXT')
-                                    new_columns.append(column)
-                                    print(f"[DEBUG] Added new column: {column}")
-                                except sqlite3.OperationalError as e:
-                                    if "duplicate column name" not in str(e):
-                                        raise
-                                    print(f"[DEBUG] Column already exists: {column}")
-
-                        # Prepare insert statement using all columns (new and existing)
-                        all_columns = ['"Brand"', '"ProductName"', '"Url"', '"Images"']
-                        values = [brand, product_name, url, images_json]
-                        
-                        # Add product data columns and values
-                        for column, value in product_data.items():
-                            if column in existing_columns or column in new_columns:
-                                all_columns.append(f'"{column}"')
-                                values.append(value)
-
-                        placeholders = ', '.join(['?'] * len(values))
-                        columns_str = ', '.join(all_columns)
-                        
-                        # Insert the data
-                        cursor.execute(
-                            f"INSERT INTO products ({columns_str}) VALUES ({placeholders})", 
-                            values
-                        )
-
-                print(f"[DEBUG] Product '{product_name}' has been saved to the database.")
-                return True
-
-            except sqlite3.Error as e:
-                error_msg = f"Database error while storing product: {e}"
-                log_error(error_msg, row_id, url)
-                raise
+            return response
 
         except requests.RequestException as e:
-            print(f"[DEBUG] Request failed on port {port} for URL ID: {row_id}. Error: {e}")
-            port += 1
-            if port > max_port:
-                port = starting_port
-            
+            failure = (*classify(str(e), e), str(e))
             if attempt == retries - 1:  # Log only on last attempt
                 log_error(f"Request failed after {retries} attempts: {e}", row_id, url)
 
@@ -205,78 +233,410 @@ def fetch_and_store_to_db(url, row_id, port, products_db="products.db", retries=
             log_error(error_msg, row_id, url)
             raise
 
-    print(f"[DEBUG] All retries failed for URL ID: {row_id}. Skipping...")
+    PAGES.inc("failed")
+    if on_failed:
+        category, status, message = failure
+        on_failed(category, message, status)
+    return None
+
+def fetch_and_store_to_db(url, row_id, products_db="products.db", retries=None, on_stored=None, known=None,
+                          on_failed=None):
+    """Fetch product data and store it in the database."""
+    response = fetch_product_page(url, row_id, retries, known, on_failed)
+    if response is None:
+        return False
+    if response.status_code == 304:
+        return skip_unchanged(row_id, "not_modified", on_stored)
+
+    if raw_archive is not None:
+        raw_archive.append(url, response.content, row_id)
+    return store_product_page(response.content, url, row_id, products_db, on_stored, known,
+                              response.headers.get("ETag"), response.headers.get("Last-Modified"), on_failed)
+
+async def fetch_and_store_to_db_async(session, limiter, url, row_id, products_db="products.db", retries=None,
+                                      on_stored=None, known=None, on_failed=None):
+    """Asyncio counterpart of fetch_and_store_to_db with the same retries and port scheduling."""
+    retries = retries or retries_per_run
+    request_headers = {**headers, **conditional_headers(known)}
+    timeout = aiohttp.ClientTimeout(sock_connect=10, sock_read=10)
+    port = None
+    failure = ("other", "No attempt made", None)
+
+    for attempt in range(retries):
+        try:
+            async with limiter.slot():
+                port = proxy_scheduler.acquire(previous=port)
+                # requests only routes through a proxy registered for the URL's scheme
+                proxy = get_proxies(port).get(urlsplit(url).scheme)
+
+                start = time.monotonic()
+                try:
+                    async with session.get(url, headers=request_headers, proxy=proxy,
+                                           timeout=timeout) as response:
+                        status_code = response.status
+                        retry_after = response.headers.get("Retry-After")
+                        etag = response.headers.get("ETag")
+                        last_modified = response.headers.get("Last-Modified")
+                        content = await response.read()
+                except (aiohttp.ClientError, asyncio.TimeoutError):
+                    elapsed = time.monotonic() - start
+                    proxy_scheduler.report(port, False, elapsed)
+                    limiter.record(None, elapsed)
+                    record_attempt(attempt, None, elapsed)
+                    raise
+                elapsed = time.monotonic() - start
+                proxy_scheduler.report(port, proxy_ok(status_code), elapsed)
+                limiter.record(status_code, elapsed, retry_after)
+                record_attempt(attempt, status_code, elapsed)
+
+            if status_code == 304:
+                return skip_unchanged(row_id, "not_modified", on_stored)
+
+            if status_code != 200:
+                error_msg = f"Failed with status code: {status_code}"
+                gone = status_code in retry_policy.permanent_statuses
+                if attempt == retries - 1 or gone:  # Log only on last attempt
+                    log_error(error_msg, row_id, url, status=status_code)
+                if gone:
+                    failure = ("http_status", status_code, error_msg)
+                    break
+                raise aiohttp.ClientError(error_msg)
+
+            if raw_archive is not None:
+                await asyncio.to_thread(raw_archive.append, url, content, row_id)
+            return await asyncio.to_thread(store_product_page, content, url, row_id, products_db, on_stored,
+                                           known, etag, last_modified, on_failed)
+
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            failure = (*classify(str(e), e), str(e))
+            if attempt == retries - 1:  # Log only on last attempt
+                log_error(f"Request failed after {retries} attempts: {e!r}", row_id, url)
+
+        except Exception as e:
+            error_msg = f"Unexpected error: {e}"
+            log_error(error_msg, row_id, url)
+            raise
+
+    PAGES.inc("failed")
+    if on_failed:
+        category, status, message = failure
+        on_failed(category, message, status)
     return False
 
+async def process_urls_async(urls, on_stored, on_failed, concurrency=500):
+    """Fetch URLs on one event loop with at most `concurrency` requests in flight."""
+    if aiohttp is None:
+        raise RuntimeError("The async fetch mode requires aiohttp (pip install aiohttp)")
+
+    pending = iter(urls)
+    # Advancing the iterator reads the URL database and, with --lease, claims
+    # rows or waits for other workers' leases, so it runs off the event loop,
+    # for one worker at a time
+    pending_lock = asyncio.Lock()
+
+    async def next_url():
+        async with pending_lock:
+            return await asyncio.to_thread(next, pending, None)
+
+    async def worker(session):
+        # Workers share one iterator, so only `concurrency` URLs are ever scheduled at once
+        while True:
+            item = await next_url()
+            if item is None:
+                return
+            row_id, url, known = item
+            try:
+                await fetch_and_store_to_db_async(session, limiter, url, row_id,
+                                                  on_stored=partial(on_stored, row_id), known=known,
+                                                  on_failed=partial(on_failed, row_id, url))
+            except Exception as e:
+                error_msg = f"Error processing URL ID {row_id}: {e}"
+                print(f"[DEBUG] {error_msg}")
+                log_error(error_msg, row_id, url)
+                on_failed(row_id, url, "other", error_msg)
+
+    # `concurrency` is the ceiling; the limiter finds the sustainable rate below it
+    limiter = AsyncAdaptiveLimiter(initial=min(10, concurrency), maximum=concurrency)
+    REGISTRY.add_collector("limiter", lambda: prefixed("crawler_limiter", limiter.stats()))
+    connector = aiohttp.TCPConnector(limit=concurrency, limit_per_host=0)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        await asyncio.gather(*(worker(session) for _ in range(max(1, concurrency))))
+    print(f"[DEBUG] Concurrency limiter: {limiter.stats()}")
+
+def process_urls_pipeline(urls, on_stored, on_failed, products_db="products.db", fetchers=100, parsers=None,
+                          queue_size=200):
+    """Fetch in `fetchers` threads, parse in `parsers` processes and queue rows from one writer thread."""
+
+    def report_failures(stage):
+        # The pipeline logs and counts an error escaping a stage; the URL is also
+        # scheduled for a retry (and its lease given up), as in the other modes
+        def run(item, *args):
+            try:
+                return stage(item, *args)
+            except Exception as e:
+                row_id, url, _ = item
+                on_failed(row_id, url, "other", f"Error processing URL ID {row_id}: {e}")
+                raise
+        return run
+
+    def fetch(item):
+        row_id, url, known = item
+        response = fetch_product_page(url, row_id, known=known, on_failed=partial(on_failed, row_id, url))
+        if response is None:
+            return None
+        if response.status_code == 304:
+            skip_unchanged(row_id, "not_modified", partial(on_stored, row_id))
+            return None
+
+        if raw_archive is not None:
+            raw_archive.append(url, response.content, row_id)
+        page = FetchedPage(url, response.content, response.headers.get("ETag"),
+                           response.headers.get("Last-Modified"), content_hash(response.content))
+        if known and known.content_hash == page.content_hash:
+            skip_unchanged(row_id, "same_body", partial(on_stored, row_id), etag=page.etag,
+                           last_modified=page.last_modified, content_hash=page.content_hash,
+                           spec_hash=known.spec_hash)
+            return None
+        return page
+
+    def write(item, page, result):
+        row_id, url, known = item
+        if result is None:
+            spec_table_missing(url, row_id, partial(on_failed, row_id, url))
+            return
+        row, page_spec_hash = result
+        validators = {"etag": page.etag, "last_modified": page.last_modified,
+                      "content_hash": page.content_hash, "spec_hash": page_spec_hash}
+        store_product_row(row, row_id, products_db, partial(on_stored, row_id), known, validators)
+
+    # The fetch stage keeps the adaptive limiter; `fetchers` is its ceiling
+    concurrency_limiter.maximum = fetchers
+    concurrency_limiter.limit = min(concurrency_limiter.limit, fetchers)
+
+    pipeline = Pipeline(report_failures(fetch), parse_product_pages, report_failures(write), fetchers=fetchers,
+                        parsers=parsers, queue_size=queue_size, initializer=init_product_parser,
+                        initargs=(extractor.DEFAULT_BACKEND,), log_error=log_error)
+    REGISTRY.add_collector("pipeline", lambda: prefixed("crawler_pipeline", pipeline.stats()), label="stage")
+    stats = pipeline.run(urls)
+    print(f"[DEBUG] Pipeline: {stats}")
+    print(f"[DEBUG] Concurrency limiter: {concurrency_limiter.stats()}")
+    return stats
+
 def process_urls_from_db(url_db_name="Models_urls-2.db", url_table="models_urls", 
-                        url_column="url", batch_size=100):
+                        url_column="url", batch_size=100, mode="threads", concurrency=500,
+                        incremental=False, parsers=None, queue_size=200, worker_id=None, lease_seconds=300.0):
+    """Scrape every unprocessed URL, or with `incremental` re-check every URL.
+
+    An incremental run sends conditional requests using the validators stored
+    by earlier runs and only parses and stores pages that changed.
+
+    With `worker_id`, URLs are claimed in leased batches (url_store.UrlLeases)
+    so several workers can share the URL table, and each stored URL is marked
+    processed in the table itself instead of the checkpoint journal.
+    """
+    if worker_id is not None and incremental:
+        raise ValueError("Leased workers only process pending URLs; run incremental recrawls from one worker")
     print("[DEBUG] Connecting to the database")
     
     try:
         with closing(get_db_connection(url_db_name)) as conn:
             with conn:
-                cursor = conn.cursor()
-                
-                cursor.execute(f"PRAGMA table_info({url_table})")
-                columns = {row[1] for row in cursor.fetchall()}
-                if "processed" not in columns:
-                    print("[DEBUG] Adding 'processed' column to the table")
-                    cursor.execute(f"""
-                        ALTER TABLE {url_table} ADD COLUMN processed INTEGER DEFAULT 0
-                    """)
-
-                cursor.execute(f"SELECT id, {url_column} FROM {url_table} "
-                             f"WHERE processed = 0 ORDER BY id ASC")
-                urls = cursor.fetchall()
-                print(f"[DEBUG] Fetched {len(urls)} unprocessed URLs")
+                added = ensure_url_columns(conn, url_table)
+                if added:
+                    print(f"[DEBUG] Added columns to the table: {', '.join(added)}")
 
     except sqlite3.Error as e:
         log_error(f"Database error in process_urls_from_db: {e}")
         raise
 
-    # Load progress
-    progress = load_progress()
-    already_processed = progress.get("processed", [])
+    checkpoint = leases = None
+    if worker_id is not None:
+        leases = UrlLeases(url_db_name, url_table, worker_id, columns=("id", url_column), batch_size=batch_size,
+                           lease_seconds=lease_seconds)
+        REGISTRY.add_collector("leases", lambda: prefixed("crawler_leases", leases.stats()))
+    else:
+        # Opening the checkpoint folds any journal left by a crashed run into `processed`
+        checkpoint = Checkpoint(checkpoint_file, url_db_name=url_db_name, url_table=url_table,
+                                legacy_file=progress_file).open()
+    try:
+        _process_urls(checkpoint, leases, url_db_name, url_table, url_column, batch_size, mode, concurrency,
+                      incremental, parsers, queue_size)
+    finally:
+        close_sinks()
+        # Only once every completion is committed may the remaining leases go
+        if leases is not None:
+            leases.close()
+        else:
+            checkpoint.close()
+        error_log.close()
+
+    print(f"[DEBUG] Session pool: {session_pool.stats()}")
+    print(f"[DEBUG] Proxy scheduler: {proxy_scheduler.stats()}")
+    if leases is not None:
+        print(f"[DEBUG] Leases: {leases.stats()}")
+    print(f"[DEBUG] Page outcomes: {PAGES.snapshot()}")
+    print(f"[DEBUG] Errors by category: {ERRORS.snapshot()} (python error_log.py summary)")
+    print_retry_queue(url_db_name, url_table)
+    print(f"[DEBUG] Fetch latency: {FETCH_SECONDS.snapshot().get('total')}, "
+          f"parse time: {PARSE_SECONDS.snapshot().get('total')}")
+    print("[DEBUG] All URLs have been processed.")
+
+def print_retry_queue(url_db_name, url_table):
+    stats = retry_stats(url_db_name, url_table)
+    print(f"[DEBUG] Retry queue: {sum(stats['waiting'].values())} URLs backing off, "
+          f"{sum(stats['dead'].values())} dead {stats['dead']} (python url_store.py dead)")
 
-    # Filter unprocessed URLs
-    urls = [url for url in urls if url[0] not in already_processed]
-    print(f"[DEBUG] Remaining URLs to process: {len(urls)}")
+def _process_urls(checkpoint, leases, url_db_name, url_table, url_column, batch_size, mode, concurrency,
+                  incremental=False, parsers=None, queue_size=200):
+    # URLs are read page by page as the workers need them, never all at once.
+    # Dead URLs and those still backing off from a failure are left out.
+    where = eligible_where(pending_only=not incremental)
+    try:
+        print(f"[DEBUG] {count_url_rows(url_db_name, url_table, where)} URLs to "
+              f"{'re-check' if incremental else 'process'}")
+        print_retry_queue(url_db_name, url_table)
+    except sqlite3.Error as e:
+        log_error(f"Database error in process_urls_from_db: {e}")
+        raise
 
-    batch_start = starting_port
+    if leases is not None:
+        urls = ((row_id, url, None) for row_id, url in leases)
+    elif incremental:
+        rows = iter_url_rows(url_db_name, url_table, where=where,
+                             columns=("id", url_column, "etag", "last_modified", "content_hash", "spec_hash"))
+        urls = ((row[0], row[1], Validators(*row[2:])) for row in rows)
+    else:
+        rows = iter_url_rows(url_db_name, url_table, where=where, columns=("id", url_column))
+        urls = ((row_id, url, None) for row_id, url in rows)
+    if checkpoint is not None:
+        # Skip URLs the checkpoint already has
+        urls = (url for url in urls if url[0] not in checkpoint)
+
+    def url_done(row_id, **validators):
+        # Fresh validators are saved for the next incremental run; the
+        # checkpoint is marked once they are committed. A leased URL is
+        # marked processed in the same batch instead.
+        mark = partial(checkpoint.mark, row_id) if checkpoint is not None else None
+        if validators:
+            record_validators(url_db_name, url_table, row_id, **validators, callback=mark)
+        else:
+            record_success(url_db_name, url_table, row_id, callback=mark)
+        if leases is not None:
+            mark_processed(url_db_name, url_table, row_id)
+
+    def url_failed(row_id, url, category, message=None, status=None):
+        # Scheduled for a later run with backoff, or dead-lettered
+        record_failure(url_db_name, url_table, row_id, url, category, message, status, retry_policy)
+
+    if mode == "async":
+        asyncio.run(process_urls_async(urls, url_done, url_failed, concurrency=concurrency))
+        return
+    if mode == "pipeline":
+        process_urls_pipeline(urls, url_done, url_failed, fetchers=batch_size, parsers=parsers,
+                              queue_size=queue_size)
+        return
+
+    # batch_size is the ceiling; the limiter finds the sustainable rate below it
+    concurrency_limiter.maximum = batch_size
+    concurrency_limiter.limit = min(concurrency_limiter.limit, batch_size)
+
+    def process(item):
+        row_id, url, known = item
+        # The checkpoint is marked on the writer thread once the row is committed
+        return fetch_and_store_to_db(url, row_id, on_stored=partial(url_done, row_id), known=known,
+                                     on_failed=partial(url_failed, row_id, url))
 
     with ThreadPoolExecutor(max_workers=batch_size) as executor:
-        future_to_url = {}
-        for i, (row_id, url) in enumerate(urls):
-            port = batch_start + (i % 100)
-            future = executor.submit(fetch_and_store_to_db, url, row_id, port)
-            future_to_url[future] = (row_id, url)
-
-        for future in as_completed(future_to_url):
-            row_id, url = future_to_url[future]
+        # Only a few tasks per worker are pending at a time
+        for (row_id, url, known), future in submit_bounded(executor, process, urls, window=4 * batch_size):
             try:
-                if future.result():
-                    with closing(get_db_connection(url_db_name)) as conn:
-                        with conn:
-                            cursor = conn.cursor()
-                            cursor.execute(f"UPDATE {url_table} SET processed = 1 WHERE id = ?", 
-                                        (row_id,))
-                    
-                    already_processed.append(row_id)
-                    progress["processed"] = already_processed
-                    save_progress(progress)
+                future.result()
             except Exception as e:
                 error_msg = f"Error processing URL ID {row_id}: {e}"
                 print(f"[DEBUG] {error_msg}")
                 log_error(error_msg, row_id, url)
+                url_failed(row_id, url, "other", error_msg)
 
-    print("[DEBUG] All URLs have been processed.")
+    print(f"[DEBUG] Concurrency limiter: {concurrency_limiter.stats()}")
+
+def download_product_images(directory, products_db="products.db", workers=32, max_rate=None, thumbnail_size=None):
+    """Fetch the gallery images of every stored product through the proxies into `directory`."""
+    fetcher = ImageFetcher(session_pool, proxy_scheduler, get_proxies,
+                           limiter=AdaptiveLimiter(initial=min(10, workers), maximum=workers),
+                           rate_limiter=ByteRateLimiter(max_rate) if max_rate else None)
+    stats = download_images(products_db, directory, fetcher.fetch, workers=workers,
+                            thumbnail_size=thumbnail_size, log_error=log_error)
+    print(f"[DEBUG] Images: {stats}")
+    return stats
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Scrape product pages listed in the URL database.")
+    parser.add_argument("--mode", choices=("threads", "async", "pipeline"), default="threads",
+                        help="fetch engine: a thread pool, a single asyncio event loop, "
+                             "or fetch threads feeding parser processes")
+    parser.add_argument("--batch-size", type=int, default=100,
+                        help="maximum worker threads in threads mode, fetch threads in pipeline mode")
+    parser.add_argument("--parsers", type=int, default=None,
+                        help="parser processes in pipeline mode (default: all cores)")
+    parser.add_argument("--queue-size", type=int, default=200,
+                        help="capacity of each queue between pipeline stages")
+    parser.add_argument("--concurrency", type=int, default=500,
+                        help="maximum in-flight requests in async mode")
+    parser.add_argument("--parser", choices=["auto"] + list(extractor.BACKENDS), default="auto",
+                        help="HTML extraction backend")
+    parser.add_argument("--incremental", action="store_true",
+                        help="re-check every URL with conditional requests and store only changed pages")
+    parser.add_argument("--archive", metavar="DIR",
+                        help="also keep every raw page in this archive (see page_archive.py reparse)")
+    parser.add_argument("--images", metavar="DIR",
+                        help="after the crawl, download every product's gallery images into DIR")
+    parser.add_argument("--image-workers", type=int, default=32, help="maximum concurrent image downloads")
+    parser.add_argument("--image-rate", type=parse_size, default=None, metavar="BYTES",
+                        help="cap on image download bytes per second, e.g. 2M")
+    parser.add_argument("--thumbnails", type=int, default=None, metavar="PIXELS",
+                        help="also write JPEG thumbnails of the images (requires Pillow)")
+    parser.add_argument("--stats-port", type=int, default=None, metavar="PORT",
+                        help="serve live metrics on 127.0.0.1:PORT (/metrics for Prometheus, /stats.json)")
+    parser.add_argument("--stats-file", metavar="PATH",
+                        help="write a JSON metrics snapshot to PATH every --stats-interval seconds")
+    parser.add_argument("--stats-interval", type=float, default=10.0, help="seconds between JSON snapshots")
+    parser.add_argument("--lease", action="store_true",
+                        help="claim URLs in leased batches so several worker processes can share Models.db")
+    parser.add_argument("--worker-id", default=None, help="name of this worker with --lease (default: host-pid)")
+    parser.add_argument("--lease-seconds", type=float, default=300.0,
+                        help="lease on claimed URLs, renewed while the worker is alive")
+    args = parser.parse_args()
+    if args.lease and args.incremental:
+        parser.error("--incremental re-checks every URL and runs from a single worker, without --lease")
+    worker_id = (args.worker_id or default_worker_id()) if args.lease else None
+    if worker_id is not None:
+        # Workers sharing a directory must not rotate one log file
+        error_log.path = f"error_log.{worker_id}.jsonl"
+    extractor.DEFAULT_BACKEND = args.parser
+    if args.archive:
+        raw_archive = PageArchive(args.archive, log_error=log_error).open()
+    stats_server = start_stats_server(args.stats_port) if args.stats_port is not None else None
+    snapshots = SnapshotWriter(args.stats_file, args.stats_interval).start() if args.stats_file else None
+
     print("[DEBUG] Starting URL processing")
     try:
         process_urls_from_db(url_db_name="Models.db", url_table="models_urls", 
-                           url_column="url", batch_size=100)
+                           url_column="url", batch_size=args.batch_size,
+                           mode=args.mode, concurrency=args.concurrency,
+                           incremental=args.incremental, parsers=args.parsers,
+                           queue_size=args.queue_size, worker_id=worker_id, lease_seconds=args.lease_seconds)
+        if args.images:
+            download_product_images(args.images, workers=args.image_workers, max_rate=args.image_rate,
+                                    thumbnail_size=args.thumbnails)
     except Exception as e:
         error_msg = f"Unhandled error during execution: {e}"
         print(f"[DEBUG] {error_msg}")
         log_error(error_msg)
+    finally:
+        if raw_archive is not None:
+            raw_archive.close()
+            print(f"[DEBUG] Page archive: {raw_archive.stats()}")
+        if snapshots is not None:
+            snapshots.stop()
+        if stats_server is not None:
+            stats_server.shutdown()
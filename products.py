@@ -1,7 +1,17 @@
 import sqlite3
 import requests
-from bs4 import BeautifulSoup
 import json
+import time
+from functools import partial
+
+from extractor import (PRODUCTS_FINGERPRINT_COLUMN, PRODUCTS_VERSION_COLUMN, extract_product_page,
+                       product_identity, spec_fingerprint)
+from proxy_scheduler import ProxyScheduler, proxy_ok
+from session_pool import SessionPool
+from search_index import SEARCH_SCHEMA_SQL, queue_search_entry
+from spec_store import SPEC_SCHEMA_SQL, queue_specs
+from sqlite_sink import get_sink, close_sinks
+from url_store import iter_url_rows
 
 # Proxy settings
 username = "Yusuf_iV5xx"
@@ -10,6 +20,11 @@ proxy_base = "dc.oxylabs.io"
 starting_port = 8052
 max_port = 9000
 
+# Keep-alive sessions reused across URLs, one pool per proxy port
+session_pool = SessionPool()
+# Health-weighted port choice across the whole range
+proxy_scheduler = ProxyScheduler(range(starting_port, max_port + 1))
+
 def get_proxies(port):
     """Generate proxy settings for a specific port."""
     proxy = f"{proxy_base}:{port}"
@@ -17,8 +32,19 @@ def get_proxies(port):
         "https": f"https://user-{username}:{password}@{proxy}",
     }
 
-def fetch_and_store_to_db(url, db_name="products.db", retries=5):
-    """Fetch product data and store it in the database."""
+def get_products_sink(db_name):
+    """Return the batched writer for the products table of `db_name`."""
+    return get_sink(db_name, table="products", create_sql=("""
+        CREATE TABLE IF NOT EXISTS products (
+            ID INTEGER PRIMARY KEY AUTOINCREMENT,
+            Brand TEXT,
+            ProductName TEXT,
+            Images TEXT
+        )
+    """, *SPEC_SCHEMA_SQL, *SEARCH_SCHEMA_SQL), version_column=PRODUCTS_VERSION_COLUMN)
+
+def fetch_and_store_to_db(url, db_name="products.db", retries=5, on_stored=None):
+    """Fetch product data and queue it for the database."""
     # Define headers with user agent
     headers = {
         "User-Agent": (
@@ -30,106 +56,59 @@ def fetch_and_store_to_db(url, db_name="products.db", retries=5):
         "Connection": "keep-alive",
     }
 
-    # Define the base domain
-    base_domain = "https://www.laptoparena.net"
-
-    port = starting_port  # Start with the first port
+    port = None
 
     for attempt in range(retries):
         try:
+            # Pick the healthiest port, avoiding the one that just failed
+            port = proxy_scheduler.acquire(previous=port)
             proxies = get_proxies(port)
             print(f"Using proxy on port: {port}")
             
-            # Send GET request with the proxy
-            response = requests.get(url, headers=headers, proxies=proxies, timeout=10)
+            # Send GET request with the proxy over a pooled keep-alive session
+            start = time.monotonic()
+            try:
+                with session_pool.session(port, proxies) as session:
+                    response = session.get(url, headers=headers, proxies=proxies, timeout=10)
+            except requests.RequestException:
+                proxy_scheduler.report(port, False, time.monotonic() - start)
+                raise
+            proxy_scheduler.report(port, proxy_ok(response.status_code), time.monotonic() - start)
             
             if response.status_code != 200:
                 print(f"Failed with status code: {response.status_code}. Retrying...")
                 raise requests.RequestException
             
-            # Parse HTML content
-            soup = BeautifulSoup(response.content, "html.parser")
-            table = soup.find("table", class_="specs responsive")
-            gallery = soup.find("div", class_="gallery")
+            # Extract the spec table and gallery
+            page = extract_product_page(response.content)
             
-            if not table:
+            if page is None:
                 print("Specified table not found on the page. Skipping...")
                 return False
             
-            # Extract rows from the table
-            rows = table.find_all("tr")
-            product_data = {}
-            brand = model_name = part_number = "Unknown"
-
-            for row in rows:
-                if row.find("td"):
-                    cells = row.find_all("td")
-                    if len(cells) == 2:
-                        label = cells[0].get_text(strip=True)
-                        value = cells[1].get_text(strip=True)
-                        product_data[label] = value
-
-                        if label.lower() == "brand":
-                            brand = value
-                        elif label.lower() == "model name":
-                            model_name = value
-                        elif label.lower() == "part number":
-                            part_number = value
+            product_data = page.specs
+            brand, model_name, part_number = product_identity(product_data)
 
             # Combine Brand, Model Name, and Part Number to create Product Name
             product_name = f"{brand} {model_name} {part_number}"
 
-            # Extract image URLs and prepend the base domain
-            image_urls = []
-            if gallery:
-                for img in gallery.find_all("img", class_="gallery-image"):
-                    src = img.get("data-src") or img.get("src")
-                    if src:
-                        full_url = f"{base_domain}{src}"  # Prepend base domain to the URL
-                        image_urls.append(full_url)
-
             # Convert image URLs to JSON for storage
-            images_json = json.dumps(image_urls)
-
-            # Connect to SQLite database
-            conn = sqlite3.connect(db_name)
-            cursor = conn.cursor()
-            
-            # Ensure the products table exists
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS products (
-                    ID INTEGER PRIMARY KEY AUTOINCREMENT,
-                    Brand TEXT,
-                    ProductName TEXT,
-                    Images TEXT
-                )
-            """)
-            
-            # Check existing columns
-            cursor.execute("PRAGMA table_info(products)")
-            existing_columns = {column[1] for column in cursor.fetchall()}
-
-            for column in product_data.keys():
-                if column not in existing_columns:
-                    cursor.execute(f"ALTER TABLE products ADD COLUMN \"{column}\" TEXT")
-
-            # Insert product data
-            placeholders = ', '.join(['?'] * (len(product_data) + 3))
-            columns = ', '.join(['"Brand"', '"ProductName"', '"Images"'] + [f'"{column}"' for column in product_data.keys()])
-            values = [brand, product_name, images_json] + list(product_data.values())
-            cursor.execute(f"INSERT INTO products ({columns}) VALUES ({placeholders})", values)
-            
-            # Commit and close
-            conn.commit()
-            conn.close()
-            print(f"Product '{product_name}' has been saved to the database.")
+            images_json = json.dumps(page.images)
+
+            # Queue the row; new spec labels become columns when the batch is written
+            row = {"Brand": brand, "ProductName": product_name, "Images": images_json,
+                   PRODUCTS_FINGERPRINT_COLUMN: spec_fingerprint(product_data)}
+            for column, value in product_data.items():
+                row.setdefault(column, value)
+            sink = get_products_sink(db_name)
+            sink.put(row)
+            queue_search_entry(sink, url, product_data)
+            queue_specs(sink, url, product_data, on_stored)
+            print(f"Product '{product_name}' has been queued for the database.")
             return True
 
         except requests.RequestException:
-            print(f"Request failed on port {port}. Trying next port...")
-            port += 1
-            if port > max_port:
-                port = starting_port  # Wrap around to the first port
+            print(f"Request failed on port {port}. Trying another port...")
 
     print("All retries failed. Skipping this URL.")
     return False
@@ -151,22 +130,32 @@ def process_urls_from_db(url_db_name="Models_urls-2.db", url_table="models_urls"
         """)
         conn.commit()
     
-    # Fetch unprocessed URLs
-    cursor.execute(f"SELECT id, {url_column} FROM {url_table} WHERE processed = 0 ORDER BY id ASC")
-    urls = cursor.fetchall()
+    # Read unprocessed URLs page by page rather than all at once
+    urls = iter_url_rows(url_db_name, url_table, columns=("id", url_column))
     
+    # IDs whose product rows the writer thread has committed
+    stored_ids = []
+
+    def mark_stored():
+        done = [stored_ids.pop() for _ in range(len(stored_ids))]
+        if done:
+            cursor.executemany(f"UPDATE {url_table} SET processed = 1 WHERE id = ?",
+                               [(row_id,) for row_id in done])
+            conn.commit()
+
     for url_row in urls:
         row_id, url = url_row
         print(f"Processing URL (ID {row_id}): {url}")
         
         # Attempt to process and store the product data
-        if fetch_and_store_to_db(url):
-            # Mark the URL as processed
-            cursor.execute(f"UPDATE {url_table} SET processed = 1 WHERE id = ?", (row_id,))
-            conn.commit()
-        else:
+        if not fetch_and_store_to_db(url, on_stored=partial(stored_ids.append, row_id)):
             print(f"Failed to process URL: {url}. Skipping...")
+
+        # Mark the URLs stored so far as processed
+        mark_stored()
     
+    close_sinks()
+    mark_stored()
     conn.close()
     print("All URLs have been processed.")
 
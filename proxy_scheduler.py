@@ -0,0 +1,156 @@
+import random
+import threading
+import time
+
+from concurrency import PROXY_ERROR_STATUSES
+
+def proxy_ok(status_code):
+    """Whether a response with `status_code` counts as a healthy proxy attempt.
+
+    Only proxy and gateway errors count against the port; a throttled (429,
+    503) or failed response from the site itself does not.
+    """
+    return status_code not in PROXY_ERROR_STATUSES
+
+class PortHealth:
+    """Running health estimate for one proxy port."""
+
+    __slots__ = ("latency", "success", "in_flight", "consecutive_failures", "trips",
+                 "open_until", "attempts", "failures")
+
+    def __init__(self, success=1.0):
+        self.latency = None             # EWMA of request latency in seconds
+        self.success = success          # EWMA of the success rate
+        self.in_flight = 0
+        self.consecutive_failures = 0
+        self.trips = 0                  # Times the circuit opened in a row
+        self.open_until = 0.0           # Circuit open (port unusable) until this time
+        self.attempts = 0
+        self.failures = 0
+
+    def cost(self, default_latency):
+        # Expected time per successful request, spread across concurrent users.
+        # Untried ports are assumed average so they get explored.
+        latency = default_latency if self.latency is None else self.latency
+        return latency / max(self.success, 0.05) * (1 + self.in_flight)
+
+class ProxyScheduler:
+    """Health-weighted proxy port selection with per-port circuit breakers.
+
+    Each acquire samples two eligible ports at random and returns the one with
+    the lower expected cost (latency / success rate, scaled by in-flight
+    requests). This spreads load over the whole port range while steering
+    traffic away from slow or failing ports. A retry (`previous` given) does
+    not explore: it goes to the cheapest port that has already answered and
+    did not fail since, so a URL's few attempts per run are not spent on
+    untried ports that may be dead. After `failure_threshold` consecutive
+    failures a port's circuit opens for `cooldown` seconds, doubling on every
+    repeated trip up to `max_cooldown`. Once the cooldown expires the port is
+    offered again: one success closes the circuit, one failure opens it again.
+    """
+
+    def __init__(self, ports, failure_threshold=2, cooldown=30.0, max_cooldown=600.0,
+                 alpha=0.2, initial_latency=1.0):
+        self.ports = list(ports)
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.alpha = alpha
+        self.mean_latency = initial_latency  # EWMA over all ports
+        self.health = {port: PortHealth() for port in self.ports}
+        self._lock = threading.Lock()
+        self._random = random.Random()
+
+    def acquire(self, previous=None):
+        """Pick a port for the next attempt, avoiding `previous` when possible."""
+        with self._lock:
+            now = time.monotonic()
+            proven = self._proven_port(now, previous) if previous is not None else None
+            if proven is not None:
+                return self._take(proven)
+            candidates = []
+            for _ in range(8):
+                port = self._random.choice(self.ports)
+                health = self.health[port]
+                if port != previous and health.open_until <= now:
+                    candidates.append(port)
+                    if len(candidates) == 2:
+                        break
+            if not candidates:
+                candidates = [self._fallback_port(now, previous)]
+
+            return self._take(min(candidates, key=lambda p: self.health[p].cost(self.mean_latency)))
+
+    def _take(self, port):
+        health = self.health[port]
+        health.in_flight += 1
+        health.attempts += 1
+        return port
+
+    def _proven_port(self, now, previous):
+        # The cheapest closed port with a measured latency and no failure since
+        # its last success, or None while no port qualifies (cold start)
+        proven = [port for port, health in self.health.items()
+                  if port != previous and health.open_until <= now and health.latency is not None
+                  and not health.consecutive_failures and not health.trips]
+        return min(proven, key=lambda p: self.health[p].cost(self.mean_latency)) if proven else None
+
+    def _fallback_port(self, now, previous):
+        # Sampling found nothing usable: scan for any closed circuit, otherwise
+        # fall back to the port whose cooldown ends first
+        usable = [port for port in self.ports
+                  if self.health[port].open_until <= now and port != previous]
+        if usable:
+            return self._random.choice(usable)
+        return min(self.ports, key=lambda p: self.health[p].open_until)
+
+    def report(self, port, ok, latency=None):
+        """Record the outcome of an attempt made through `port`."""
+        with self._lock:
+            health = self.health[port]
+            health.in_flight = max(0, health.in_flight - 1)
+            health.success += self.alpha * ((1.0 if ok else 0.0) - health.success)
+            if latency is not None:
+                if health.latency is None:
+                    health.latency = latency
+                else:
+                    health.latency += self.alpha * (latency - health.latency)
+                self.mean_latency += self.alpha * (latency - self.mean_latency)
+
+            if ok:
+                health.consecutive_failures = 0
+                health.trips = 0
+                return
+
+            health.failures += 1
+            health.consecutive_failures += 1
+            # A port on probation after a cooldown trips again on its first failure
+            if health.consecutive_failures >= self.failure_threshold or health.trips:
+                cooldown = min(self.cooldown * (2 ** health.trips), self.max_cooldown)
+                health.open_until = time.monotonic() + cooldown
+                health.trips += 1
+                health.consecutive_failures = 0
+
+    def stats(self):
+        """Return attempt, failure and circuit counters across all ports."""
+        with self._lock:
+            now = time.monotonic()
+            used = [health for health in self.health.values() if health.attempts]
+            return {
+                "ports": len(self.ports),
+                "ports_used": len(used),
+                "ports_open_circuit": sum(1 for health in self.health.values()
+                                          if health.open_until > now),
+                "attempts": sum(health.attempts for health in used),
+                "failures": sum(health.failures for health in used),
+            }
+
+    def port_stats(self):
+        """Return {port: {attempts, failures, success, latency, open}} for every port used so far."""
+        with self._lock:
+            now = time.monotonic()
+            return {port: {"attempts": health.attempts, "failures": health.failures,
+                           "success": round(health.success, 3),
+                           "latency": round(health.latency, 3) if health.latency is not None else None,
+                           "open": int(health.open_until > now)}
+                    for port, health in self.health.items() if health.attempts}
@@ -0,0 +1,129 @@
+import argparse
+import hashlib
+import re
+import sqlite3
+from contextlib import closing
+
+from extractor import product_identity
+from spec_store import iter_product_specs
+
+# SQLite FTS5 index over brand, model name, part number and the flattened
+# spec text of every product, for lookups by part number or free text
+# ("i7-1255U") without LIKE scans. Like product_specs, entries are queued
+# on the products sink right after the product row and replace the previous
+# entry of the same URL, whose rowid is derived from the URL.
+SEARCH_TABLE = "product_search"
+SEARCH_SCHEMA_SQL = (
+    f"""
+    CREATE VIRTUAL TABLE IF NOT EXISTS {SEARCH_TABLE} USING fts5(
+        url UNINDEXED,
+        brand,
+        product_name,
+        part_number,
+        specs,
+        tokenize = 'unicode61 remove_diacritics 2'
+    )
+    """,
+)
+UPSERT_SQL = (f"INSERT OR REPLACE INTO {SEARCH_TABLE} (rowid, url, brand, product_name, part_number, specs) "
+              f"VALUES (?, ?, ?, ?, ?, ?)")
+# bm25 weight per column (url, brand, product_name, part_number, specs)
+COLUMN_WEIGHTS = (0.0, 2.0, 5.0, 10.0, 1.0)
+# Columns of a products row that are not spec text
+NON_SPEC_LABELS = {"id", "brand", "productname", "product_name", "url", "images", "specs", "rowversion", "fingerprint",
+                   "model name", "part number", "processed"}
+
+def url_rowid(url):
+    """Stable signed 64-bit rowid for the index entry of `url`."""
+    return int.from_bytes(hashlib.blake2b(url.encode("utf-8"), digest_size=8).digest(), "big", signed=True)
+
+def spec_text(specs):
+    """Flatten spec labels and values into one searchable line."""
+    return "; ".join(f"{label}: {value}" for label, value in specs.items()
+                     if value is not None and str(label).lower() not in NON_SPEC_LABELS)
+
+def entry_params(url, specs):
+    brand, model_name, part_number = product_identity(specs)
+    return (url_rowid(url), url, brand, model_name, part_number, spec_text(specs))
+
+def queue_search_entry(sink, url, specs, callback=None):
+    """Queue the index entry of `url` on the products sink, after its product row.
+
+    `specs` is the spec dict or products row. The sink's create_sql must
+    include SEARCH_SCHEMA_SQL.
+    """
+    sink.put_statement(UPSERT_SQL, entry_params(url, specs), callback)
+
+def match_query(text, prefix=True):
+    """Turn free text into an FTS5 query: every word must match, the last as a prefix.
+
+    Words are split the way the unicode61 tokenizer splits them, so
+    "i7-1255U" finds entries with the word "i7" and a word starting with "1255u".
+    """
+    words = re.findall(r"[^\W_]+", text)
+    if not words:
+        return None
+    terms = [f'"{word}"' for word in words]
+    if prefix:
+        terms[-1] += "*"
+    return " ".join(terms)
+
+def search(db_name, text, limit=20, raw=False):
+    """Return the best matches for `text` as dicts, best first.
+
+    With `raw`, `text` is passed to FTS5 unchanged, so its query syntax
+    (OR, NEAR, column filters, ...) can be used.
+    """
+    query = text if raw else match_query(text)
+    if not query:
+        return []
+    weights = ", ".join(str(weight) for weight in COLUMN_WEIGHTS)
+    with closing(sqlite3.connect(db_name, timeout=30.0)) as conn:
+        cursor = conn.execute(f"""
+            SELECT url, brand, product_name, part_number,
+                   snippet({SEARCH_TABLE}, 4, '[', ']', '...', 8) AS snippet,
+                   bm25({SEARCH_TABLE}, {weights}) AS rank
+            FROM {SEARCH_TABLE} WHERE {SEARCH_TABLE} MATCH ?
+            ORDER BY rank LIMIT ?
+        """, (query, limit))
+        columns = [description[0] for description in cursor.description]
+        return [dict(zip(columns, row)) for row in cursor]
+
+def rebuild(db_name, table="products"):
+    """Rebuild the index from every product row; returns the entries written."""
+    with closing(sqlite3.connect(db_name, timeout=30.0)) as conn:
+        for statement in SEARCH_SCHEMA_SQL:
+            conn.execute(statement)
+        written = 0
+        with conn:
+            conn.execute(f"DELETE FROM {SEARCH_TABLE}")
+            for batch in iter_product_specs(conn, table):
+                conn.executemany(UPSERT_SQL, [entry_params(url, specs) for url, specs in batch])
+                written += len(batch)
+            # Merge the index segments written above for faster queries
+            conn.execute(f"INSERT INTO {SEARCH_TABLE} ({SEARCH_TABLE}) VALUES ('optimize')")
+        return written
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Full-text search over the scraped products.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    rebuild_parser = commands.add_parser("rebuild", help="re-index every stored product")
+    rebuild_parser.add_argument("--db", default="products.db")
+    rebuild_parser.add_argument("--table", default="products")
+
+    query_parser = commands.add_parser("query", help="find products by part number or free text")
+    query_parser.add_argument("text")
+    query_parser.add_argument("--db", default="products.db")
+    query_parser.add_argument("--limit", type=int, default=20)
+    query_parser.add_argument("--raw", action="store_true", help="pass the text as an FTS5 query")
+    args = parser.parse_args()
+
+    if args.command == "rebuild":
+        print(f"Indexed {rebuild(args.db, args.table)} products in {args.db}")
+    else:
+        for result in search(args.db, args.text, args.limit, args.raw):
+            print(f"{result['rank']:8.2f}  {result['brand']} {result['product_name']} "
+                  f"({result['part_number']})  {result['url']}")
+            if result["snippet"]:
+                print(f"          {result['snippet']}")
@@ -0,0 +1,144 @@
+import threading
+import time
+from contextlib import contextmanager
+
+import requests
+from requests.adapters import HTTPAdapter
+
+def _connection_counts(session):
+    """Return (connections opened, requests sent) across a session's urllib3 pools."""
+    connections = sent = 0
+    # The same adapter is usually mounted for both http:// and https://
+    adapters = {id(adapter): adapter for adapter in session.adapters.values()}
+    for adapter in adapters.values():
+        managers = [adapter.poolmanager] + list(getattr(adapter, "proxy_manager", {}).values())
+        for manager in managers:
+            for key in manager.pools.keys():
+                try:
+                    pool = manager.pools[key]
+                except KeyError:  # Evicted by another thread meanwhile
+                    continue
+                connections += pool.num_connections
+                sent += pool.num_requests
+    return connections, sent
+
+class SessionPool:
+    """Thread-safe pool of keep-alive requests sessions keyed by proxy port.
+
+    A session is checked out for one request at a time, so its connections
+    (and the TLS tunnel through the proxy) are reused by whichever URL uses
+    that port next. At most `max_per_port` sessions exist per port, and idle
+    sessions are closed after `idle_timeout` seconds.
+    """
+
+    def __init__(self, max_per_port=8, idle_timeout=60.0, headers=None):
+        self.max_per_port = max_per_port
+        self.idle_timeout = idle_timeout
+        self.headers = headers or {}
+        self._idle = {}      # port -> [(last_used, session)]
+        self._in_use = {}    # port -> number of checked-out sessions
+        self._condition = threading.Condition()
+        self._last_eviction = time.monotonic()
+        self._sessions_created = 0
+        self._sessions_evicted = 0
+        self._closed_connections = 0
+        self._closed_requests = 0
+        self._live = set()
+
+    @contextmanager
+    def session(self, port, proxies=None):
+        """Check out a session for `port`, creating one if none is idle."""
+        session = self._checkout(port, proxies)
+        try:
+            yield session
+        finally:
+            self._checkin(port, session)
+
+    def _checkout(self, port, proxies):
+        with self._condition:
+            self._maybe_evict()
+            while True:
+                idle = self._idle.get(port)
+                if idle:
+                    _, session = idle.pop()
+                    break
+                if self._in_use.get(port, 0) < self.max_per_port:
+                    session = self._new_session(proxies)
+                    break
+                self._condition.wait()
+            self._in_use[port] = self._in_use.get(port, 0) + 1
+            return session
+
+    def _checkin(self, port, session):
+        with self._condition:
+            self._in_use[port] -= 1
+            self._idle.setdefault(port, []).append((time.monotonic(), session))
+            self._condition.notify()
+
+    def _new_session(self, proxies):
+        session = requests.Session()
+        session.headers.update(self.headers)
+        if proxies:
+            session.proxies.update(proxies)
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=1)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        self._sessions_created += 1
+        self._live.add(session)
+        return session
+
+    def _maybe_evict(self):
+        # Called with the lock held; scan at most once per second
+        now = time.monotonic()
+        if now - self._last_eviction < 1.0:
+            return
+        self._last_eviction = now
+        for port, idle in list(self._idle.items()):
+            keep = []
+            for last_used, session in idle:
+                if now - last_used > self.idle_timeout:
+                    self._close_session(session)
+                    self._sessions_evicted += 1
+                else:
+                    keep.append((last_used, session))
+            if keep:
+                self._idle[port] = keep
+            else:
+                del self._idle[port]
+
+    def _close_session(self, session):
+        connections, sent = _connection_counts(session)
+        self._closed_connections += connections
+        self._closed_requests += sent
+        self._live.discard(session)
+        session.close()
+
+    def evict_idle(self):
+        """Close every session that has been idle longer than `idle_timeout`."""
+        with self._condition:
+            self._last_eviction = 0.0
+            self._maybe_evict()
+
+    def stats(self):
+        """Return session, handshake and reuse counters for the pool."""
+        with self._condition:
+            connections, sent = self._closed_connections, self._closed_requests
+            for session in list(self._live):
+                live_connections, live_sent = _connection_counts(session)
+                connections += live_connections
+                sent += live_sent
+            return {
+                "sessions_created": self._sessions_created,
+                "sessions_evicted": self._sessions_evicted,
+                "sessions_live": len(self._live),
+                "requests": sent,
+                "handshakes": connections,
+                "reuse_rate": 1 - connections / sent if sent else 0.0,
+            }
+
+    def close(self):
+        """Close every session, including ones still checked out."""
+        with self._condition:
+            for session in list(self._live):
+                self._close_session(session)
+            self._idle.clear()
@@ -0,0 +1,238 @@
+import argparse
+import json
+import re
+import sqlite3
+from contextlib import closing
+
+from sqlite_sink import quote_identifier
+
+# Typed copy of the specs the scrapers store as text, one row per product
+# URL in `product_specs`. Common labels are parsed into numbers in a fixed
+# unit so range queries ("RAM >= 16 GB and weight < 1.5 kg") can use an
+# index instead of scanning and re-parsing every row. The row is queued on
+# the products sink right after the product itself, so both are committed
+# by the same writer in order.
+SPEC_TABLE = "product_specs"
+# Typed column -> labels it is parsed from (compared lower-cased, first match wins)
+SPEC_LABELS = {
+    "ram_gb": ("ram", "memory", "installed ram", "internal memory", "ram size", "system memory"),
+    "storage_gb": ("storage", "total storage capacity", "storage capacity", "ssd capacity",
+                   "ssd", "hdd capacity", "hard drive"),
+    "weight_kg": ("weight",),
+    "screen_in": ("display size", "display diagonal", "screen size", "screen diagonal", "display"),
+    "battery_wh": ("battery", "battery capacity", "battery capacity (watt-hours)", "battery capacity (wh)"),
+    "price": ("price",),
+}
+SPEC_COLUMNS = tuple(SPEC_LABELS) + ("currency",)
+
+SPEC_SCHEMA_SQL = (
+    f"""
+    CREATE TABLE IF NOT EXISTS {SPEC_TABLE} (
+        url TEXT PRIMARY KEY,
+        ram_gb REAL,
+        storage_gb REAL,
+        weight_kg REAL,
+        screen_in REAL,
+        battery_wh REAL,
+        price REAL,
+        currency TEXT
+    )
+    """,
+    *(f"CREATE INDEX IF NOT EXISTS idx_{SPEC_TABLE}_{column} ON {SPEC_TABLE} ({column})"
+      for column in SPEC_LABELS),
+)
+UPSERT_SQL = (f"INSERT OR REPLACE INTO {SPEC_TABLE} (url, {', '.join(SPEC_COLUMNS)}) "
+              f"VALUES ({', '.join('?' * (len(SPEC_COLUMNS) + 1))})")
+
+NUMBER = r"(\d+(?:[.,]\d+)*)"
+CAPACITY_PATTERN = re.compile(r"(?:(\d+)\s*[x×]\s*)?" + NUMBER + r"\s*(TB|GB|MB)\b", re.IGNORECASE)
+WEIGHT_PATTERN = re.compile(NUMBER + r"\s*(kg|g|lbs?|pounds)\b", re.IGNORECASE)
+SCREEN_PATTERN = re.compile(NUMBER + r"\s*(\"|''|”|″|inch(?:es)?\b|in\b|cm\b)", re.IGNORECASE)
+BATTERY_PATTERN = re.compile(NUMBER + r"\s*Wh\b", re.IGNORECASE)
+PRICE_PATTERN = re.compile(r"([€$£]|[A-Z]{3})?\s*" + NUMBER + r"\s*([€$£]|[A-Z]{3})?")
+CURRENCY_SYMBOLS = {"€": "EUR", "$": "USD", "£": "GBP"}
+GB_PER_UNIT = {"tb": 1000.0, "gb": 1.0, "mb": 1 / 1000}
+KG_PER_UNIT = {"kg": 1.0, "g": 0.001, "lb": 0.45359237, "lbs": 0.45359237, "pounds": 0.45359237}
+
+def parse_number(text):
+    """Parse "1,299.00", "1.299,00", "15,6" or "16" into a float."""
+    if "," in text and "." in text:
+        # The later separator is the decimal point
+        decimal = "," if text.rfind(",") > text.rfind(".") else "."
+        text = text.replace("." if decimal == "," else ",", "").replace(decimal, ".")
+    elif "," in text:
+        # "1,299" groups thousands, "15,6" is a decimal comma
+        fraction = text.rpartition(",")[2]
+        text = text.replace(",", "") if text.count(",") > 1 or len(fraction) == 3 else text.replace(",", ".")
+    elif text.count(".") > 1:
+        text = text.replace(".", "")
+    return float(text)
+
+def parse_capacity(value, total=False):
+    """Gigabytes in "16 GB" or, with `total`, the sum of "1 TB SSD + 2 x 512 GB"."""
+    sizes = [int(count or 1) * parse_number(number) * GB_PER_UNIT[unit.lower()]
+             for count, number, unit in CAPACITY_PATTERN.findall(value)]
+    if not sizes:
+        return None
+    return sum(sizes) if total else sizes[0]
+
+def parse_weight(value):
+    match = WEIGHT_PATTERN.search(value)
+    return parse_number(match.group(1)) * KG_PER_UNIT[match.group(2).lower()] if match else None
+
+def parse_screen(value):
+    match = SCREEN_PATTERN.search(value)
+    if match is None:
+        return None
+    size = parse_number(match.group(1))
+    return size / 2.54 if match.group(2).lower() == "cm" else size
+
+def parse_battery(value):
+    match = BATTERY_PATTERN.search(value)
+    return parse_number(match.group(1)) if match else None
+
+def parse_price(value):
+    """Return (amount, currency code or None)."""
+    match = PRICE_PATTERN.search(value)
+    if match is None:
+        return None, None
+    currency = match.group(1) or match.group(3)
+    return parse_number(match.group(2)), CURRENCY_SYMBOLS.get(currency, currency)
+
+PARSERS = {
+    "ram_gb": parse_capacity,
+    "storage_gb": lambda value: parse_capacity(value, total=True),
+    "weight_kg": parse_weight,
+    "screen_in": parse_screen,
+    "battery_wh": parse_battery,
+}
+_LABEL_COLUMNS = {label: column for column, labels in SPEC_LABELS.items() for label in labels}
+
+def normalize_specs(specs):
+    """Return {typed column: value} for the spec labels it recognises.
+
+    `specs` maps spec labels to their text, as in ProductPage.specs or a
+    products row. Values that cannot be parsed are left out.
+    """
+    typed = {}
+    for label, value in specs.items():
+        column = _LABEL_COLUMNS.get(str(label).strip().rstrip(":").lower())
+        if column is None or column in typed or not isinstance(value, str):
+            continue
+        try:
+            if column == "price":
+                amount, currency = parse_price(value)
+                if amount is not None:
+                    typed["price"] = amount
+                    typed["currency"] = currency
+            else:
+                parsed = PARSERS[column](value)
+                if parsed is not None:
+                    typed[column] = round(parsed, 3)
+        except ValueError:
+            continue
+    return typed
+
+def spec_params(url, specs):
+    typed = normalize_specs(specs)
+    return (url, *(typed.get(column) for column in SPEC_COLUMNS))
+
+def queue_specs(sink, url, specs, callback=None):
+    """Queue the typed specs of `url` on the products sink, after its product row.
+
+    The sink's create_sql must include SPEC_SCHEMA_SQL. `callback()` runs
+    once the typed row is committed, which is after the product row.
+    """
+    sink.put_statement(UPSERT_SQL, spec_params(url, specs), callback)
+
+def iter_product_specs(conn, table="products", batch_size=1000, where=None, params=()):
+    """Yield lists of (url, specs) for the rows of a products table.
+
+    Reads either the spec columns of prducts-fast.py or the JSON `specs`
+    column of complete.py. `where` optionally filters the rows.
+    """
+    cursor = conn.execute(f"SELECT * FROM {quote_identifier(table)}" + (f" WHERE {where}" if where else ""),
+                          params)
+    columns = [description[0] for description in cursor.description]
+    lower = [column.lower() for column in columns]
+    if "url" not in lower:
+        raise ValueError(f"Table {table} has no url column to key on")
+    url_index = lower.index("url")
+    specs_index = lower.index("specs") if "specs" in lower else None
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            return
+        if specs_index is not None:
+            yield [(row[url_index], json.loads(row[specs_index] or "{}")) for row in rows]
+        else:
+            yield [(row[url_index], dict(zip(columns, row))) for row in rows]
+
+def rebuild(db_name, table="products"):
+    """Rebuild `product_specs` from every product row; returns the rows written."""
+    with closing(sqlite3.connect(db_name, timeout=30.0)) as conn:
+        for statement in SPEC_SCHEMA_SQL:
+            conn.execute(statement)
+        written = 0
+        with conn:
+            conn.execute(f"DELETE FROM {SPEC_TABLE}")
+            for batch in iter_product_specs(conn, table):
+                conn.executemany(UPSERT_SQL, [spec_params(url, specs) for url, specs in batch])
+                written += len(batch)
+        return written
+
+def find_products(db_name, minimum=None, maximum=None, limit=None):
+    """Return typed spec rows (as dicts) with every column within the given bounds.
+
+    `minimum` and `maximum` map typed columns to inclusive and exclusive
+    bounds, e.g. minimum={"ram_gb": 16}, maximum={"weight_kg": 1.5}.
+    """
+    conditions = []
+    params = []
+    for bounds, operator in ((minimum or {}, ">="), (maximum or {}, "<")):
+        for column, bound in bounds.items():
+            if column not in SPEC_LABELS:
+                raise ValueError(f"Unknown spec column {column!r}; choose from {', '.join(SPEC_LABELS)}")
+            conditions.append(f"{column} {operator} ?")
+            params.append(bound)
+    sql = f"SELECT url, {', '.join(SPEC_COLUMNS)} FROM {SPEC_TABLE}"
+    if conditions:
+        sql += " WHERE " + " AND ".join(conditions)
+    sql += " ORDER BY url"
+    if limit:
+        sql += f" LIMIT {int(limit)}"
+    with closing(sqlite3.connect(db_name, timeout=30.0)) as conn:
+        cursor = conn.execute(sql, params)
+        columns = [description[0] for description in cursor.description]
+        return [dict(zip(columns, row)) for row in cursor]
+
+def parse_bounds(values):
+    bounds = {}
+    for value in values:
+        column, _, number = value.partition("=")
+        bounds[column.strip()] = float(number)
+    return bounds
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Typed, indexed spec values of the scraped products.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    rebuild_parser = commands.add_parser("rebuild", help="re-parse every stored product into product_specs")
+    rebuild_parser.add_argument("--db", default="products.db")
+    rebuild_parser.add_argument("--table", default="products")
+
+    query_parser = commands.add_parser("query", help="list products within spec ranges")
+    query_parser.add_argument("--db", default="products.db")
+    query_parser.add_argument("--min", action="append", default=[], metavar="COLUMN=VALUE",
+                              help=f"inclusive lower bound, e.g. ram_gb=16 (columns: {', '.join(SPEC_LABELS)})")
+    query_parser.add_argument("--max", action="append", default=[], metavar="COLUMN=VALUE",
+                              help="exclusive upper bound, e.g. weight_kg=1.5")
+    query_parser.add_argument("--limit", type=int, default=50)
+    args = parser.parse_args()
+
+    if args.command == "rebuild":
+        print(f"Stored typed specs for {rebuild(args.db, args.table)} products in {args.db}")
+    else:
+        for row in find_products(args.db, parse_bounds(args.min), parse_bounds(args.max), args.limit):
+            print(row["url"], " ".join(f"{column}={row[column]}" for column in SPEC_COLUMNS
+                                       if row[column] is not None))
@@ -0,0 +1,329 @@
+import queue
+import sqlite3
+import threading
+import time
+from collections import namedtuple
+
+from metrics import DB_ROWS, DB_WRITE_SECONDS
+
+# Shared by every scraper: one writer thread per database owns the only
+# connection, so workers never contend on busy_timeout.
+_STOP = object()
+
+# A statement queued with put_statement instead of a row
+Statement = namedtuple("Statement", ["sql", "params"])
+
+def quote_identifier(name):
+    """Quote a column or table name for use in SQL."""
+    return '"' + str(name).replace('"', '""') + '"'
+
+def user_tables(conn):
+    """Names of the ordinary tables, in creation order.
+
+    SQLite's own tables, virtual tables such as the FTS5 search index and
+    the shadow tables holding their data (`<virtual table>_*`) are left out:
+    they are indexes over other tables, not data to export.
+    """
+    tables = conn.execute("SELECT name, sql FROM sqlite_master "
+                          "WHERE type = 'table' AND name NOT LIKE 'sqlite_%'").fetchall()
+    virtual = [name for name, sql in tables if (sql or "").upper().startswith("CREATE VIRTUAL TABLE")]
+    return [name for name, _ in tables
+            if name not in virtual and not any(name.startswith(f"{table}_") for table in virtual)]
+
+def enable_wal(conn, timeout=30.0):
+    """Switch the database of `conn` to WAL mode; returns the journal mode.
+
+    Unlike other statements, the switch fails at once instead of waiting out
+    busy_timeout while another connection uses the database, as happens when
+    several processes open a new database together, so it is retried here.
+    """
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            return conn.execute("PRAGMA journal_mode=WAL").fetchone()[0]
+        except sqlite3.OperationalError:
+            if time.monotonic() >= deadline:
+                raise
+            time.sleep(0.05)
+
+class SQLiteSink:
+    """Queue-fed writer that groups inserts into batched transactions."""
+
+    def __init__(self, db_name, table="products", create_sql=None, insert_verb="INSERT",
+                 dynamic_columns=True, key_column=None, unchanged_columns=(), version_column=None,
+                 batch_size=500, flush_interval=1.0, max_queue=10000, log_error=print):
+        self.db_name = db_name
+        self.table = table
+        self.create_sql = create_sql
+        self.insert_verb = insert_verb
+        # Rows are upserted on this UNIQUE column: a row replaces the stored row
+        # with the same key, unless all of `unchanged_columns` already match it
+        self.key_column = key_column
+        self.unchanged_columns = tuple(unchanged_columns)
+        # Every row written gets the next value of this counter, so readers can
+        # ask for rows changed since a version they have already seen
+        self.version_column = version_column
+        self.dynamic_columns = dynamic_columns
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.log_error = log_error
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.columns = set()  # lower-cased, SQLite column names are case-insensitive
+        self.primary_key = set()
+        self.rows_written = 0
+        self.batches_written = 0
+        self.columns_added = 0
+        self._thread = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def start(self):
+        """Open the connection, prepare the table and start the writer thread."""
+        if self._thread is not None:
+            return self
+        # Autocommit mode so ALTERs and INSERTs share the explicit transactions below
+        self.conn = sqlite3.connect(self.db_name, timeout=30.0, check_same_thread=False,
+                                    isolation_level=None)
+        enable_wal(self.conn)
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("PRAGMA busy_timeout=30000")
+        # create_sql is one statement or a sequence of them (e.g. a table and its indexes)
+        for statement in [self.create_sql] if isinstance(self.create_sql, str) else self.create_sql or ():
+            self.conn.execute(statement)
+        if self.key_column:
+            self._ensure_unique_key()
+        self._load_columns()
+        if self.version_column:
+            if self.version_column.lower() not in self.columns:
+                self.conn.execute(f"ALTER TABLE {quote_identifier(self.table)} "
+                                  f"ADD COLUMN {quote_identifier(self.version_column)} INTEGER")
+                self.columns.add(self.version_column.lower())
+            index = quote_identifier(f"idx_{self.table}_{self.version_column}")
+            self.conn.execute(f"CREATE INDEX IF NOT EXISTS {index} "
+                              f"ON {quote_identifier(self.table)} ({quote_identifier(self.version_column)})")
+        self._thread = threading.Thread(target=self._run, name=f"sink-{self.table}", daemon=True)
+        self._thread.start()
+        return self
+
+    def put(self, row, callback=None):
+        """Queue a row (column -> value); `callback()` runs once it is committed."""
+        self.queue.put((row, callback))
+
+    def put_statement(self, sql, params=(), callback=None):
+        """Queue any other statement (e.g. an UPDATE) to run in the next batch."""
+        self.queue.put((Statement(sql, params), callback))
+
+    def close(self):
+        """Flush everything still queued and stop the writer thread."""
+        if self._thread is None:
+            return
+        self.queue.put(_STOP)
+        self._thread.join()
+        self._thread = None
+        self.conn.close()
+
+    def _run(self):
+        batch = []
+        deadline = time.monotonic() + self.flush_interval
+        while True:
+            timeout = max(0.0, deadline - time.monotonic())
+            try:
+                item = self.queue.get(timeout=timeout)
+            except queue.Empty:
+                item = None
+
+            if item is _STOP:
+                self._flush(batch)
+                return
+            if item is not None:
+                batch.append(item)
+
+            if len(batch) >= self.batch_size or time.monotonic() >= deadline:
+                self._flush(batch)
+                batch = []
+                deadline = time.monotonic() + self.flush_interval
+
+    def _flush(self, batch):
+        if not batch:
+            return
+        try:
+            self._transaction(batch)
+        except sqlite3.Error as e:
+            # Retry row by row so one bad row does not lose the whole batch
+            self.log_error(f"Batch of {len(batch)} rows failed, retrying individually: {e}")
+            written = []
+            for item in batch:
+                try:
+                    self._transaction([item])
+                    written.append(item)
+                except sqlite3.Error as e:
+                    self.log_error(f"Database error while storing row: {e}")
+            batch = written
+
+        for _, callback in batch:
+            if callback is not None:
+                try:
+                    callback()
+                except Exception as e:
+                    self.log_error(f"Sink callback failed: {e}")
+
+    def _ensure_unique_key(self):
+        """Put a UNIQUE index on key_column, removing older duplicate rows if there are any."""
+        table = quote_identifier(self.table)
+        key = quote_identifier(self.key_column)
+        for _, name, unique, *_ in self.conn.execute(f"PRAGMA index_list({table})").fetchall():
+            columns = [row[2] for row in self.conn.execute(f"PRAGMA index_info({quote_identifier(name)})")]
+            if unique and [column.lower() for column in columns] == [self.key_column.lower()]:
+                return
+        # Tables written before upserts have a plain index and possibly duplicates
+        self.conn.execute(f"DROP INDEX IF EXISTS {quote_identifier(f'idx_{self.table}_{self.key_column}')}")
+        index = quote_identifier(f"uq_{self.table}_{self.key_column}")
+        try:
+            self.conn.execute(f"CREATE UNIQUE INDEX {index} ON {table} ({key})")
+        except sqlite3.IntegrityError:
+            removed = self.conn.execute(
+                f"DELETE FROM {table} WHERE {key} IS NOT NULL AND rowid NOT IN "
+                f"(SELECT MAX(rowid) FROM {table} GROUP BY {key})").rowcount
+            self.log_error(f"Removed {removed} older duplicate rows from {self.table} "
+                           f"before making {self.key_column} unique")
+            self.conn.execute(f"CREATE UNIQUE INDEX {index} ON {table} ({key})")
+
+    def _load_columns(self):
+        table_info = self.conn.execute(f"PRAGMA table_info({quote_identifier(self.table)})").fetchall()
+        self.columns = {row[1].lower() for row in table_info}
+        self.primary_key = {row[1].lower() for row in table_info if row[5]}
+
+    def _new_columns(self, rows):
+        new_columns = {}
+        for row in rows:
+            for column in row:
+                if column.lower() not in self.columns:
+                    new_columns.setdefault(column.lower(), column)
+        return new_columns
+
+    def _transaction(self, batch):
+        start = time.perf_counter()
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            self._write(batch)
+        except BaseException:
+            self.conn.execute("ROLLBACK")
+            self._load_columns()  # Forget ALTERs that were rolled back
+            raise
+        self.conn.execute("COMMIT")
+        DB_WRITE_SECONDS.observe(time.perf_counter() - start, self.table)
+        DB_ROWS.inc(self.table, amount=len(batch))
+
+    def _write(self, batch):
+        rows = [self._normalize(row) for row, _ in batch if not isinstance(row, Statement)]
+        statements = [row for row, _ in batch if isinstance(row, Statement)]
+
+        # Add every column introduced by this batch before inserting
+        if self.dynamic_columns:
+            new_columns = self._new_columns(rows)
+            if new_columns:
+                # Another process writing the same database may have added them meanwhile
+                self._load_columns()
+                new_columns = self._new_columns(rows)
+            for column in new_columns.values():
+                self.conn.execute(f"ALTER TABLE {quote_identifier(self.table)} "
+                                  f"ADD COLUMN {quote_identifier(column)} TEXT")
+            self.columns.update(new_columns)
+            self.columns_added += len(new_columns)
+        else:
+            rows = [{column: value for column, value in row.items() if column.lower() in self.columns}
+                    for row in rows]
+
+        if self.version_column and rows:
+            # Inside BEGIN IMMEDIATE, so no other writer can take the same numbers
+            version = self.conn.execute(f"SELECT COALESCE(MAX({quote_identifier(self.version_column)}), 0) "
+                                        f"FROM {quote_identifier(self.table)}").fetchone()[0]
+            rows = [{**row, self.version_column: version + i} for i, row in enumerate(rows, 1)]
+
+        groups = {}
+        for row in rows:
+            groups.setdefault(tuple(row), []).append(tuple(row.values()))
+        for columns, values in groups.items():
+            columns_str = ", ".join(quote_identifier(column) for column in columns)
+            placeholders = ", ".join(["?"] * len(columns))
+            self.conn.executemany(
+                f"{self.insert_verb} INTO {quote_identifier(self.table)} ({columns_str}) "
+                f"VALUES ({placeholders}){self._upsert_clause(columns)}",
+                values,
+            )
+        # Consecutive statements with the same SQL run as one executemany
+        for i, statement in enumerate(statements):
+            if i and statement.sql == statements[i - 1].sql:
+                continue
+            same = [statement.params]
+            for following in statements[i + 1:]:
+                if following.sql != statement.sql:
+                    break
+                same.append(following.params)
+            self.conn.executemany(statement.sql, same)
+
+        self.rows_written += len(rows)
+        self.batches_written += 1
+
+    def _upsert_clause(self, columns):
+        """ON CONFLICT clause that makes an insert of `columns` replace the stored row."""
+        if not self.key_column or self.key_column.lower() not in {column.lower() for column in columns}:
+            return ""
+        key = self.key_column.lower()
+        written = {column.lower() for column in columns}
+        assignments = [f"{quote_identifier(column)} = excluded.{quote_identifier(column)}"
+                       for column in columns if column.lower() != key and column.lower() not in self.primary_key]
+        # Columns the new row does not have are cleared, as if the row had been replaced
+        assignments += [f"{quote_identifier(column)} = NULL"
+                        for column in sorted(self.columns - written - self.primary_key)]
+        if not assignments:
+            return f" ON CONFLICT({quote_identifier(self.key_column)}) DO NOTHING"
+        clause = (f" ON CONFLICT({quote_identifier(self.key_column)}) DO UPDATE SET "
+                  + ", ".join(assignments))
+        unchanged = [column for column in self.unchanged_columns if column.lower() in written]
+        if unchanged:
+            table = quote_identifier(self.table)
+            clause += " WHERE " + " OR ".join(
+                f"{table}.{quote_identifier(column)} IS NOT excluded.{quote_identifier(column)}"
+                for column in unchanged)
+        return clause
+
+    @staticmethod
+    def _normalize(row):
+        # Keep the first of any labels that differ only by case
+        normalized = {}
+        seen = set()
+        for column, value in row.items():
+            if column.lower() not in seen:
+                seen.add(column.lower())
+                normalized[column] = value
+        return normalized
+
+_sinks = {}
+_sinks_lock = threading.Lock()
+
+def get_sink(db_name, table="products", **options):
+    """Return the running sink for (db_name, table), starting it on first use."""
+    with _sinks_lock:
+        sink = _sinks.get((db_name, table))
+        if sink is None:
+            sink = SQLiteSink(db_name, table=table, **options).start()
+            _sinks[(db_name, table)] = sink
+        return sink
+
+def close_sinks():
+    """Drain and close every sink started through get_sink, in start order."""
+    # Commit callbacks may queue work for (or start) a later sink, so keep
+    # going until none are left
+    while True:
+        with _sinks_lock:
+            if not _sinks:
+                return
+            key = next(iter(_sinks))
+            sink = _sinks.pop(key)
+        sink.close()
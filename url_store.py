@@ -0,0 +1,379 @@
+import argparse
+import hashlib
+import json
+import os
+import random
+import socket
+import sqlite3
+import threading
+import time
+from collections import namedtuple
+from contextlib import closing
+
+from sqlite_sink import get_sink, quote_identifier
+
+# Per-URL crawl state kept next to the URL list. The validators let a
+# recrawl send conditional requests and skip pages that did not change.
+URL_STATE_COLUMNS = {
+    "processed": "INTEGER DEFAULT 0",  # 1 once stored, -1 once moved to the dead-letter table
+    "etag": "TEXT",
+    "last_modified": "TEXT",
+    "content_hash": "TEXT",   # Hash of the response body
+    "spec_hash": "TEXT",      # Hash of the extracted specs and images
+    # Retry schedule of a URL whose last fetch failed, see record_failure
+    "attempts": "INTEGER DEFAULT 0",
+    "last_error": "TEXT",      # error_log category, with the status code for http_status
+    "next_attempt_at": "REAL",  # Unix time before which the URL is not fetched again
+    # Worker holding the URL while several workers share the table, see UrlLeases
+    "lease_owner": "TEXT",
+    "lease_expires": "REAL",    # Unix time after which another worker may claim the URL
+}
+DEAD = -1
+# URLs are eligible when they are not dead and their backoff has passed
+ELIGIBLE_SQL = "processed >= 0 AND (next_attempt_at IS NULL OR next_attempt_at <= {now})"
+RETRY_RESET_SQL = "attempts = 0, last_error = NULL, next_attempt_at = NULL"
+LEASE_FREE_SQL = "(lease_expires IS NULL OR lease_expires <= {now})"
+LEASE_RELEASE_SQL = "lease_owner = NULL, lease_expires = NULL"
+
+Validators = namedtuple("Validators", ["etag", "last_modified", "content_hash", "spec_hash"])
+
+def dead_table(url_table):
+    return f"{url_table}_dead"
+
+def ensure_url_columns(conn, url_table):
+    """Add any missing crawl state columns and the dead-letter table; returns the column names added.
+
+    Takes the write lock first, so workers starting together add each column
+    once; the caller commits.
+    """
+    if not conn.in_transaction:
+        conn.execute("BEGIN IMMEDIATE")
+    existing = {row[1].lower() for row in conn.execute(f"PRAGMA table_info({quote_identifier(url_table)})")}
+    added = []
+    for column, definition in URL_STATE_COLUMNS.items():
+        if column not in existing:
+            conn.execute(f"ALTER TABLE {quote_identifier(url_table)} ADD COLUMN {column} {definition}")
+            added.append(column)
+    # Lets a claim find the first pending rows without scanning the processed ones
+    conn.execute(f"CREATE INDEX IF NOT EXISTS {quote_identifier(url_table + '_pending')} "
+                 f"ON {quote_identifier(url_table)} (processed, id)")
+    conn.execute(f"""
+        CREATE TABLE IF NOT EXISTS {quote_identifier(dead_table(url_table))} (
+            id INTEGER PRIMARY KEY,
+            url TEXT,
+            attempts INTEGER,
+            last_error TEXT,
+            message TEXT,
+            dead_at REAL
+        )
+    """)
+    return added
+
+def eligible_where(pending_only=True, now=None):
+    """WHERE clause for the URLs to fetch now: unprocessed ones, or without `pending_only` every live one."""
+    eligible = ELIGIBLE_SQL.format(now=float(now if now is not None else time.time()))
+    return f"processed = 0 AND {eligible}" if pending_only else eligible
+
+def iter_url_rows(url_db_name, url_table, columns=("id", "url"), where="processed = 0", page_size=1000):
+    """Yield `columns` of the matching rows in id order, `page_size` rows at a time.
+
+    Each page is a separate keyset query (`id > last id`), so memory stays
+    O(page_size) and no read transaction stays open while the rows are being
+    processed. The first column must be `id`. The generator may be advanced
+    from different threads, one at a time.
+    """
+    condition = f"({where}) AND id > ?" if where else "id > ?"
+    query = (f"SELECT {', '.join(columns)} FROM {quote_identifier(url_table)} "
+             f"WHERE {condition} ORDER BY id LIMIT ?")
+    last_id = -1
+    with closing(sqlite3.connect(url_db_name, timeout=30.0, check_same_thread=False)) as conn:
+        conn.execute("PRAGMA busy_timeout=30000")
+        while True:
+            rows = conn.execute(query, (last_id, page_size)).fetchall()
+            if not rows:
+                return
+            yield from rows
+            last_id = rows[-1][0]
+
+def count_url_rows(url_db_name, url_table, where="processed = 0"):
+    with closing(sqlite3.connect(url_db_name, timeout=30.0)) as conn:
+        return conn.execute(f"SELECT COUNT(*) FROM {quote_identifier(url_table)}"
+                            + (f" WHERE {where}" if where else "")).fetchone()[0]
+
+def conditional_headers(known):
+    """Request headers that let the server answer 304 for an unchanged page."""
+    if known is None:
+        return {}
+    headers = {}
+    if known.etag:
+        headers["If-None-Match"] = known.etag
+    if known.last_modified:
+        headers["If-Modified-Since"] = known.last_modified
+    return headers
+
+def content_hash(content):
+    """Hash of a response body (bytes or str)."""
+    if isinstance(content, str):
+        content = content.encode("utf-8")
+    return hashlib.blake2b(content, digest_size=16).hexdigest()
+
+def spec_hash(page):
+    """Hash of an extracted ProductPage, stable across markup-only changes."""
+    payload = json.dumps([page.specs, page.images], ensure_ascii=False, sort_keys=True)
+    return hashlib.blake2b(payload.encode("utf-8"), digest_size=16).hexdigest()
+
+def record_validators(url_db_name, url_table, row_id, etag=None, last_modified=None,
+                      content_hash=None, spec_hash=None, callback=None):
+    """Queue the validators seen for `row_id`; `callback()` runs once committed."""
+    sink = get_sink(url_db_name, table=url_table, dynamic_columns=False)
+    sink.put_statement(f"UPDATE {quote_identifier(url_table)} SET etag = ?, last_modified = ?, "
+                       f"content_hash = ?, spec_hash = ?, {RETRY_RESET_SQL} WHERE id = ?",
+                       (etag, last_modified, content_hash, spec_hash, row_id), callback)
+
+def record_success(url_db_name, url_table, row_id, callback=None):
+    """Queue clearing the retry schedule of `row_id` after a fetch without new validators (a 304)."""
+    sink = get_sink(url_db_name, table=url_table, dynamic_columns=False)
+    sink.put_statement(f"UPDATE {quote_identifier(url_table)} SET {RETRY_RESET_SQL} WHERE id = ? AND attempts > 0",
+                       (row_id,), callback)
+
+def mark_processed(url_db_name, url_table, row_id, callback=None):
+    """Queue marking `row_id` processed and releasing its lease, for workers without a checkpoint journal."""
+    sink = get_sink(url_db_name, table=url_table, dynamic_columns=False)
+    sink.put_statement(f"UPDATE {quote_identifier(url_table)} SET processed = 1, {LEASE_RELEASE_SQL} WHERE id = ?",
+                       (row_id,), callback)
+
+class RetryPolicy:
+    """Exponential backoff with jitter for URLs whose fetch failed, and when to give up.
+
+    The n-th consecutive failure schedules the next attempt after
+    base_delay * 2**(n-1) seconds (capped at max_delay), scaled by a random
+    factor between 1 - jitter and 1 so failures from one outage spread out.
+    A URL moves to the dead-letter table after `max_attempts` failures, or
+    after fewer for errors that retrying will not fix: `permanent_statuses`
+    (404, 410) at once, and pages without a spec table after `parse_attempts`.
+    """
+
+    def __init__(self, base_delay=60.0, max_delay=6 * 3600.0, jitter=0.5, max_attempts=8,
+                 permanent_statuses=(404, 410), parse_attempts=2):
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.jitter = jitter
+        self.max_attempts = max_attempts
+        self.permanent_statuses = set(permanent_statuses)
+        self.parse_attempts = parse_attempts
+        self._random = random.Random()
+
+    def attempts_allowed(self, category, status=None):
+        if status in self.permanent_statuses:
+            return 1
+        if category == "parse":
+            return self.parse_attempts
+        return self.max_attempts
+
+    def jitter_factor(self):
+        return 1.0 - self.jitter * self._random.random()
+
+def record_failure(url_db_name, url_table, row_id, url, category, message=None, status=None,
+                   policy=None, now=None):
+    """Queue one more failed attempt for `row_id`: schedule its retry, or move it to the dead-letter table.
+
+    The backoff is computed in SQL from the stored attempt count, so the
+    call needs no read and the three statements commit in one batch.
+    """
+    policy = policy or RetryPolicy()
+    now = now if now is not None else time.time()
+    error = f"{category}:{status}" if status is not None else category
+    allowed = policy.attempts_allowed(category, status)
+    table = quote_identifier(url_table)
+    sink = get_sink(url_db_name, table=url_table, dynamic_columns=False)
+    # SET sees the attempt count from before this failure
+    sink.put_statement(
+        f"UPDATE {table} SET attempts = attempts + 1, last_error = ?, {LEASE_RELEASE_SQL}, "
+        f"next_attempt_at = ? + MIN(?, ? * (1 << MIN(attempts, 30))) * ? WHERE id = ?",
+        (error, now, policy.max_delay, policy.base_delay, policy.jitter_factor(), row_id))
+    sink.put_statement(
+        f"INSERT OR REPLACE INTO {quote_identifier(dead_table(url_table))} "
+        f"(id, url, attempts, last_error, message, dead_at) "
+        f"SELECT id, ?, attempts, last_error, ?, ? FROM {table} WHERE id = ? AND attempts >= ?",
+        (url, message, now, row_id, allowed))
+    sink.put_statement(f"UPDATE {table} SET processed = {DEAD}, next_attempt_at = NULL "
+                       f"WHERE id = ? AND attempts >= ?", (row_id, allowed))
+
+def default_worker_id():
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+class UrlLeases:
+    """Pending URLs of a URL table shared by several workers, claimed in batches under renewable leases.
+
+    Iterating yields `columns` of the rows claimed for `worker_id`. Each claim
+    is one write transaction that takes up to `batch_size` pending, eligible
+    rows whose lease is free or expired and stamps them with the worker and
+    an expiry `lease_seconds` ahead, so two workers never hold the same row.
+    A heartbeat thread extends the leases this worker holds every third of
+    `lease_seconds`; the rows of a worker that died are claimed by the others
+    once its leases expire. Rows leave the pool through mark_processed or
+    record_failure. When nothing is claimable while other workers hold
+    leases, iteration waits for their rows to finish or expire, polling every
+    `poll_interval` seconds at most.
+
+    Workers on several machines need the URL database on a filesystem whose
+    locks SQLite can rely on.
+    """
+
+    def __init__(self, url_db_name, url_table, worker_id=None, columns=("id", "url"), batch_size=100,
+                 lease_seconds=300.0, poll_interval=5.0):
+        self.url_db_name = url_db_name
+        self.url_table = url_table
+        self.worker_id = worker_id or default_worker_id()
+        self.columns = tuple(columns)
+        self.batch_size = batch_size
+        self.lease_seconds = lease_seconds
+        self.poll_interval = poll_interval
+        self.claims = 0
+        self.claimed = 0
+        self.reclaimed = 0  # Rows taken over from another worker's expired lease
+        self.waits = 0
+        self._stopping = threading.Event()
+        self._heartbeat = None
+
+    def _connect(self):
+        conn = sqlite3.connect(self.url_db_name, timeout=30.0, isolation_level=None, check_same_thread=False)
+        conn.execute("PRAGMA busy_timeout=30000")
+        return conn
+
+    def __iter__(self):
+        if self._heartbeat is None:
+            self._heartbeat = threading.Thread(target=self._renew, name="lease-heartbeat", daemon=True)
+            self._heartbeat.start()
+        with closing(self._connect()) as conn:
+            while True:
+                rows = self._claim(conn)
+                if rows:
+                    yield from rows
+                    continue
+                wait = self._wait_for_others(conn)
+                if wait is None:
+                    return
+                self.waits += 1
+                time.sleep(wait)
+
+    def _claim(self, conn):
+        now = time.time()
+        table = quote_identifier(self.url_table)
+        # BEGIN IMMEDIATE takes the write lock before reading, so the rows
+        # selected here cannot be claimed by another worker meanwhile
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            rows = conn.execute(f"SELECT lease_owner, {', '.join(self.columns)} FROM {table} "
+                                f"WHERE {eligible_where(now=now)} AND {LEASE_FREE_SQL.format(now=float(now))} "
+                                f"ORDER BY id LIMIT ?", (self.batch_size,)).fetchall()
+            conn.executemany(f"UPDATE {table} SET lease_owner = ?, lease_expires = ? WHERE id = ?",
+                             ((self.worker_id, now + self.lease_seconds, row[1]) for row in rows))
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        self.claims += 1
+        self.claimed += len(rows)
+        self.reclaimed += sum(1 for row in rows if row[0] is not None and row[0] != self.worker_id)
+        return [row[1:] for row in rows]
+
+    def _wait_for_others(self, conn):
+        """Seconds to wait for rows leased by other workers, or None when there are none."""
+        now = time.time()
+        count, first_expiry = conn.execute(
+            f"SELECT COUNT(*), MIN(lease_expires) FROM {quote_identifier(self.url_table)} "
+            f"WHERE processed = 0 AND lease_owner != ? AND lease_expires > ?", (self.worker_id, now)).fetchone()
+        if not count:
+            return None
+        return min(self.poll_interval, first_expiry - now + 0.01)
+
+    def _renew(self):
+        with closing(self._connect()) as conn:
+            while not self._stopping.wait(self.lease_seconds / 3):
+                try:
+                    conn.execute(f"UPDATE {quote_identifier(self.url_table)} SET lease_expires = ? "
+                                 f"WHERE lease_owner = ? AND processed = 0",
+                                 (time.time() + self.lease_seconds, self.worker_id))
+                except sqlite3.Error:
+                    continue  # The next heartbeat comes well before the leases expire
+
+    def close(self):
+        """Stop the heartbeat and release the rows still held, for other workers to claim at once.
+
+        Call it after the sinks are closed, so rows whose completion is
+        still queued are not released.
+        """
+        self._stopping.set()
+        if self._heartbeat is not None:
+            self._heartbeat.join()
+            self._heartbeat = None
+        with closing(self._connect()) as conn:
+            conn.execute(f"UPDATE {quote_identifier(self.url_table)} SET {LEASE_RELEASE_SQL} "
+                         f"WHERE lease_owner = ? AND processed = 0", (self.worker_id,))
+
+    def stats(self):
+        return {"worker": self.worker_id, "claims": self.claims, "claimed": self.claimed,
+                "reclaimed": self.reclaimed, "waits": self.waits}
+
+def retry_stats(url_db_name, url_table, now=None):
+    """Counts of URLs waiting for a retry and in the dead-letter table, by last error."""
+    now = now if now is not None else time.time()
+    table = quote_identifier(url_table)
+    with closing(sqlite3.connect(url_db_name, timeout=30.0)) as conn:
+        waiting = dict(conn.execute(f"SELECT last_error, COUNT(*) FROM {table} WHERE processed >= 0 "
+                                    f"AND next_attempt_at > ? GROUP BY last_error", (now,)).fetchall())
+        dead = dict(conn.execute(f"SELECT last_error, COUNT(*) FROM {quote_identifier(dead_table(url_table))} "
+                                 f"GROUP BY last_error").fetchall())
+    return {"waiting": waiting, "dead": dead}
+
+def lease_stats(url_db_name, url_table, now=None):
+    """{worker: {"live": n, "expired": n}} for the unprocessed URLs leased by each worker."""
+    now = now if now is not None else time.time()
+    with closing(sqlite3.connect(url_db_name, timeout=30.0)) as conn:
+        rows = conn.execute(f"SELECT lease_owner, SUM(lease_expires > ?), SUM(lease_expires <= ?) "
+                            f"FROM {quote_identifier(url_table)} WHERE processed = 0 AND lease_owner IS NOT NULL "
+                            f"GROUP BY lease_owner", (now, now)).fetchall()
+    return {worker: {"live": live, "expired": expired} for worker, live, expired in rows}
+
+def revive_dead(url_db_name, url_table, last_error=None):
+    """Give dead URLs (optionally only those whose last error starts with `last_error`) a fresh start."""
+    table, dead = quote_identifier(url_table), quote_identifier(dead_table(url_table))
+    where, params = ("WHERE last_error LIKE ?", (f"{last_error}%",)) if last_error else ("", ())
+    with closing(sqlite3.connect(url_db_name, timeout=30.0)) as conn:
+        with conn:
+            conn.execute(f"UPDATE {table} SET processed = 0, {RETRY_RESET_SQL} "
+                         f"WHERE id IN (SELECT id FROM {dead} {where})", params)
+            return conn.execute(f"DELETE FROM {dead} {where}", params).rowcount
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Inspect the retry schedule, dead-letter table and leases "
+                                                 "of a URL database.")
+    parser.add_argument("--db", default="Models.db")
+    parser.add_argument("--table", default="models_urls")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("retries", help="count URLs waiting for a retry and dead URLs, by last error")
+    commands.add_parser("leases", help="count URLs leased by each worker, live and expired")
+    dead_parser = commands.add_parser("dead", help="list dead-letter URLs")
+    dead_parser.add_argument("--limit", type=int, default=50)
+    revive_parser = commands.add_parser("revive", help="move dead URLs back into the crawl")
+    revive_parser.add_argument("--error", help="only URLs whose last error starts with this, e.g. http_status:404")
+    args = parser.parse_args()
+
+    if args.command == "retries":
+        stats = retry_stats(args.db, args.table)
+        for state in ("waiting", "dead"):
+            print(f"{state}: {sum(stats[state].values())}")
+            for error, count in sorted(stats[state].items(), key=lambda item: -item[1]):
+                print(f"    {count:8}  {error}")
+    elif args.command == "leases":
+        for worker, counts in sorted(lease_stats(args.db, args.table).items()):
+            print(f"{worker:30}  {counts['live']:8} live  {counts['expired']:8} expired")
+    elif args.command == "dead":
+        with closing(sqlite3.connect(args.db, timeout=30.0)) as conn:
+            for row_id, url, attempts, error, message in conn.execute(
+                    f"SELECT id, url, attempts, last_error, message FROM {quote_identifier(dead_table(args.table))} "
+                    f"ORDER BY dead_at DESC LIMIT ?", (args.limit,)):
+                print(f"{row_id:8}  {attempts:3} attempts  {error:20}  {url}  {message or ''}")
+    else:
+        print(f"Revived {revive_dead(args.db, args.table, args.error)} URLs")
@@ -0,0 +1,230 @@
+import argparse
+import hashlib
+import sqlite3
+from contextlib import closing
+
+import numpy as np
+
+from extractor import PRODUCTS_VERSION_COLUMN, canonical_specs
+from spec_store import iter_product_specs
+from sqlite_sink import quote_identifier
+
+# Groups of near-identical products (variants that differ in part number or
+# one or two specs), found with MinHash signatures over the "label=value"
+# pairs of each product and locality-sensitive hashing: each signature is cut
+# into BANDS bands, and only products whose band hashes collide are compared,
+# so building the groups is close to linear in the number of products instead
+# of comparing every pair. Signatures are kept in `product_variants`, so a
+# build only re-hashes rows whose RowVersion moved since the last build;
+# grouping loads every signature (512 bytes per product) into memory.
+VARIANTS_TABLE = "product_variants"
+VARIANTS_SCHEMA_SQL = (
+    f"""
+    CREATE TABLE IF NOT EXISTS {VARIANTS_TABLE} (
+        url TEXT PRIMARY KEY,
+        row_version INTEGER,
+        signature BLOB,
+        group_url TEXT
+    )
+    """,
+    f"CREATE INDEX IF NOT EXISTS idx_{VARIANTS_TABLE}_group_url ON {VARIANTS_TABLE} (group_url)",
+)
+
+# 16 bands of 8 rows: pairs above ~0.7 Jaccard similarity almost always share
+# a bucket, pairs below ~0.4 almost never do
+PERMUTATIONS = 128
+BANDS = 16
+ROWS_PER_BAND = PERMUTATIONS // BANDS
+# Candidates sharing a band are grouped if their estimated similarity reaches this
+THRESHOLD = 0.8
+# Columns of a products row that do not describe the product itself
+IGNORED_LABELS = {"id", "url", "images", "specs", "processed", "productname", "product_name", "part number",
+                  PRODUCTS_VERSION_COLUMN.lower(), "fingerprint"}
+
+MERSENNE_PRIME = (1 << 31) - 1
+_random = np.random.default_rng(20240601)
+_A = _random.integers(1, MERSENNE_PRIME, PERMUTATIONS, dtype=np.uint64)
+_B = _random.integers(0, MERSENNE_PRIME, PERMUTATIONS, dtype=np.uint64)
+_BAND_WEIGHTS = _random.integers(1, 1 << 63, ROWS_PER_BAND, dtype=np.uint64) | np.uint64(1)
+
+def spec_features(specs):
+    """The canonical "label=value" pairs a product is compared on."""
+    return {f"{label}={value}" for label, value in canonical_specs(specs).items() if label not in IGNORED_LABELS}
+
+def feature_hash(feature):
+    return int.from_bytes(hashlib.blake2b(feature.encode("utf-8"), digest_size=4).digest(), "big")
+
+def signatures(feature_sets):
+    """MinHash signatures (uint32 array, one row per set) of non-empty feature sets."""
+    lengths = [len(features) for features in feature_sets]
+    hashes = np.fromiter((feature_hash(feature) for features in feature_sets for feature in features),
+                         dtype=np.uint64, count=sum(lengths)) % np.uint64(MERSENNE_PRIME)
+    # (a * x + b) mod p for every permutation and feature, then the minimum per set
+    permuted = (np.outer(_A, hashes) + _B[:, None]) % np.uint64(MERSENNE_PRIME)
+    starts = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+    return np.minimum.reduceat(permuted, starts, axis=1).T.astype(np.uint32)
+
+def band_buckets(signature_rows):
+    """Hash of every band of every signature, shape (n, BANDS)."""
+    bands = signature_rows.reshape(len(signature_rows), BANDS, ROWS_PER_BAND).astype(np.uint64)
+    return (bands * _BAND_WEIGHTS).sum(axis=2, dtype=np.uint64)
+
+def table_columns(conn, table):
+    return {row[1].lower() for row in conn.execute(f"PRAGMA table_info({quote_identifier(table)})")}
+
+def update_signatures(conn, table):
+    """Re-hash rows changed since the last build; returns the number of rows hashed.
+
+    Tables without a RowVersion column (written before it was added) are re-hashed in full.
+    """
+    columns = table_columns(conn, table)
+    if "url" not in columns:
+        # products.py's table has no url, and `url` below would silently mean product_variants.url
+        raise ValueError(f"Table {table} has no url column to key on")
+    versioned = PRODUCTS_VERSION_COLUMN.lower() in columns
+    where, params = None, ()
+    if versioned:
+        last = conn.execute(f"SELECT MAX(row_version) FROM {VARIANTS_TABLE}").fetchone()[0]
+        if last is not None:
+            where, params = f"{PRODUCTS_VERSION_COLUMN} > ?", (last,)
+    # Forget products that no longer exist (NOT IN would match nothing once any url is NULL)
+    conn.execute(f"DELETE FROM {VARIANTS_TABLE} WHERE NOT EXISTS "
+                 f"(SELECT 1 FROM {quote_identifier(table)} AS product WHERE product.url = {VARIANTS_TABLE}.url)")
+
+    hashed = 0
+    for batch in iter_product_specs(conn, table, batch_size=500, where=where, params=params):
+        feature_sets = [spec_features(specs) for _, specs in batch]
+        blobs = [None] * len(batch)
+        hashable = [index for index, features in enumerate(feature_sets) if features]
+        if hashable:
+            rows = signatures([feature_sets[index] for index in hashable])
+            for position, index in enumerate(hashable):
+                blobs[index] = rows[position].tobytes()
+        conn.executemany(f"INSERT OR REPLACE INTO {VARIANTS_TABLE} (url, row_version, signature, group_url) "
+                         f"VALUES (?, ?, ?, ?)",
+                         [(url, specs.get(PRODUCTS_VERSION_COLUMN) if versioned else None, blob, url)
+                          for (url, specs), blob in zip(batch, blobs)])
+        hashed += len(batch)
+    return hashed
+
+def load_signatures(conn):
+    """Return (urls, signature matrix) of every hashed product, in url order."""
+    rows = conn.execute(f"SELECT url, signature FROM {VARIANTS_TABLE} "
+                        f"WHERE signature IS NOT NULL ORDER BY url").fetchall()
+    matrix = np.frombuffer(b"".join(blob for _, blob in rows), dtype=np.uint32).reshape(len(rows), PERMUTATIONS)
+    return [url for url, _ in rows], matrix
+
+def similar_pairs(matrix, threshold=THRESHOLD):
+    """Index pairs (a, b), a < b, of signatures that share a band and reach `threshold`.
+
+    Each product is compared with the first (lowest index) product of every
+    band bucket it falls in, so a family of variants costs one comparison
+    per member and band rather than one per pair.
+    """
+    needed = int(np.ceil(threshold * PERMUTATIONS))
+    pairs = []
+    for band, hashes in enumerate(band_buckets(matrix).T):
+        order = np.argsort(hashes, kind="stable")
+        ordered = hashes[order]
+        starts = np.flatnonzero(np.concatenate(([True], ordered[1:] != ordered[:-1])))
+        firsts = order[np.repeat(starts, np.diff(np.append(starts, len(order))))]
+        members = order != firsts
+        members[members] &= (matrix[order[members]] == matrix[firsts[members]]).sum(axis=1) >= needed
+        pairs.append(np.stack((firsts[members], order[members]), axis=1))
+    return np.unique(np.concatenate(pairs), axis=0) if pairs else np.empty((0, 2), dtype=np.int64)
+
+def regroup(conn, threshold=THRESHOLD):
+    """Recompute group_url for every product; returns the number of groups with 2+ products."""
+    urls, matrix = load_signatures(conn)
+    parent = list(range(len(urls)))
+
+    def find(index):
+        while parent[index] != index:
+            parent[index] = parent[parent[index]]
+            index = parent[index]
+        return index
+
+    for first, second in similar_pairs(matrix, threshold).tolist():
+        first, second = find(first), find(second)
+        if first != second:
+            # Urls are sorted, so the lowest index is the group's smallest url
+            parent[max(first, second)] = min(first, second)
+    groups = [(urls[find(index)], url) for index, url in enumerate(urls)]
+    conn.execute("CREATE TEMP TABLE new_groups (url TEXT PRIMARY KEY, group_url TEXT)")
+    try:
+        conn.executemany("INSERT INTO new_groups (group_url, url) VALUES (?, ?)", groups)
+        conn.execute(f"""
+            UPDATE {VARIANTS_TABLE} SET group_url = COALESCE(
+                (SELECT group_url FROM new_groups WHERE new_groups.url = {VARIANTS_TABLE}.url), url)
+            WHERE group_url IS NOT COALESCE(
+                (SELECT group_url FROM new_groups WHERE new_groups.url = {VARIANTS_TABLE}.url), url)
+        """)
+    finally:
+        conn.execute("DROP TABLE new_groups")
+    return len({group_url for group_url, url in groups if group_url != url})
+
+def build(db_name, table="products", threshold=THRESHOLD):
+    """Bring the variant index of `table` up to date; returns (rows hashed, groups)."""
+    with closing(sqlite3.connect(db_name, timeout=30.0)) as conn:
+        for statement in VARIANTS_SCHEMA_SQL:
+            conn.execute(statement)
+        with conn:
+            hashed = update_signatures(conn, table)
+            groups = regroup(conn, threshold)
+        return hashed, groups
+
+def variant_groups(db_name, min_size=2, limit=None):
+    """Return [(group_url, [urls])] of the groups with at least `min_size` products, largest first."""
+    sql = f"""
+        SELECT group_url, group_concat(url, char(10)) FROM {VARIANTS_TABLE}
+        GROUP BY group_url HAVING COUNT(*) >= ? ORDER BY COUNT(*) DESC, group_url
+    """
+    if limit:
+        sql += f" LIMIT {int(limit)}"
+    with closing(sqlite3.connect(db_name, timeout=30.0)) as conn:
+        return [(group_url, sorted(urls.split("\n"))) for group_url, urls in conn.execute(sql, (min_size,))]
+
+def similar_products(db_name, url, threshold=0.5):
+    """Return [(url, estimated similarity)] of the products most like `url`, most similar first."""
+    with closing(sqlite3.connect(db_name, timeout=30.0)) as conn:
+        row = conn.execute(f"SELECT signature FROM {VARIANTS_TABLE} WHERE url = ?", (url,)).fetchone()
+        if row is None or row[0] is None:
+            return []
+        urls, matrix = load_signatures(conn)
+    scores = (matrix == np.frombuffer(row[0], dtype=np.uint32)).sum(axis=1) / PERMUTATIONS
+    found = [(other, float(score)) for other, score in zip(urls, scores) if score >= threshold and other != url]
+    return sorted(found, key=lambda item: (-item[1], item[0]))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Group near-identical product variants with MinHash/LSH.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    build_parser = commands.add_parser("build", help="hash changed products and recompute the groups")
+    build_parser.add_argument("--db", default="products.db")
+    build_parser.add_argument("--table", default="products")
+    build_parser.add_argument("--threshold", type=float, default=THRESHOLD,
+                              help="estimated spec similarity needed to group two products")
+
+    groups_parser = commands.add_parser("groups", help="list variant groups, largest first")
+    groups_parser.add_argument("--db", default="products.db")
+    groups_parser.add_argument("--min-size", type=int, default=2)
+    groups_parser.add_argument("--limit", type=int, default=50)
+
+    similar_parser = commands.add_parser("similar", help="list the products most similar to one URL")
+    similar_parser.add_argument("url")
+    similar_parser.add_argument("--db", default="products.db")
+    similar_parser.add_argument("--threshold", type=float, default=0.5)
+    args = parser.parse_args()
+
+    if args.command == "build":
+        hashed, groups = build(args.db, args.table, args.threshold)
+        print(f"Hashed {hashed} changed products; {groups} variant groups in {args.db}")
+    elif args.command == "groups":
+        for group_url, urls in variant_groups(args.db, args.min_size, args.limit):
+            print(f"{len(urls):5d}  {group_url}")
+            for url in urls:
+                if url != group_url:
+                    print(f"       {url}")
+    else:
+        for url, score in similar_products(args.db, args.url, args.threshold):
+            print(f"{score:5.2f}  {url}")